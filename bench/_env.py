@@ -0,0 +1,124 @@
+# coding=utf-8
+"""
+Makes plexnet and lib.templating importable outside of Kodi, for the benchmarks in this directory.
+
+Only what the benchmarked code touches is provided: the Kodi modules and the few lib modules plexnet and the
+templating engine import are replaced by minimal stand-ins. Pass --tree to a benchmark to run it against another
+checkout (e.g. a `git worktree` of an older revision) and compare.
+"""
+import os
+import sys
+import types
+import argparse
+import tempfile
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(description, **extra):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--tree", default=ROOT, help="addon checkout to benchmark (default: this one)")
+    for name, kwargs in extra.items():
+        parser.add_argument("--" + name.replace("_", "-"), **kwargs)
+    return parser.parse_args()
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _log(*args, **kwargs):
+    pass
+
+
+class _Addon(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def getSetting(self, key):
+        return ""
+
+    def setSetting(self, key, value):
+        pass
+
+    def getAddonInfo(self, key):
+        return "1.0.0"
+
+
+class _Settings(object):
+    # every advanced setting enabled, the way the optimized paths run in the addon
+    def __getattr__(self, attr):
+        return True
+
+
+class _Interface(object):
+    def getPreference(self, *args, **kwargs):
+        return []
+
+    def getGlobal(self, *args, **kwargs):
+        return None
+
+    def getRegistry(self, *args, **kwargs):
+        return None
+
+    def setRegistry(self, *args, **kwargs):
+        pass
+
+    LOG = DEBUG_LOG = WARN_LOG = ERROR_LOG = _log
+
+
+def _kodi():
+    xbmc = _module("kodi_six.xbmc", LOGINFO=1, LOGDEBUG=0, LOGERROR=4, log=_log, sleep=_log)
+    _module("kodi_six", xbmc=xbmc, xbmcaddon=_module("kodi_six.xbmcaddon", Addon=_Addon),
+            xbmcgui=_module("kodi_six.xbmcgui"), xbmcvfs=_module("kodi_six.xbmcvfs", exists=os.path.exists))
+
+
+def _lib(tree):
+    sys.path[:0] = [tree, os.path.join(tree, "lib", "_included_packages")]
+    lib = _module("lib")
+    lib.__path__ = [os.path.join(tree, "lib")]
+    return lib
+
+
+def plexnet(tree=ROOT):
+    """
+    Stand-ins for the Kodi side of plexnet; returns the plexnet package
+    """
+    _kodi()
+    _lib(tree)
+    _module("lib.util", addonSettings=_Settings(), KODI_VERSION_MAJOR=21, T=lambda string_id, default="": default,
+            shortDF=lambda *args, **kwargs: "", durationToShortText=lambda *args, **kwargs: "")
+    _module("lib.i18n", T=lambda string_id, default="": default)
+    _module("lib.path_mapping", pmm=None, norm_sep=lambda s: "\\" in s and "\\" or "/")
+    _module("lib.exceptions", NoDataException=type("NoDataException", (Exception,), {}))
+    _module("lib.data_cache", dcm=None)
+    _module("lib.cache", CACHE_SIZE=20)
+
+    from plexnet import util
+    util.setInterface(_Interface())
+    import plexnet
+    return plexnet
+
+
+def templating(tree=ROOT, profile=None):
+    """
+    Stand-ins for the Kodi side of lib.templating; returns (engine, template context, skin directory)
+    """
+    _kodi()
+    _lib(tree)
+    profile = profile or tempfile.mkdtemp(prefix="bench_profile_")
+    _module("lib.util", PROFILE=profile, DEF_THEME="modern", ADDON=_Addon(), getSetting=lambda key, default=None: default,
+            translatePath=lambda path: path, THEME_VERSION=1, setSetting=_log, DEBUG_LOG=_log, LOG=_log,
+            T=lambda *args: "", MONITOR=None, xbmcvfs=None, addonSettings=_Settings(), DISPLAY_RESOLUTION=(1920, 1080),
+            NEEDS_SCALING=False)
+    _module("lib.logging", log=_log, log_error=_log)
+    _module("lib.windows")
+    _module("lib.windows.busy", ProgressDialog=None)
+
+    from lib.templating.core import engine
+    from lib.templating.context import TEMPLATE_CONTEXTS
+    return engine, TEMPLATE_CONTEXTS, os.path.join(tree, "resources", "skins", "Main", "1080i")
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Time to build the items of an episode list and read what a list view shows of them, and to later access all of
+their streams (opening an item).
+
+    python bench/episode_list_build.py [--items 1000] [--runs 7] [--tree OTHER_CHECKOUT]
+
+Every episode has one Media with one Part and six Streams (video, two audio, three subtitle).
+"""
+import gc
+import time
+
+from xml.etree import ElementTree
+
+import _env
+
+
+def response(count):
+    root = ElementTree.Element("MediaContainer", size=str(count))
+    for i in range(count):
+        video = ElementTree.SubElement(
+            root, "Video", ratingKey=str(i), key="/library/metadata/{0}".format(i), type="episode",
+            title="Episode {0}".format(i), index=str(i % 20 + 1), parentIndex="1", thumb="/t/{0}".format(i),
+            duration="2700000", viewCount="0", grandparentTitle="Show", parentRatingKey="9")
+        media = ElementTree.SubElement(
+            video, "Media", id=str(i), duration="2700000", bitrate="8000", width="1920", height="1080",
+            videoResolution="1080", videoCodec="h264", audioCodec="eac3", audioChannels="6", container="mkv",
+            videoFrameRate="24p")
+        part = ElementTree.SubElement(
+            media, "Part", id=str(i), key="/library/parts/{0}/file.mkv".format(i), duration="2700000",
+            file="/media/show/s01e{0:02d}.mkv".format(i), size="1500000000", container="mkv", indexes="sd")
+        ElementTree.SubElement(part, "Stream", id=str(i * 10), streamType="1", codec="h264", index="0",
+                               bitrate="7000", height="1080", width="1920", selected="1")
+        for j, lang in enumerate(("eng", "ger")):
+            ElementTree.SubElement(part, "Stream", id=str(i * 10 + 1 + j), streamType="2", codec="eac3",
+                                   index=str(1 + j), channels="6", language=lang, languageCode=lang,
+                                   selected=j == 0 and "1" or "0")
+        for j, lang in enumerate(("eng", "ger", "fre")):
+            ElementTree.SubElement(part, "Stream", id=str(i * 10 + 3 + j), streamType="3", codec="srt",
+                                   index=str(3 + j), language=lang, languageCode=lang)
+    return root
+
+
+class Server(object):
+    uuid = "bench"
+
+    def buildUrl(self, *args, **kwargs):
+        return ""
+
+
+def main():
+    args = _env.parse_args(__doc__, items=dict(type=int, default=1000), runs=dict(type=int, default=7))
+    _env.plexnet(args.tree)
+    from plexnet import plexobjects
+    # registers the video types with plexobjects
+    from plexnet import video  # noqa: F401
+
+    root = response(args.items)
+    server = Server()
+
+    def build():
+        items = plexobjects.listItems(server, "/library/metadata/9/children", data=root,
+                                      container=plexobjects.PlexContainer(root, "/x", server, "/x"))
+        rows = []
+        for ep in items:
+            medias = ep.media()
+            rows.append((ep.title, ep.thumb, ep.index, ep.parentIndex, ep.duration.asInt(), ep.isWatched,
+                         ep.available(), len([m for m in medias if m.isAccessible()]) > 1,
+                         medias[0].videoResolution, medias[0].audioCodec))
+        return items
+
+    assert len(build()) == args.items
+    times = []
+    for run in range(args.runs):
+        gc.collect()
+        start = time.perf_counter()
+        items = build()
+        times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for ep in items:
+        for stream in ep.media[0].parts[0].streams:
+            stream.streamType
+    streams = time.perf_counter() - start
+
+    times.sort()
+    print("{0} episodes: list build best {1:.1f} ms, median {2:.1f} ms; accessing all streams afterwards {3:.1f} ms"
+          .format(args.items, times[0] * 1000, times[len(times) // 2] * 1000, streams * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# coding=utf-8
+"""
+Memory and build time of PlexObjects built from a synthetic /library/sections/X/all response.
+
+    python bench/plexobject_memory.py [--items 50000] [--tree OTHER_CHECKOUT]
+
+Reports the traced memory after building all items and after reading the attributes a list view uses, and the
+untraced build time.
+"""
+import gc
+import time
+import tracemalloc
+
+from xml.etree import ElementTree
+
+import _env
+
+
+ATTRIBUTES = dict(
+    ratingKey="1", key="/library/metadata/1", guid="plex://movie/x", studio="Studio", type="movie", title="Title",
+    contentRating="PG", summary="x" * 300, rating="7.1", audienceRating="8.0", year="2001", tagline="Tagline",
+    thumb="/library/metadata/1/thumb/1", art="/library/metadata/1/art/1", duration="7200000",
+    originallyAvailableAt="2001-01-01", addedAt="1600000000", updatedAt="1600000000", viewCount="1",
+    lastViewedAt="1600000000", audienceRatingImage="rottentomatoes://image.rating.upright",
+    ratingImage="rottentomatoes://image.rating.ripe", primaryExtraKey="/library/metadata/2", titleSort="Title")
+
+
+def response(count):
+    root = ElementTree.Element("MediaContainer", size=str(count))
+    for i in range(count):
+        attrs = dict(ATTRIBUTES, ratingKey=str(i), key="/library/metadata/{0}".format(i), title="Title {0}".format(i))
+        ElementTree.SubElement(root, "Video", attrs)
+    return root
+
+
+def main():
+    args = _env.parse_args(__doc__, items=dict(type=int, default=50000))
+    _env.plexnet(args.tree)
+    from plexnet import plexobjects
+
+    class Movie(plexobjects.PlexObject):
+        TYPE = "movie"
+
+    root = response(args.items)
+
+    def build():
+        return [Movie(elem, initpath="/library/sections/1/all") for elem in root]
+
+    gc.collect()
+    start = time.perf_counter()
+    items = build()
+    build_time = time.perf_counter() - start
+    del items
+
+    gc.collect()
+    tracemalloc.start()
+    items = build()
+    built, _ = tracemalloc.get_traced_memory()
+    for item in items:
+        item.title, item.thumb, item.year, item.viewCount
+    accessed, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("{0} items: build {1:.2f}s, {2:.1f} MB after build, {3:.1f} MB after reading title/thumb/year/viewCount"
+          .format(args.items, build_time, built / 1e6, accessed / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""
+Tree-walking ibis templates vs. templates compiled to Python code (ibis.codegen), for a full render of all skin
+templates in one process.
+
+    python bench/template_codegen.py [--runs 5] [--tree OTHER_CHECKOUT]
+
+- tree walker: no code cache, every template is lexed, parsed and rendered by walking its node tree
+- first render: empty code cache; renders with the tree walker, the code is generated afterwards in the background
+  (timed separately)
+- cached code: the code of every template is loaded from the cache
+- render only: templates already loaded, as on a re-render within the same session
+
+The outputs of both renderers are compared first.
+"""
+import os
+import copy
+import time
+import shutil
+import filecmp
+import tempfile
+
+import _env
+
+
+def main():
+    args = _env.parse_args(__doc__, runs=dict(type=int, default=5))
+    engine, contexts, skin_dir = _env.templating(args.tree)
+    from lib.templating.util import deep_update
+
+    work = tempfile.mkdtemp(prefix="bench_codegen_")
+    cache_dir = os.path.join(work, "template_cache")
+    engine.init(os.path.join(work, "out"), os.path.join(skin_dir, "templates"), os.path.join(work, "custom"))
+    engine.debug_log = lambda *args: None
+
+    def render(target, code, fresh=True):
+        shutil.rmtree(target, ignore_errors=True)
+        os.makedirs(target)
+        engine.target_dir = target
+        engine.manifest = None
+        if fresh:
+            engine.prepare_loader(engine.loader.base_dirs)
+            engine.loader.cache_dir = code and cache_dir or None
+        engine.context = copy.deepcopy(contexts)
+        deep_update(engine.context, {
+            "core": {"resolution": (1920, 1080), "needs_scaling": False},
+            "indicators": {"START": {"INHERIT": "modern_2024", "style": "modern_2024", "hide_aw_bg": False,
+                                     "use_scaling": True}}})
+        start = time.perf_counter()
+        engine.apply("modern", engine.get_jobs("modern"), engine.prepare("modern"), lambda *args: None)
+        elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if engine.codegen:
+            engine.codegen.join()
+        return elapsed, time.perf_counter() - start
+
+    def best(func):
+        return min(func() for run in range(args.runs))
+
+    def cold():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        return render(os.path.join(work, "code"), True)
+
+    tree_dir, code_dir = os.path.join(work, "tree"), os.path.join(work, "code")
+    render(tree_dir, False)
+    cold()
+    render(code_dir, True)
+    names = [fn for fn in os.listdir(tree_dir) if fn.endswith(".xml")]
+    match, mismatch, errors = filecmp.cmpfiles(tree_dir, code_dir, names, shallow=False)
+    compiled = sum(template.__class__.__name__ == "CompiledTemplate" for digest, template in
+                   engine.loader.cache.values())
+    print("{0} outputs identical, differing: {1}; {2} of {3} templates compiled to code".format(
+        len(match), mismatch + errors, compiled, len(engine.loader.cache)))
+
+    print("tree walker: {0:.0f} ms".format(best(lambda: render(tree_dir, False)[0]) * 1000))
+    first = min(cold() for run in range(args.runs))
+    print("first render: {0:.0f} ms, then {1:.0f} ms generating code in the background".format(
+        first[0] * 1000, first[1] * 1000))
+    print("cached code: {0:.0f} ms".format(best(lambda: render(code_dir, True)[0]) * 1000))
+    render(tree_dir, False)
+    print("render only, tree walker: {0:.0f} ms".format(best(lambda: render(tree_dir, False, False)[0]) * 1000))
+    render(code_dir, True)
+    print("render only, code: {0:.0f} ms".format(best(lambda: render(code_dir, True, False)[0]) * 1000))
+
+    shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
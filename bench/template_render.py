@@ -0,0 +1,66 @@
+# coding=utf-8
+"""
+Time to render all skin templates, the way the addon does after a theme or setting change, with one and with several
+worker processes.
+
+    python bench/template_render.py [--workers 1,2,4] [--runs 5] [--tree OTHER_CHECKOUT]
+
+Every run starts with an empty target directory and a fresh template loader, so it includes loading (or compiling)
+the templates and, with more than one worker, forking the pool. Parallel rendering only pays off with as many free
+cores as workers; the number of cores found is printed along with the results.
+"""
+import os
+import copy
+import time
+import shutil
+import inspect
+import tempfile
+
+import _env
+
+
+def main():
+    args = _env.parse_args(__doc__, workers=dict(default="1,2,4"), runs=dict(type=int, default=5))
+    engine, contexts, skin_dir = _env.templating(args.tree)
+    from lib.templating.util import deep_update
+
+    target = tempfile.mkdtemp(prefix="bench_skin_")
+    engine.init(target, os.path.join(skin_dir, "templates"), os.path.join(target, "custom"))
+    engine.debug_log = lambda *args: None
+    parallel = "workers" in inspect.signature(engine.apply).parameters
+
+    def render(workers):
+        shutil.rmtree(target)
+        os.makedirs(target)
+        engine.manifest = None
+        engine.prepare_loader(engine.loader.base_dirs)
+        engine.context = copy.deepcopy(contexts)
+        deep_update(engine.context, {
+            "core": {"resolution": (1920, 1080), "needs_scaling": False},
+            "indicators": {"START": {"INHERIT": "modern_2024", "style": "modern_2024", "hide_aw_bg": False,
+                                     "use_scaling": True}}})
+        start = time.perf_counter()
+        template_context = engine.prepare("modern")
+        jobs = engine.get_jobs("modern")
+        kwargs = parallel and {"workers": workers} or {}
+        engine.apply("modern", jobs, template_context, lambda *args: None, **kwargs)
+        return time.perf_counter() - start, len(jobs)
+
+    print("{0} cores".format(os.cpu_count()))
+    for workers in [int(w) for w in args.workers.split(",")]:
+        if workers > 1 and not parallel:
+            print("{0} workers: not supported by this tree".format(workers))
+            continue
+        times = []
+        for run in range(args.runs):
+            elapsed, count = render(workers)
+            times.append(elapsed)
+        times.sort()
+        print("{0} workers: {1} templates, best {2:.0f} ms, median {3:.0f} ms".format(
+            workers, count, times[0] * 1000, times[len(times) // 2] * 1000))
+
+    shutil.rmtree(target, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
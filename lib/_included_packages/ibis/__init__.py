@@ -5,6 +5,7 @@ from . import errors
 from . import compiler
 
 from .template import Template
+from . import codegen
 
 
 # Library version.
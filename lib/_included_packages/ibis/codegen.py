@@ -0,0 +1,524 @@
+# coding=utf-8
+
+import ast
+import bisect
+import itertools
+import marshal
+
+from importlib.util import MAGIC_NUMBER
+
+import ibis
+
+from . import compiler
+from . import errors
+from . import filters
+from . import nodes
+from .context import Context
+
+
+# Code generation backend. Instead of walking a template's node tree on every render, the tree is translated into
+# the source of a Python module with one function for the template body and one per block:
+#
+#     code = ibis.codegen.compile_template(template_string, template_id)
+#     template = ibis.codegen.CompiledTemplate(code, template_id)
+#
+# CompiledTemplates behave like Templates and can extend, include and be included by them. The code object can be
+# serialized with dumps() and restored with loads(), which skips lexing and parsing the template altogether.
+
+
+# Bump when the generated code changes, so cached code objects are regenerated.
+VERSION = 1
+
+HEADER = MAGIC_NUMBER + b"ibis" + VERSION.to_bytes(2, "little")
+
+
+class Unsupported(Exception):
+    pass
+
+
+# IfNode operator functions and their Python equivalents.
+CONDITION_OPERATORS = dict((func, op) for op, func in nodes.IfNode.operators.items())
+
+
+class CodeGenerator:
+
+    def __init__(self, template_id):
+        self.template_id = template_id
+        self.lines = []
+        self.depth = 0
+        self.writer = "_w"
+        self.tokens = []
+        self.token_index = {}
+        self.line_tokens = {}
+        self.fallbacks = []
+        self.counter = itertools.count()
+
+    def generate(self, root):
+        extends = None
+        if root.children and isinstance(root.children[0], nodes.ExtendsNode):
+            extends = root.children[0].parent_name
+
+        self.function("render", root.children)
+
+        # last one wins, like Template._register_blocks
+        blocks = {}
+        self.collect_blocks(root, blocks)
+        block_functions = {}
+        for index, (title, node) in enumerate(blocks.items()):
+            block_functions[title] = "_block_{}".format(index)
+            self.function(block_functions[title], node.children)
+
+        self.emit("BLOCKS = {{{}}}".format(", ".join("{!r}: {}".format(title, name)
+                                                    for title, name in block_functions.items())))
+        self.emit("EXTENDS = {!r}".format(extends))
+        self.emit("TOKENS = {!r}".format(tuple(self.tokens)))
+        self.emit("FALLBACKS = {!r}".format(tuple(self.fallbacks)))
+        self.emit("LINES = {!r}".format(tuple(sorted(self.line_tokens.items()))))
+        return "\n".join(self.lines) + "\n"
+
+    def collect_blocks(self, node, blocks):
+        if isinstance(node, nodes.BlockNode):
+            blocks[node.title] = node
+        for child in node.children:
+            self.collect_blocks(child, blocks)
+
+    def emit(self, line, token=None):
+        self.lines.append("    " * self.depth + line)
+        if token is not None:
+            self.line_tokens[len(self.lines)] = self.token(token)
+
+    def token(self, token):
+        key = id(token)
+        if key not in self.token_index:
+            self.token_index[key] = len(self.tokens)
+            self.tokens.append((token.type, token.text, token.line_number))
+        return self.token_index[key]
+
+    def function(self, name, children):
+        self.emit("def {}(context):".format(name))
+        self.depth += 1
+        self.emit("_o = []")
+        self.emit("_w = _o.append")
+        self.children(children)
+        self.emit("return ''.join(_o)")
+        self.depth -= 1
+        self.emit("")
+
+    def body(self, children):
+        # an indented block that may turn out empty
+        self.depth += 1
+        count = len(self.lines)
+        self.children(children)
+        if len(self.lines) == count:
+            self.emit("pass")
+        self.depth -= 1
+
+    def children(self, children):
+        for node in children:
+            handler = self.handlers.get(type(node))
+            if not handler:
+                raise Unsupported("Unsupported node type: {}".format(type(node).__name__))
+            handler(self, node)
+
+    def buffered(self, children):
+        """
+        Renders children into a separate buffer and returns the name of the list holding their output
+        """
+        index = next(self.counter)
+        self.emit("_o{0} = []".format(index))
+        self.emit("_w{0} = _o{0}.append".format(index))
+        writer, self.writer = self.writer, "_w{}".format(index)
+        self.children(children)
+        self.writer = writer
+        return "_o{}".format(index)
+
+    # expressions
+
+    def literal(self, value):
+        code = repr(value)
+        try:
+            restored = ast.literal_eval(code)
+        except Exception:
+            raise Unsupported("Unsupported literal: {}".format(code))
+        if type(restored) is not type(value) or restored != value:
+            raise Unsupported("Unsupported literal: {}".format(code))
+        return code
+
+    def expr(self, expr):
+        token = self.token(expr.token)
+        try:
+            return self._expr(expr, token)
+        except Unsupported:
+            # e.g. math with variables; parse it from its source when the template is loaded
+            self.fallbacks.append((expr.source, token))
+            return "_X[{}].eval(context)".format(len(self.fallbacks) - 1)
+
+    def _expr(self, expr, token):
+        if expr.is_literal and not expr.dyn_args:
+            code = self.literal(expr.literal)
+        elif isinstance(expr.varstring, str):
+            code = "context.resolve({!r}, _T[{}])".format(str(expr.varstring), token)
+            if expr.is_func_call:
+                code = "_call(context, {}, {!r}, {}, {}, _T[{}])".format(code, str(expr.varstring),
+                                                                         self.args(expr.func_args, token),
+                                                                         self.kwargs(expr.func_kwargs, token), token)
+        else:
+            raise Unsupported("Unsupported expression")
+
+        for name, func, args, kwargs, _ in expr.filters:
+            code = "_filter(context, {!r}, {}, {}, {}, _T[{}])".format(name, code, self.args(args, token),
+                                                                       self.kwargs(kwargs, token), token)
+        return code
+
+    def arg(self, arg, token):
+        if isinstance(arg, nodes.ContextVariable):
+            return "context.resolve({!r}, _T[{}])".format(str(arg), token)
+        elif isinstance(arg, nodes.Expression):
+            return self.expr(arg)
+        return self.literal(arg)
+
+    def args(self, args, token):
+        return "[{}]".format(", ".join(self.arg(arg, token) for arg in args))
+
+    def kwargs(self, kwargs, token):
+        return "{{{}}}".format(", ".join("{!r}: {}".format(name, self.arg(value, token))
+                                         for name, value in kwargs.items()))
+
+    def condition(self, node):
+        groups = []
+        for condition_group in node.condition_groups:
+            conditions = []
+            for condition in condition_group:
+                if condition.op:
+                    code = "({} {} {})".format(self.expr(condition.lhs), CONDITION_OPERATORS[condition.op],
+                                               self.expr(condition.rhs))
+                else:
+                    code = "({})".format(self.expr(condition.lhs))
+                conditions.append("not " + code if condition.negated else code)
+            groups.append("({})".format(" and ".join(conditions)))
+        return " or ".join(groups)
+
+    # nodes
+
+    def node(self, node):
+        self.children(node.children)
+
+    def nothing(self, node):
+        pass
+
+    def text(self, node):
+        self.emit("{}({!r})".format(self.writer, node.token.text))
+
+    def print_(self, node):
+        if node.is_ternary:
+            self.emit("if {}:".format(self.expr(node.test_expr)), node.token)
+            self.depth += 1
+            self.emit("_v = {}".format(self.expr(node.true_branch_expr)), node.token)
+            self.depth -= 1
+            self.emit("else:")
+            self.depth += 1
+            self.emit("_v = {}".format(self.expr(node.false_branch_expr)), node.token)
+            self.depth -= 1
+        else:
+            self.emit("_v = {}".format(self.expr(node.exprs[0])), node.token)
+            for expr in node.exprs[1:]:
+                self.emit("if not _v: _v = {}".format(self.expr(expr)), node.token)
+
+        if node.token.type == "EPRINT":
+            self.emit("{}(_escape(str(_v)))".format(self.writer), node.token)
+        else:
+            self.emit("{}(str(_v))".format(self.writer), node.token)
+
+    def for_(self, node):
+        index = next(self.counter)
+        names = dict(c="_c{}".format(index), n="_n{}".format(index), i="_i{}".format(index),
+                     item="_it{}".format(index), token=self.token(node.token))
+        self.emit("{c} = {expr}".format(expr=self.expr(node.expr), **names), node.token)
+        self.emit("if {c} and hasattr({c}, '__iter__'):".format(**names), node.token)
+        self.depth += 1
+        self.emit("{c} = list({c})".format(**names))
+        self.emit("{n} = len({c})".format(**names))
+        self.emit("for {i}, {item} in enumerate({c}):".format(**names))
+        self.depth += 1
+        self.emit("context.push()")
+        if len(node.loopvars) > 1:
+            self.emit("context.update(_unpack({vars!r}, {item}, _T[{token}]))".format(vars=node.loopvars, **names),
+                      node.token)
+        else:
+            self.emit("context[{var!r}] = {item}".format(var=node.loopvars[0], **names))
+        self.emit("context['loop'] = {{'index': {i}, 'count': {i} + 1, 'length': {n}, 'is_first': {i} == 0, "
+                  "'is_last': {i} == {n} - 1, 'parent': context.get('loop')}}".format(**names))
+        self.children(node.for_branch.children)
+        self.emit("context.pop()")
+        self.depth -= 2
+        self.emit("else:")
+        self.body(node.empty_branch.children)
+
+    def if_(self, node, keyword="if"):
+        self.emit("{} {}:".format(keyword, self.condition(node)), node.token)
+        self.body(node.true_branch.children)
+        if isinstance(node.false_branch, nodes.IfNode):
+            self.if_(node.false_branch, "elif")
+        elif node.false_branch.children:
+            self.emit("else:")
+            self.body(node.false_branch.children)
+
+    def cycle(self, node):
+        key = repr(("cycle", self.template_id, next(self.counter)))
+        self.emit("if {} not in context.stash:".format(key), node.token)
+        self.depth += 1
+        self.emit("context.stash[{}] = _cycle({})".format(key, self.expr(node.expr)), node.token)
+        self.depth -= 1
+        self.emit("{}(str(next(context.stash[{}], '')))".format(self.writer, key), node.token)
+
+    def include(self, node):
+        self.emit("_t = _include({}, {!r}, _T[{}])".format(self.expr(node.template_expr), node.template_arg,
+                                                          self.token(node.token)), node.token)
+        self.emit("context.push()")
+        for name, expr in node.variables.items():
+            self.emit("context[{!r}] = {}".format(name, self.expr(expr)), node.token)
+        self.emit("{}(_t.root_node.render(context))".format(self.writer), node.token)
+        self.emit("context.pop()")
+
+    def block(self, node):
+        self.emit("{}(_block(context, {!r}))".format(self.writer, node.title), node.token)
+
+    def spaceless(self, node):
+        output = self.buffered(node.children)
+        self.emit("{}(_spaceless(''.join({})).strip())".format(self.writer, output))
+
+    def trim(self, node):
+        output = self.buffered(node.children)
+        self.emit("{}(''.join({}).strip())".format(self.writer, output))
+
+    def with_(self, node):
+        self.emit("context.push()")
+        for name, expr in node.variables.items():
+            self.emit("context[{!r}] = {}".format(name, self.expr(expr)), node.token)
+        self.children(node.children)
+        self.emit("context.pop()")
+
+    handlers = {
+        nodes.Node: node,
+        nodes.TextNode: text,
+        nodes.PrintNode: print_,
+        nodes.ForNode: for_,
+        nodes.IfNode: if_,
+        nodes.CycleNode: cycle,
+        nodes.IncludeNode: include,
+        nodes.ExtendsNode: nothing,
+        nodes.BlockNode: block,
+        nodes.SpacelessNode: spaceless,
+        nodes.TrimNode: trim,
+        nodes.WithNode: with_,
+        # delimiters, consumed by their parent's exit_scope
+        nodes.EmptyNode: nothing,
+        nodes.ElifNode: nothing,
+        nodes.ElseNode: nothing,
+    }
+
+
+def filename(template_id):
+    return "<ibis:{}>".format(template_id)
+
+
+# Compiles a template string into a code object. Raises Unsupported (or SyntaxError/RecursionError for pathological
+# nesting) if the template can't be translated; use a regular Template then.
+def compile_template(template_string, template_id):
+    root = compiler.compile(template_string, template_id)
+    source = CodeGenerator(template_id).generate(root)
+    return compile(source, filename(template_id), "exec")
+
+
+def dumps(code):
+    return HEADER + marshal.dumps(code)
+
+
+# Returns the code object serialized by dumps(), or None if it was created by another Python or ibis version.
+def loads(data):
+    if not data.startswith(HEADER):
+        return None
+    return marshal.loads(data[len(HEADER):])
+
+
+# Runtime helpers used by the generated code. They mirror Expression and the node classes' wrender methods.
+
+def _call(context, obj, name, args, kwargs, token):
+    try:
+        if getattr(obj, "with_context", False):
+            kwargs["context"] = context
+        obj = obj(*args, **kwargs)
+
+        # see Expression._resolve_variable
+        if isinstance(obj, nodes.ResolveContextVariable):
+            value = context.resolve(obj, token)
+            obj = context.resolve(value, token)
+    except Exception as err:
+        msg = "Error calling function '{}'.".format(name)
+        errors.raise_(errors.TemplateRenderingError(msg, token), err)
+    return obj
+
+
+def _filter(context, name, obj, args, kwargs, token):
+    func = filters.filtermap[name]
+    try:
+        if getattr(func, "with_context", False):
+            kwargs["context"] = context
+        return func(obj, *args, **kwargs)
+    except Exception as err:
+        msg = "Error applying filter '{}'.".format(name)
+        errors.raise_(errors.TemplateRenderingError(msg, token), err)
+
+
+def _unpack(loopvars, item, token):
+    try:
+        return dict(zip(loopvars, item))
+    except Exception as err:
+        errors.raise_(errors.TemplateRenderingError("Unpacking error.", token), err)
+
+
+def _cycle(items):
+    if not hasattr(items, '__iter__'):
+        items = ''
+    return itertools.cycle(items)
+
+
+def _include(template_name, template_arg, token):
+    if not isinstance(template_name, str):
+        msg = "Invalid argument for the 'include' tag. "
+        msg += "The variable '{}' should evaluate to a string. ".format(template_arg)
+        msg += "This variable has the value: {}.".format(repr(template_name))
+        raise errors.TemplateRenderingError(msg, token)
+
+    if not ibis.loader:
+        msg = "No template loader has been specified. "
+        msg += "A template loader is required by the 'include' tag in "
+        msg += "template '{template_id}', line {line_number}.".format(template_id=token.template_id,
+                                                                      line_number=token.line_number)
+        raise errors.TemplateLoadError(msg)
+    return ibis.loader(template_name)
+
+
+def _block(context, title):
+    block_list = []
+    for template in context.templates:
+        block = template.blocks.get(title)
+        if block:
+            block_list.append(block)
+    return _render_block(context, block_list)
+
+
+def _render_block(context, block_list):
+    if block_list:
+        current_block = block_list.pop(0)
+        context.push()
+        context['super'] = lambda: _render_block(context, block_list)
+        output = current_block.render_body(context)
+        context.pop()
+        return output
+    return ''
+
+
+RUNTIME = {
+    "_call": _call,
+    "_filter": _filter,
+    "_unpack": _unpack,
+    "_cycle": _cycle,
+    "_include": _include,
+    "_block": _block,
+    "_escape": filters.escape,
+    "_spaceless": filters.spaceless,
+}
+
+
+class CompiledBlock:
+
+    def __init__(self, template, title, func):
+        self.template = template
+        self.title = title
+        self.func = func
+
+    def render_body(self, context):
+        return self.template.run(self.func, context)
+
+
+# Stands in for a Template's root node, which the 'include' tag renders.
+class CompiledRoot:
+
+    children = ()
+
+    def __init__(self, template, func):
+        self.template = template
+        self.func = func
+
+    def render(self, context):
+        return self.template.run(self.func, context)
+
+
+# A template backed by a code object from compile_template(); has the same interface as Template.
+class CompiledTemplate:
+
+    def __init__(self, code, template_id="UNIDENTIFIED"):
+        self.template_id = template_id
+        namespace = dict(RUNTIME)
+        exec(code, namespace)
+
+        tokens = [compiler.Token(token_type, text, template_id, line_number)
+                  for token_type, text, line_number in namespace["TOKENS"]]
+        namespace["_T"] = tokens
+        namespace["_X"] = [nodes.Expression(source, tokens[token]) for source, token in namespace["FALLBACKS"]]
+
+        self.tokens = tokens
+        self.lines = namespace["LINES"]
+        self.filename = code.co_filename
+        self.parent_name = namespace["EXTENDS"]
+        self.root_node = CompiledRoot(self, namespace["render"])
+        self.blocks = dict((title, CompiledBlock(self, title, func)) for title, func in namespace["BLOCKS"].items())
+
+    def render(self, *pargs, **kwargs):
+        data_dict = pargs[0] if pargs else kwargs
+        strict_mode = kwargs.get("strict_mode", False)
+        context = Context(data_dict, strict_mode)
+        return self._render(context)
+
+    def _render(self, context):
+        context.templates.append(self)
+        if self.parent_name:
+            if ibis.loader:
+                parent_template = ibis.loader(self.parent_name)
+                return parent_template._render(context)
+            else:
+                msg = "No template loader has been specified. A template loader is required "
+                msg += "by the 'extends' tag in template '{}'.".format(self.template_id)
+                raise errors.TemplateLoadError(msg)
+        else:
+            return self.root_node.render(context)
+
+    def run(self, func, context):
+        # wrap unexpected errors like Node.render does, with the token of the failing line
+        try:
+            return func(context)
+        except errors.TemplateError:
+            raise
+        except Exception as err:
+            token = self.error_token(err)
+            if token:
+                tagname = "'{}'".format(token.keyword) if token.type == "INSTRUCTION" else token.type
+                msg = "An unexpected error occurred while rendering the {} tag: ".format(tagname)
+            else:
+                msg = "Unexpected rendering error: "
+            msg += "{name}: {err}".format(name=err.__class__.__name__, err=err)
+            errors.raise_(errors.TemplateRenderingError(msg, token), err)
+
+    def error_token(self, err):
+        line = None
+        tb = err.__traceback__
+        while tb:
+            if tb.tb_frame.f_code.co_filename == self.filename:
+                line = tb.tb_lineno
+            tb = tb.tb_next
+
+        if line is None or not self.lines:
+            return None
+        index = bisect.bisect_right(self.lines, (line, len(self.tokens))) - 1
+        return self.tokens[self.lines[index][1]] if index >= 0 else None
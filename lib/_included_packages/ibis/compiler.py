@@ -14,6 +14,9 @@ eprint_end = '$}'
 instruction_start = '{%'
 instruction_end = '%}'
 
+# second characters of the start delimiters, which all start with '{'
+tag_chars = ('#', '$', '{', '%')
+
 
 # Returns the root node of the compiled node tree.
 def compile(template_string, template_id):
@@ -71,72 +74,60 @@ class Lexer:
             self.line_number += 1
         self.index += 1
 
+    def read_until(self, end):
+        # returns the index of end, or -1 if it's not found; line numbers are counted up to there
+        end_index = self.template_string.find(end, self.index)
+        stop = len(self.template_string) if end_index == -1 else end_index
+        self.line_number += self.template_string.count('\n', self.index, stop)
+        self.index = stop
+        return end_index
+
     def read_comment_tag(self):
         self.index += len(comment_start)
         start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(comment_end):
-                self.index += len(comment_end)
-                return
-            self.advance()
+        if self.read_until(comment_end) != -1:
+            self.index += len(comment_end)
+            return
         msg = "Unclosed comment tag."
         raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
 
-    def read_eprint_tag(self):
-        self.index += len(eprint_start)
+    def read_tag(self, token_type, end, msg):
         start_index = self.index
         start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(eprint_end):
-                text = self.template_string[start_index:self.index].strip()
-                self.tokens.append(Token("EPRINT", text, self.template_id, start_line_number))
-                self.index += len(eprint_end)
-                return
-            self.advance()
-        msg = "Unclosed escaped-print tag."
+        if self.read_until(end) != -1:
+            text = self.template_string[start_index:self.index].strip()
+            self.tokens.append(Token(token_type, text, self.template_id, start_line_number))
+            self.index += len(end)
+            return
         raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
 
+    def read_eprint_tag(self):
+        self.index += len(eprint_start)
+        self.read_tag("EPRINT", eprint_end, "Unclosed escaped-print tag.")
+
     def read_print_tag(self):
         self.index += len(print_start)
-        start_index = self.index
-        start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(print_end):
-                text = self.template_string[start_index:self.index].strip()
-                self.tokens.append(Token("PRINT", text, self.template_id, start_line_number))
-                self.index += len(print_end)
-                return
-            self.advance()
-        msg = "Unclosed print tag."
-        raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        self.read_tag("PRINT", print_end, "Unclosed print tag.")
 
     def read_instruction_tag(self):
         self.index += len(instruction_start)
-        start_index = self.index
-        start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(instruction_end):
-                text = self.template_string[start_index:self.index].strip()
-                self.tokens.append(Token("INSTRUCTION", text, self.template_id, start_line_number))
-                self.index += len(instruction_end)
-                return
-            self.advance()
-        msg = "Unclosed instruction tag."
-        raise errors.TemplateLexingError(msg, self.template_id, start_line_number)
+        self.read_tag("INSTRUCTION", instruction_end, "Unclosed instruction tag.")
 
     def read_text(self):
         start_index = self.index
         start_line_number = self.line_number
-        while self.index < len(self.template_string):
-            if self.match(comment_start):
-                break
-            elif self.match(eprint_start):
+        # all tag delimiters start with '{'
+        index = self.index
+        while True:
+            index = self.template_string.find('{', index)
+            if index == -1:
+                index = len(self.template_string)
                 break
-            elif self.match(print_start):
-                break
-            elif self.match(instruction_start):
+            if self.template_string[index + 1:index + 2] in tag_chars:
                 break
-            self.advance()
+            index += 1
+        self.line_number += self.template_string.count('\n', start_index, index)
+        self.index = index
         text = self.template_string[start_index:self.index]
         self.tokens.append(Token("TEXT", text, self.template_id, start_line_number))
 
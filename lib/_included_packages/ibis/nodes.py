@@ -162,6 +162,7 @@ class Expression:
     re_varstring = re.compile(r'^[\w.]+$')
 
     def __init__(self, expr, token):
+        self.source = expr
         self.token = token
         self.filters = []
         self.literal = None
@@ -798,12 +799,15 @@ class BlockNode(Node):
             current_block = block_list.pop(0)
             context.push()
             context['super'] = lambda: self.render_block(context, block_list)
-            output = ''.join(child.render(context) for child in current_block.children)
+            output = current_block.render_body(context)
             context.pop()
             return output
         else:
             return ''
 
+    def render_body(self, context):
+        return ''.join(child.render(context) for child in self.children)
+
 
 # Strips leading and trailing whitespace along with all whitespace between HTML tags.
 @register('spaceless', 'endspaceless')
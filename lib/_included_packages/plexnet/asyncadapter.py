@@ -4,6 +4,8 @@ import socket
 import six
 import os
 import datetime
+import threading
+import weakref
 
 from kodi_six import xbmc
 from requests.packages.urllib3 import HTTPConnectionPool, HTTPSConnectionPool
@@ -23,6 +25,8 @@ from requests_cache import CachedSession
 #from six.moves.http_client import HTTPConnection
 import errno
 
+from . import metrics
+
 DEFAULT_POOLBLOCK = False
 SSL_KEYWORDS = ('key_file', 'cert_file', 'cert_reqs', 'ca_certs',
                 'ssl_version')
@@ -40,6 +44,14 @@ WIN_EHOSTUNREACH = 10065
 MAX_RETRIES = 3
 REQUESTS_CACHE_EXPIRY = 168
 
+# keep-alive connections kept per host:port, i.e. per PlexConnection
+POOL_MAXSIZE = 4
+# number of hosts we keep connection pools for
+POOL_NUM_POOLS = 20
+
+# the Session a request is currently running for on this thread
+_local = threading.local()
+
 
 def ABORT_FLAG_FUNCTION():
     if STOP_RETRYING_REQUESTS and DEBUG_REQUESTS:
@@ -118,9 +130,13 @@ class AsyncConnectionMixin:
 
         host, port = address
         err = None
-        for res in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        start = time.time()
+        addrinfo = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        metrics.addPhase("dns", time.time() - start)
+        for res in addrinfo:
             af, socktype, proto, canonname, sa = res
             sock = None
+            start = time.time()
             try:
                 sock = socket.socket(af, socktype, proto)
                 sock.setblocking(False)  # this is obviously critical
@@ -133,6 +149,7 @@ class AsyncConnectionMixin:
                     if self._canceled or ABORT_FLAG_FUNCTION():
                         raise CanceledException('Request canceled: {0}'.format(str(self)))
                 sock.setblocking(True)
+                metrics.addPhase("connect", time.time() - start)
                 return sock
 
             except socket.error as _:
@@ -184,9 +201,19 @@ class AsyncConnectionMixin:
     def cancel(self):
         self._canceled = True
 
+        # a reused keep-alive connection is already connected and may be blocked reading the response; shutting the
+        # socket down makes that read return right away
+        sock = getattr(self, "sock", None)
+        if sock is not None:
+            try:
+                # on the plain socket level, so a TLS socket isn't modified under its reading thread
+                socket.socket.shutdown(sock, socket.SHUT_RDWR)
+            except (OSError, TypeError, ValueError):
+                pass
+
 
 class AsyncVerifiedHTTPSConnection(AsyncConnectionMixin, VerifiedHTTPSConnection):
-    __slots__ = ("_canceled", "deadline", "deadline_extended", "identifier", "_timeout")
+    __slots__ = ("_canceled", "deadline", "deadline_extended", "identifier", "_timeout", "_owner")
 
     def __init__(self, *args, **kwargs):
         super(AsyncVerifiedHTTPSConnection, self).__init__(*args, **kwargs)
@@ -195,10 +222,22 @@ class AsyncVerifiedHTTPSConnection(AsyncConnectionMixin, VerifiedHTTPSConnection
         self.identifier = None
         self.deadline_extended = False
         self._timeout = AsyncTimeout(DEFAULT_TIMEOUT)
+        self._owner = None
+
+    def connect(self):
+        timing = metrics.current()
+        if not timing:
+            return super(AsyncVerifiedHTTPSConnection, self).connect()
+
+        start = time.time()
+        before = timing.networkTime()
+        super(AsyncVerifiedHTTPSConnection, self).connect()
+        # whatever isn't DNS or the TCP connect is the TLS handshake
+        timing.add("tls", time.time() - start - (timing.networkTime() - before))
 
 
 class AsyncHTTPConnection(AsyncConnectionMixin, HTTPConnection):
-    __slots__ = ("_canceled", "deadline", "deadline_extended", "identifier", "_timeout")
+    __slots__ = ("_canceled", "deadline", "deadline_extended", "identifier", "_timeout", "_owner")
 
     def __init__(self, *args, **kwargs):
         super(AsyncHTTPConnection, self).__init__(*args, **kwargs)
@@ -207,16 +246,79 @@ class AsyncHTTPConnection(AsyncConnectionMixin, HTTPConnection):
         self.identifier = None
         self.deadline_extended = False
         self._timeout = AsyncTimeout(DEFAULT_TIMEOUT)
+        self._owner = None
+
+
+class ConnectionStats(object):
+    """
+    Counts requests and newly established connections per host:port to show how well keep-alive connections are reused
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts = {}
+
+    def add(self, host, new):
+        with self._lock:
+            d = self.hosts.get(host)
+            if d is None:
+                d = self.hosts[host] = {"requests": 0, "connections": 0}
+            d["requests"] += 1
+            if new:
+                d["connections"] += 1
+
+    def reset(self):
+        with self._lock:
+            self.hosts = {}
+
+    def toDict(self):
+        with self._lock:
+            return dict((host, dict(d, reused=d["requests"] - d["connections"])) for host, d in self.hosts.items())
+
+    def summary(self):
+        with self._lock:
+            requests = sum(d["requests"] for d in self.hosts.values())
+            connections = sum(d["connections"] for d in self.hosts.values())
+
+        if not requests:
+            return ''
+        return '{0} requests over {1} connections ({2:.0f}% reused)'.format(
+            requests, connections, 100.0 * (requests - connections) / requests)
+
+
+CONNECTION_STATS = ConnectionStats()
+
+
+class AsyncPoolMixin(object):
+    """
+    Keeps track of which Session a connection is used by, so a Session can cancel its own requests without tearing
+    down the pooled connections of everybody else, and counts connection reuse.
+    """
+    def _get_conn(self, timeout=None):
+        conn = super(AsyncPoolMixin, self)._get_conn(timeout=timeout)
+        conn._canceled = False
+        CONNECTION_STATS.add("{0}:{1}".format(self.host, self.port), getattr(conn, "sock", None) is None)
+
+        owner = getattr(_local, "session", None)
+        conn._owner = owner
+        if owner is not None:
+            owner._active.add(conn)
+        return conn
 
+    def _put_conn(self, conn):
+        if conn is not None:
+            if conn._owner is not None:
+                conn._owner._active.discard(conn)
+                conn._owner = None
 
+            if conn._canceled:
+                # don't hand out a connection that was canceled mid-request; the pool opens a new one for its slot
+                conn.close()
+                conn = None
 
-class AsyncHTTPConnectionPool(HTTPConnectionPool):
-    __slots__ = ("connections",)
+        return super(AsyncPoolMixin, self)._put_conn(conn)
 
-    def __init__(self, *args, **kwargs):
-        HTTPConnectionPool.__init__(self, *args, **kwargs)
-        self.connections = []
 
+class AsyncHTTPConnectionPool(AsyncPoolMixin, HTTPConnectionPool):
     def _new_conn(self):
         """
         Return a fresh :class:`httplib.HTTPConnection`.
@@ -236,22 +338,10 @@ class AsyncHTTPConnectionPool(HTTPConnectionPool):
             # Mark this connection as not reusable
             conn.auto_open = 0
 
-        self.connections.append(conn)
-
         return conn
 
-    def cancel(self):
-        for c in self.connections:
-            c.cancel()
-
-
-class AsyncHTTPSConnectionPool(HTTPSConnectionPool):
-    __slots__ = ("connections",)
-
-    def __init__(self, *args, **kwargs):
-        HTTPSConnectionPool.__init__(self, *args, **kwargs)
-        self.connections = []
 
+class AsyncHTTPSConnectionPool(AsyncPoolMixin, HTTPSConnectionPool):
     def _new_conn(self):
         """
         Return a fresh :class:`httplib.HTTPSConnection`.
@@ -271,18 +361,12 @@ class AsyncHTTPSConnectionPool(HTTPSConnectionPool):
             extra_params['strict'] = self.strict
         connection = connection_class(host=actual_host, port=actual_port, timeout=self.timeout.connect_timeout, **extra_params)
 
-        self.connections.append(connection)
-
         try:
             return self._prepare_conn(connection)
         except AttributeError:
             # urllib3 2.1.0
             return connection
 
-    def cancel(self):
-        for c in self.connections:
-            c.cancel()
-
 
 pool_classes_by_scheme = {
     'http': AsyncHTTPConnectionPool,
@@ -309,11 +393,32 @@ class AsyncPoolManager(PoolManager):
         return pool_cls(host, port, **kwargs)
 
 
-class AsyncHTTPAdapter(HTTPAdapter):
-    def cancel(self):
-        for c in self.connections:
-            c.cancel()
+_POOL_MANAGER = None
+_POOL_LOCK = threading.Lock()
+
+
+def getPoolManager():
+    """
+    All adapters share one pool manager, so warm keep-alive connections survive the short-lived Sessions created per
+    HttpRequest
+    """
+    global _POOL_MANAGER
+    with _POOL_LOCK:
+        if _POOL_MANAGER is None:
+            _POOL_MANAGER = AsyncPoolManager(num_pools=POOL_NUM_POOLS, maxsize=POOL_MAXSIZE, block=DEFAULT_POOLBLOCK)
+        return _POOL_MANAGER
+
 
+def clearPools():
+    """
+    Closes all pooled connections, e.g. after a network change
+    """
+    with _POOL_LOCK:
+        if _POOL_MANAGER is not None:
+            _POOL_MANAGER.clear()
+
+
+class AsyncHTTPAdapter(HTTPAdapter):
     def init_poolmanager(self, connections, maxsize, block=DEFAULT_POOLBLOCK):
         """Initializes a urllib3 PoolManager. This method should not be called
         from user code, and is only exposed for use when subclassing the
@@ -324,12 +429,16 @@ class AsyncHTTPAdapter(HTTPAdapter):
         :param block: Block when no free connections are available.
         """
         # save these values for pickling
-        self._pool_connections = connections
-        self._pool_maxsize = maxsize
+        self._pool_connections = POOL_NUM_POOLS
+        self._pool_maxsize = POOL_MAXSIZE
         self._pool_block = block
 
-        self.poolmanager = AsyncPoolManager(num_pools=connections, maxsize=maxsize, block=block)
-        self.connections = []
+        self.poolmanager = getPoolManager()
+
+    def close(self):
+        # the pool manager is shared; only get rid of our proxy managers
+        for proxy in self.proxy_manager.values():
+            proxy.clear()
 
     def get_connection(self, url, proxies=None):
         """Returns a urllib3 connection for the given URL. This should not be
@@ -361,7 +470,6 @@ class AsyncHTTPAdapter(HTTPAdapter):
             url = parsed.geturl()
             conn = self.poolmanager.connection_from_url(url)
 
-        self.connections.append(conn)
         return conn
 
 STOP_RETRYING_REQUESTS = False
@@ -371,6 +479,11 @@ class StoppableRetry(Retry):
     def increment(self, *args, **kwargs):
         if STOP_RETRYING_REQUESTS:
             self.total = 0
+
+        # the request failed because its session canceled it; don't send it again
+        session = getattr(_local, "session", None)
+        if session is not None and session._cancels != _local.cancels:
+            raise CanceledException('Request canceled')
         return super(StoppableRetry, self).increment(*args, **kwargs)
 
 
@@ -383,6 +496,11 @@ class Session(CachedSession):
             kwargs['expire_after'] = datetime.timedelta(hours=REQUESTS_CACHE_EXPIRY)  # 7 days
         CachedSession.__init__(self, *args, **kwargs)
 
+        # connections currently used by requests of this session
+        self._active = weakref.WeakSet()
+        # incremented by cancel, so requests can tell whether they failed because they were canceled
+        self._cancels = 0
+
         self.mount('https://', AsyncHTTPAdapter(max_retries=StoppableRetry(MAX_RETRIES)))
         self.mount('http://', AsyncHTTPAdapter(max_retries=StoppableRetry(MAX_RETRIES)))
 
@@ -390,9 +508,37 @@ class Session(CachedSession):
         self._is_cache_disabled = not kwargs.pop('with_cache', False)
         if DEBUG_REQUESTS:
             xbmc.log("Session.request: (cache enabled: %s) %s %s" % (not self._is_cache_disabled, method, url), xbmc.LOGINFO)
-        return CachedSession.request(self, method, url, *args, **kwargs)
+
+        previous = getattr(_local, "session", None), getattr(_local, "cancels", 0)
+        _local.session = self
+        _local.cancels = cancels = self._cancels
+        try:
+            timing = metrics.begin(url)
+            if not timing:
+                return CachedSession.request(self, method, url, *args, **kwargs)
+
+            try:
+                response = CachedSession.request(self, method, url, *args, **kwargs)
+            except:
+                timing.finish(error=True)
+                raise
+
+            timing.finish(response, stream=kwargs.get('stream', False))
+            return response
+        except CanceledException:
+            raise
+        except Exception as e:
+            # cancel shuts down the sockets of running requests; report that as what it is, not a connection error
+            if self._cancels != cancels:
+                six.raise_from(CanceledException('Request canceled'), e)
+            raise
+        finally:
+            _local.session, _local.cancels = previous
 
     def cancel(self):
-        for v in self.adapters.values():
-            v.close()
-            v.cancel()
+        """
+        Cancels the requests of this session only; idle pooled connections stay open for others
+        """
+        self._cancels += 1
+        for conn in list(self._active):
+            conn.cancel()
@@ -11,8 +11,7 @@ class Audio(media.MediaItem):
         media.MediaItem.__init__(self, *args, **kwargs)
 
     def _setData(self, data):
-        for k, v in data.attrib.items():
-            setattr(self, k, plexobjects.PlexValue(v, self))
+        self._setAttribs(data.attrib)
 
         self.key = plexobjects.PlexValue(self.key.replace('/children', ''), self)
 
@@ -147,8 +146,8 @@ class Track(Audio):
 
     @property
     def defaultThumb(self):
-        return self.__dict__.get('thumb') or self.__dict__.get('parentThumb') or self.get('grandparentThumb')
+        return self.get('thumb') or self.get('parentThumb') or self.get('grandparentThumb')
 
     @property
     def defaultArt(self):
-        return self.__dict__.get('art') or self.get('grandparentArt')
+        return self.get('art') or self.get('grandparentArt')
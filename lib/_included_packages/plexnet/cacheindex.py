@@ -0,0 +1,126 @@
+# coding=utf-8
+"""
+Index of the URLs whose responses are stored in the requests cache, grouped by cache reference (e.g. show_123,
+section_4), scoped by server+user base key.
+
+Keeps a reverse index from URL to cache references, so that invalidating a set of references removes each affected
+URL from every reference pointing to it, and deletes the cached responses in one batch.
+"""
+from __future__ import absolute_import
+
+import threading
+
+from . import util
+
+
+class CacheIndex(object):
+    def __init__(self, data=None):
+        self._lock = threading.RLock()
+        # base_key: {cache_ref: {url: None}}; dicts keep insertion order and give O(1) membership
+        self.refs = {}
+        # base_key: {url: set(cache_ref, ...)}
+        self.urlRefs = {}
+        if data:
+            self.load(data)
+
+    def __bool__(self):
+        return bool(self.refs)
+
+    __nonzero__ = __bool__
+
+    def load(self, data):
+        """
+        Loads the {base_key: {cache_ref: [url, ...]}} representation as created by toDict
+        """
+        with self._lock:
+            self.refs = {}
+            self.urlRefs = {}
+            for base_key, refs in data.items():
+                for cache_ref, urls in refs.items():
+                    for url in urls:
+                        self.add(base_key, cache_ref, url)
+
+    def toDict(self):
+        with self._lock:
+            return dict((base_key, dict((ref, list(urls)) for ref, urls in refs.items()))
+                        for base_key, refs in self.refs.items())
+
+    def clear(self):
+        with self._lock:
+            self.refs = {}
+            self.urlRefs = {}
+
+    def add(self, base_key, cache_ref, url):
+        """
+        Returns True if url wasn't known for cache_ref yet
+        """
+        with self._lock:
+            urls = self.refs.setdefault(base_key, {}).setdefault(cache_ref, {})
+            if url in urls:
+                return False
+            urls[url] = None
+            self.urlRefs.setdefault(base_key, {}).setdefault(url, set()).add(cache_ref)
+            return True
+
+    def has(self, base_key, cache_ref):
+        return cache_ref in self.refs.get(base_key, {})
+
+    def urls(self, base_key, refs):
+        with self._lock:
+            base = self.refs.get(base_key, {})
+            urls = {}
+            for ref in refs:
+                urls.update(base.get(ref, {}))
+            return list(urls)
+
+    def refsForUrl(self, base_key, url):
+        with self._lock:
+            return set(self.urlRefs.get(base_key, {}).get(url, ()))
+
+    def remove(self, base_key, refs):
+        """
+        Removes refs from the index and returns the URLs they were pointing to. Those URLs are also removed from any
+        other reference, as their cached responses are about to go away.
+        """
+        with self._lock:
+            base = self.refs.get(base_key)
+            if not base:
+                return []
+
+            urlRefs = self.urlRefs.get(base_key, {})
+            urls = {}
+            for ref in refs:
+                urls.update(base.pop(ref, {}))
+
+            for url in urls:
+                for other in urlRefs.pop(url, ()):
+                    otherUrls = base.get(other)
+                    if otherUrls is not None:
+                        otherUrls.pop(url, None)
+                        if not otherUrls:
+                            del base[other]
+
+            return list(urls)
+
+    def invalidate(self, refs, base_key=None):
+        """
+        Drops all cached responses of the given cache references in one go
+        """
+        base_key = base_key or util.INTERFACE.getRCBaseKey()
+        urls = self.remove(base_key, set(refs))
+        if not urls:
+            return 0
+
+        if util.DEBUG_REQUESTS:
+            util.DEBUG_LOG("Clearing cache for: {0}, {1}".format(sorted(refs), urls))
+
+        from .asyncadapter import Session
+        s = Session()
+        try:
+            s.cache.delete_urls(urls)
+        except Exception as e:
+            util.LOG('Failed to delete {0} cached URLs: {1}', len(urls), e)
+        return len(urls)
+
+
+INDEX = CacheIndex()
@@ -0,0 +1,157 @@
+# coding=utf-8
+"""
+Caches server playback decisions, and requests the decision for the post-play "up next" item ahead of time, so
+starting it doesn't have to wait for the decision request.
+
+Decisions are keyed by their full decision path (which includes the session, offset and all transcode parameters) and
+are used once. They are also keyed by whether the server is reached locally, as local and remote playback use
+different quality settings, so none survives the server's connection switching between the two. Everything is
+dropped when a setting changes.
+"""
+from __future__ import absolute_import
+
+import time
+import threading
+import collections
+
+from . import threadutils
+from . import util
+
+
+class DecisionCache(object):
+    MAX_ENTRIES = 20
+    # server decisions depend on the server's state (transcoder load, bandwidth), so don't trust them for too long
+    TTL = 300
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._decisions = collections.OrderedDict()
+        self.generation = 0
+        self.stats = {"hits": 0, "misses": 0, "prefetched": 0}
+
+    def decisionKey(self, server, decisionPath):
+        return server.uuid, isLocal(server), self.generation, decisionPath
+
+    def takeDecision(self, server, decisionPath):
+        """
+        Returns and forgets the prefetched decision response for decisionPath on server, if any
+        """
+        with self._lock:
+            entry = self._decisions.pop(self.decisionKey(server, decisionPath), None)
+            if entry and time.time() - entry[0] < self.TTL:
+                self.stats["hits"] += 1
+                return entry[1]
+            self.stats["misses"] += 1
+        return None
+
+    def setDecision(self, server, decisionPath, response):
+        with self._lock:
+            key = self.decisionKey(server, decisionPath)
+            self._decisions.pop(key, None)
+            self._decisions[key] = (time.time(), response)
+            while len(self._decisions) > self.MAX_ENTRIES:
+                self._decisions.popitem(last=False)
+
+    def invalidate(self, **kwargs):
+        with self._lock:
+            self.generation += 1
+            self._decisions.clear()
+
+    def summary(self):
+        with self._lock:
+            return '{hits} hits, {misses} misses; {prefetched} decisions prefetched'.format(**self.stats)
+
+
+class DecisionPrefetcher(object):
+    """
+    Requests the server decision of one upcoming item in the background. A newer prefetch replaces an older one that
+    hasn't started yet.
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self._cond = threading.Condition()
+        self._pending = None
+        self._thread = None
+        self._stopped = False
+
+    def prefetch(self, item, offset=0, session_id=None):
+        """
+        Asks the server for its decision on playing item from offset (ms), which must not happen while another item
+        of the same session is still being played.
+        """
+        if self._stopped or not item or not item.isVideoItem() or not item.ratingKey:
+            return
+
+        with self._cond:
+            self._pending = (item, offset, session_id)
+            self._cond.notify()
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threadutils.KillableThread(target=self._work, name='DECISION-PREFETCH')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _work(self):
+        while not self._stopped:
+            with self._cond:
+                if not self._pending:
+                    self._cond.wait(5)
+                    if not self._pending:
+                        self._thread = None
+                        return
+                job, self._pending = self._pending, None
+
+            try:
+                self._prefetch(*job)
+            except Exception as e:
+                util.DEBUG_LOG("Decision prefetch failed for {0}: {1}", job[0], e)
+
+    def _prefetch(self, item, offset, session_id):
+        from . import plexobjects
+        from . import plexplayer
+        from . import plexrequest
+
+        start = time.time()
+        # item belongs to the UI and the player, which reload it and choose its media themselves; resolve the decision
+        # path on a separate object built from the same data
+        shadow = plexobjects.buildItem(item.server, item.data, item.initpath, container=item.container)
+        shadow.settings = item.settings
+        # same arguments the player reloads with
+        shadow.softReload(includeChapters=1)
+        if not shadow.media:
+            return
+
+        player = plexplayer.PlexPlayer(shadow, offset, forceUpdate=True, session_id=session_id)
+        if not player.choice or not player.build():
+            return
+
+        decisionPath = player.getDecisionPath(not player.metadata.isTranscoded)
+        if not decisionPath:
+            return
+
+        server = player.metadata.transcodeServer or shadow.getServer()
+        response = plexrequest.PlexRequest(server, decisionPath).getWithTimeout(util.DEFAULT_TIMEOUT)
+        if not response.isSuccess() or not response.container:
+            return
+
+        self.cache.setDecision(server, decisionPath, response)
+        with self.cache._lock:
+            self.cache.stats["prefetched"] += 1
+        util.DEBUG_LOG("Prefetched the server decision for {0} in {1:.0f}ms", item, (time.time() - start) * 1000)
+
+    def cancel(self):
+        with self._cond:
+            self._pending = None
+
+    def shutdown(self):
+        self._stopped = True
+        with self._cond:
+            self._pending = None
+            self._cond.notify_all()
+
+
+def isLocal(server):
+    return bool(server and server.isLocalConnection())
+
+
+CACHE = DecisionCache()
+PREFETCHER = DecisionPrefetcher(CACHE)
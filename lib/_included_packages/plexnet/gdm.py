@@ -1,16 +1,28 @@
 from __future__ import absolute_import
 import threading
+import selectors
 import socket
-import traceback
+import json
 import time
 from . import util
 from . import netif
 
 from . import plexconnection
+from . import reachability
 
 DISCOVERY_PORT = 32414
 WIN_NL = chr(13) + chr(10)
 
+# seconds to wait for answers
+DISCOVERY_TIMEOUT = 5
+# the search is sent again after RETRANSMIT_INTERVAL, then with doubling intervals
+RETRANSMIT_INTERVAL = 0.5
+RETRANSMITS = 3
+# once all servers of the last discovery answered, wait this long for others
+QUIET_PERIOD = 0.3
+# longest select() wait, so close() is noticed
+MAX_WAIT = 0.25
+
 
 class GDMDiscovery(object):
     def __init__(self):
@@ -125,56 +137,106 @@ class GDMDiscovery(object):
         if not util.INTERFACE.getPreference("gdm_discovery", False) or self.isActive():
             return
 
+        self._close = False
+        self.servers = []
+        self.published = self.publishCached()
+
         self.thread = threading.Thread(target=self._discover)
         self.thread.start()
 
+    def publishCached(self):
+        """
+        Hands the servers found by the last discovery on this network to the server manager right away, so
+        reachability tests don't have to wait for GDM. Returns their records.
+        """
+        records = CACHE.get()
+        if records:
+            util.LOG("Using {0} server(s) from the last GDM discovery on this network", len(records))
+            from . import plexapp
+            plexapp.SERVERMANAGER.updateFromConnectionType([createServer(r) for r in records],
+                                                           plexconnection.PlexConnection.SOURCE_DISCOVERED)
+        return records
+
     def _discover(self):
         ifaces = netif.getInterfaces()
+        sel = selectors.DefaultSelector()
         sockets = []
-        self.servers = []
 
-        packet = ("M-SEARCH * HTTP/1.1" + WIN_NL + WIN_NL).encode("utf-8")
-
-        for i in ifaces:
-            if not i.broadcast:
-                continue
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.settimeout(0.01)  # 10ms
-            s.bind((i.ip, 0))
-            s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sockets.append((s, i))
-
-        success = False
-
-        for attempt in (0, 1):
-            for s, i in sockets:
-                if self._close:
-                    return
-                util.DEBUG_LOG('  o-> Broadcasting to {0}: {1}', i.name, i.broadcast)
+        try:
+            for i in ifaces:
+                if not i.broadcast:
+                    continue
                 try:
-                    s.sendto(packet, (i.broadcast, DISCOVERY_PORT))
-                    success = True
-                except:
-                    util.ERROR()
-
-            if success:
+                    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    s.setblocking(False)
+                    s.bind((i.ip, 0))
+                    s.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                except (socket.error, OSError) as e:
+                    util.DEBUG_LOG("GDM: Can't use interface {0}: {1}", i.name, e)
+                    continue
+                sel.register(s, selectors.EVENT_READ, i)
+                sockets.append((s, i))
+
+            if sockets:
+                self._run(sel, sockets)
+        finally:
+            for s, i in sockets:
+                sel.unregister(s)
+                s.close()
+            sel.close()
+
+        if not self._close:
+            self.discoveryFinished()
+
+    def _run(self, sel, sockets):
+        # servers we expect to answer; once all of them did, we're done
+        expected = set(r[0] for r in self.published or [])
+        start = time.time()
+        end = start + DISCOVERY_TIMEOUT
+        nextSend = start
+        interval = RETRANSMIT_INTERVAL
+        sent = 0
+
+        while not self._close:
+            now = time.time()
+            if now >= end:
                 break
 
-        end = time.time() + 5
+            if sent <= RETRANSMITS and now >= nextSend:
+                self.broadcast(sockets)
+                sent += 1
+                nextSend = now + interval
+                interval *= 2
+
+            timeout = min(end, nextSend if sent <= RETRANSMITS else end, now + MAX_WAIT) - now
+            for key, mask in sel.select(max(0, timeout)):
+                while True:
+                    try:
+                        message, address = key.fileobj.recvfrom(4096)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    except (socket.error, OSError) as e:
+                        util.DEBUG_LOG("GDM: Receive failed on {0}: {1}", key.data.name, e)
+                        break
 
-        while time.time() < end:
-            for s, i in sockets:
-                if self._close:
-                    return
-                try:
-                    message, address = s.recvfrom(4096)
-                    self.onSocketEvent(message, address)
-                except socket.timeout:
-                    pass
-                except:
-                    traceback.print_exc()
+                    try:
+                        self.onSocketEvent(message, address)
+                    except Exception:
+                        util.ERROR()
+
+            if expected and expected.issubset(r[0] for r in self.servers):
+                # give servers we don't know of yet a moment to answer as well
+                end = min(end, time.time() + QUIET_PERIOD)
+                expected = None
 
-        self.discoveryFinished()
+    def broadcast(self, sockets):
+        packet = ("M-SEARCH * HTTP/1.1" + WIN_NL + WIN_NL).encode("utf-8")
+        for s, i in sockets:
+            util.DEBUG_LOG('  o-> Broadcasting to {0}: {1}', i.name, i.broadcast)
+            try:
+                s.sendto(packet, (i.broadcast, DISCOVERY_PORT))
+            except (socket.error, OSError) as e:
+                util.DEBUG_LOG("GDM: Broadcast failed on {0}: {1}", i.name, e)
 
     def onSocketEvent(self, message, addr):
         util.DEBUG_LOG('Received GDM message:\n' + str(message))
@@ -182,7 +244,7 @@ class GDMDiscovery(object):
         hostname = addr[0]  # socket.gethostbyaddr(addr[0])[0]
 
         name = parseFieldValue(message, b"Name: ")
-        port = parseFieldValue(message, b"Port: ") or b"32400"
+        port = parseFieldValue(message, b"Port: ") or "32400"
         machineID = parseFieldValue(message, b"Resource-Identifier: ")
         secureHost = parseFieldValue(message, b"Host: ")
 
@@ -191,25 +253,11 @@ class GDMDiscovery(object):
         if not name or not machineID:
             return
 
-        from . import plexserver
-        conn = plexconnection.PlexConnection(plexconnection.PlexConnection.SOURCE_DISCOVERED, "http://" + hostname + ":" + port, True, None, bool(secureHost))
-        server = plexserver.createPlexServerForConnection(conn)
-        server.uuid = machineID
-        server.name = name
-        server.sameNetwork = True
-
-        # If the server advertised a secure hostname, add a secure connection as well, and
-        # set the http connection as a fallback.
-        #
-        if secureHost:
-            server.connections.insert(
-                0,
-                plexconnection.PlexConnection(
-                    plexconnection.PlexConnection.SOURCE_DISCOVERED, "https://" + hostname.replace(".", "-") + "." + secureHost + ":" + port, True, None
-                )
-            )
+        # servers answer every retransmission, on every interface they can be reached on
+        if any(r[0] == machineID for r in self.servers):
+            return
 
-        self.servers.append(server)
+        self.servers.append((machineID, name, hostname, port, secureHost))
 
     def discoveryFinished(self, *args, **kwargs):
         # Time's up, report whatever we found
@@ -217,14 +265,87 @@ class GDMDiscovery(object):
 
         if self.servers:
             util.LOG("Finished GDM discovery, found {0} server(s)", len(self.servers))
-            from . import plexapp
-            plexapp.SERVERMANAGER.updateFromConnectionType(self.servers, plexconnection.PlexConnection.SOURCE_DISCOVERED)
+            records = sorted(self.servers)
+            CACHE.set(records)
+            # the server manager already got these from the cache
+            if records != sorted(self.published or []):
+                from . import plexapp
+                plexapp.SERVERMANAGER.updateFromConnectionType([createServer(r) for r in records],
+                                                               plexconnection.PlexConnection.SOURCE_DISCOVERED)
             self.servers = None
+        elif self.published:
+            # the cached servers didn't answer on this network anymore, take them back
+            util.LOG("Finished GDM discovery, none of the {0} cached server(s) answered", len(self.published))
+            CACHE.forget()
+            from . import plexapp
+            plexapp.SERVERMANAGER.updateFromConnectionType([], plexconnection.PlexConnection.SOURCE_DISCOVERED)
 
     def close(self):
         self._close = True
 
 
+class DiscoveryCache(object):
+    """
+    The servers the last discovery found, per network (see reachability.currentNetworkID), as
+    (machineID, name, host, port, secureHost) records.
+    """
+    REGISTRY_KEY = "PlexGDMServers"
+    MAX_NETWORKS = 10
+
+    def _load(self):
+        jstring = util.INTERFACE.getRegistry(self.REGISTRY_KEY)
+        if jstring:
+            try:
+                return json.loads(jstring)
+            except ValueError:
+                util.ERROR_LOG("Failed to parse GDM cache")
+        return {}
+
+    def get(self):
+        return [tuple(r) for r in self._load().get(reachability.HISTORY.networkID, {}).get("servers", [])]
+
+    def set(self, records):
+        networks = self._load()
+        networks[reachability.HISTORY.networkID] = {"servers": records, "seen": int(time.time())}
+        if len(networks) > self.MAX_NETWORKS:
+            oldest = sorted(networks, key=lambda k: networks[k].get("seen", 0))
+            for key in oldest[:len(networks) - self.MAX_NETWORKS]:
+                del networks[key]
+        util.INTERFACE.setRegistry(self.REGISTRY_KEY, json.dumps(networks))
+
+    def forget(self):
+        networks = self._load()
+        if networks.pop(reachability.HISTORY.networkID, None) is not None:
+            util.INTERFACE.setRegistry(self.REGISTRY_KEY, json.dumps(networks))
+
+    def clear(self):
+        util.INTERFACE.setRegistry(self.REGISTRY_KEY, '')
+
+
+def createServer(record):
+    machineID, name, hostname, port, secureHost = record
+
+    from . import plexserver
+    conn = plexconnection.PlexConnection(plexconnection.PlexConnection.SOURCE_DISCOVERED, "http://" + hostname + ":" + port, True, None, bool(secureHost))
+    server = plexserver.createPlexServerForConnection(conn)
+    server.uuid = machineID
+    server.name = name
+    server.sameNetwork = True
+
+    # If the server advertised a secure hostname, add a secure connection as well, and
+    # set the http connection as a fallback.
+    #
+    if secureHost:
+        server.connections.insert(
+            0,
+            plexconnection.PlexConnection(
+                plexconnection.PlexConnection.SOURCE_DISCOVERED, "https://" + hostname.replace(".", "-") + "." + secureHost + ":" + port, True, None
+            )
+        )
+
+    return server
+
+
 def parseFieldValue(message, label):
     if label not in message:
         return None
@@ -232,6 +353,7 @@ def parseFieldValue(message, label):
     return message.split(label, 1)[-1].split(chr(13).encode())[0].decode()
 
 
+CACHE = DiscoveryCache()
 DISCOVERY = GDMDiscovery()
 
 '''
@@ -2,12 +2,12 @@ from __future__ import absolute_import
 import sys
 import os
 import re
+import time
 import traceback
 import requests
 import socket
 import urllib3
 import datetime
-from . import threadutils
 import six.moves.urllib.request, six.moves.urllib.parse, six.moves.urllib.error
 import mimetypes
 import functools
@@ -15,6 +15,8 @@ from . import plexobjects
 from xml.etree import ElementTree
 
 from . import asyncadapter
+from . import exceptions
+from . import metrics
 
 from . import callback
 from . import util
@@ -82,9 +84,26 @@ class RequestContext(dict):
         self[attr] = value
 
 
+def certBundle(use_system=False):
+    """
+    Returns the path of the CA cert bundle to verify https requests with, or None for the system default
+    """
+    if use_system or util.USE_CERT_BUNDLE == "system":
+        return None
+
+    if util.USE_CERT_BUNDLE == "custom":
+        # noinspection PyTypeChecker
+        return os.path.join(util.translatePath(util.ADDON.getAddonInfo("profile")), "custom_bundle.crt")
+
+    elif util.USE_CERT_BUNDLE == "acme" and TODAY <= CURRENT_ACME_CRT_DATE:
+        return os.path.join(os.path.dirname(os.path.realpath(__file__)), 'certs', 'acme.bundle.crt')
+    #else:
+    #    return os.path.join(certsPath, 'ca-bundle.crt')
+
+
 class HttpRequest(object):
     __slots__ = ("server", "path", "hasParams", "ignoreResponse", "session", "currentResponse", "method", "url",
-                 "thread", "__dict__")
+                 "job", "__dict__")
     _cancel = False
 
     USE_SYSTEM_CERT_BUNDLE = False
@@ -99,35 +118,41 @@ class HttpRequest(object):
         self.currentResponse = None
         self.method = method
         self.url = url
-        self.thread = None
+        self.job = None
 
         # Use a specific CA cert bundle if applicable
-        if not self.USE_SYSTEM_CERT_BUNDLE and util.USE_CERT_BUNDLE != "system" and url[:5] == "https":
-            if util.USE_CERT_BUNDLE == "custom":
-                # noinspection PyTypeChecker
-                self.session.verify = os.path.join(util.translatePath(util.ADDON.getAddonInfo("profile")),
-                                                 "custom_bundle.crt")
-
-            elif util.USE_CERT_BUNDLE == "acme" and TODAY <= CURRENT_ACME_CRT_DATE:
-                self.session.verify = os.path.join(
-                    os.path.dirname(os.path.realpath(__file__)), 'certs', 'acme.bundle.crt')
-            #else:
-            #    self.session.cert = os.path.join(certsPath, 'ca-bundle.crt')
+        if url[:5] == "https":
+            bundle = certBundle(self.USE_SYSTEM_CERT_BUNDLE)
+            if bundle:
+                self.session.verify = bundle
 
     def removeAsPending(self):
         from . import plexapp
         util.APP.delRequest(self)
 
-    def startAsync(self, *args, **kwargs):
-        self.thread = threadutils.KillableThread(target=self._startAsync, args=args, kwargs=kwargs, name='HTTP-ASYNC:{0}'.format(self.url))
-        self.thread.start()
+    def startAsync(self, body=None, contentType=None, context=None):
+        from . import requestpool
+        self.job = requestpool.POOL.submit(self, body=body, contentType=contentType, context=context)
         return True
 
-    def _startAsync(self, body=None, contentType=None, context=None):
+    def coalesceKey(self, body=None):
+        """
+        Identical GET requests running at the same time can share one response
+        """
+        if body is not None or self.method not in (None, 'GET'):
+            return None
+        return type(self), self.url, frozenset(self.session.headers.items())
+
+    def perform(self, body=None, contentType=None, context=None, canceled=None):
+        """
+        Runs the request of an async job; returns (response, error) where error is one of None, "timeout", "canceled"
+        or "failed"
+        """
         timeout = context and context.timeout or DEFAULT_TIMEOUT
+        canceled = canceled or (lambda: self._cancel)
         self.logRequest(body, timeout)
-        if self._cancel:
-            return
+        if canceled():
+            return None, "canceled"
         try:
             if self.method == 'PUT':
                 res = self.session.put(self.url, timeout=timeout, stream=True)
@@ -148,24 +173,38 @@ class HttpRequest(object):
                 res = self.session.get(self.url, timeout=timeout, stream=True)
             self.currentResponse = res
 
-            if self._cancel:
-                return
+            if canceled():
+                return None, "canceled"
         except asyncadapter.TimeoutException:
-            from . import plexapp
-            plexapp.util.APP.onRequestTimeout(context)
-            self.removeAsPending()
-            return
+            return None, "timeout"
         except asyncadapter.CanceledException:
-            return
+            return None, "canceled"
         except (urllib3.exceptions.ProtocolError, requests.exceptions.ConnectionError):
-            self.removeAsPending()
-            return
+            return None, "failed"
         except Exception as e:
             util.ERROR('Request failed {0}'.format(util.cleanToken(self.url)))
             if not hasattr(e, 'response'):
-                return
+                return None, "failed"
             res = e.response
 
+        return res, None
+
+    def deliver(self, res, error, context):
+        """
+        Hands the result of an async job to this request's callback
+        """
+        if error == "canceled" or self._cancel:
+            return
+        elif error == "timeout":
+            from . import plexapp
+            plexapp.util.APP.onRequestTimeout(context)
+            self.removeAsPending()
+            return
+        elif error == "failed":
+            self.removeAsPending()
+            return
+
+        self.currentResponse = res
         self.onResponse(res, context)
 
         self.removeAsPending()
@@ -263,9 +302,11 @@ class HttpRequest(object):
 
     def cancel(self):
         self._cancel = True
-        self.session.cancel()
+        # requests coalesced with others only leave their job; the job aborts once nobody waits for it anymore
+        if not self.job or not self.job.detach(self):
+            self.session.cancel()
+            self.killSocket()
         self.removeAsPending()
-        self.killSocket()
 
     def addParam(self, encodedName, value):
         if self.hasParams:
@@ -347,6 +388,118 @@ class HttpResponse(object):
         return self.event.headers.get(name)
 
 
+class StreamedXmlResponse(object):
+    """
+    Incrementally parses an XML response body while it's being downloaded.
+
+    The root element (the MediaContainer) is available as soon as its start tag has been parsed. Iterating yields each
+    top-level child once it's complete and detaches it from the root afterwards, so neither the full body nor the full
+    tree have to be held in memory at once.
+    """
+    CHUNK_SIZE = 16384
+
+    def __init__(self, response, url=None, chunk_size=None):
+        self.response = response
+        self.url = url
+        self.root = None
+        self._parser = ElementTree.XMLPullParser(events=('start', 'end'))
+        self._chunks = response.iter_content(chunk_size or self.CHUNK_SIZE)
+        self._events = None
+        self._depth = 0
+        self._done = False
+        self._consumed = False
+        self._bytes = 0
+        self._downloadTime = 0
+        self._parseTime = 0
+
+        # parse until we've seen the root element
+        for event, elem in self._iterEvents():
+            if event == 'start':
+                self.root = elem
+                self._depth = 1
+                break
+
+    def __bool__(self):
+        return self.root is not None
+
+    __nonzero__ = __bool__
+
+    def __getattr__(self, attr):
+        # behave like the root element for attribute access (tag, attrib, get, find, ...)
+        if attr.startswith('_') or self.root is None:
+            raise AttributeError(attr)
+        return getattr(self.root, attr)
+
+    def _feed(self):
+        start = time.time()
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._finish()
+            self._parser.close()
+            return False
+        except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+            util.ERROR('Streaming response aborted: {0}'.format(util.cleanToken(self.url or '')))
+            self._finish()
+            # the body is incomplete; don't let the consumer mistake what it got so far for the whole container
+            six.raise_from(exceptions.StreamAborted(str(e)), e)
+
+        parseStart = time.time()
+        self._parser.feed(chunk)
+        self._downloadTime += parseStart - start
+        self._parseTime += time.time() - parseStart
+        self._bytes += len(chunk)
+        return True
+
+    def _finish(self):
+        self._done = True
+        self.response.close()
+
+        if metrics.ENABLED and self.url:
+            # the transferred bytes have already been recorded if the server told us the content length
+            nbytes = 0 if self.response.headers.get('Content-Length') else self._bytes
+            metrics.REGISTRY.addPhase(self.url, "download", self._downloadTime, nbytes=nbytes)
+            metrics.REGISTRY.addPhase(self.url, "parse", self._parseTime)
+
+    def _iterEvents(self):
+        while True:
+            for evt in self._parser.read_events():
+                yield evt
+
+            if self._done or not self._feed():
+                for evt in self._parser.read_events():
+                    yield evt
+                return
+
+    def __iter__(self):
+        if self.root is None:
+            return
+
+        if self._consumed:
+            raise RuntimeError('StreamedXmlResponse can only be iterated once')
+        self._consumed = True
+
+        try:
+            for event, elem in self._iterEvents():
+                if event == 'start':
+                    self._depth += 1
+                    continue
+
+                self._depth -= 1
+                if self._depth == 1:
+                    yield elem
+                    # the consumer is done with this element; don't keep it around on the root
+                    del self.root[:]
+        finally:
+            # also when the consumer stops early
+            if not self._done:
+                self.close()
+
+    def close(self):
+        self._done = True
+        self.response.close()
+
+
 class HttpObjectResponse(HttpResponse, plexobjects.PlexContainer):
     def __init__(self, response, path, server=None):
         self.event = response
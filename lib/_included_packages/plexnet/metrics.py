@@ -0,0 +1,250 @@
+# coding=utf-8
+"""
+Lightweight per-request instrumentation for plexnet HTTP traffic.
+
+Requests are bucketed by endpoint template (e.g. /library/sections/{id}/all). For every template we keep request,
+error, byte and cache hit/miss counters as well as a latency histogram per phase (dns, connect, tls, ttfb, download,
+parse, total).
+"""
+from __future__ import absolute_import
+
+import re
+import json
+import time
+import threading
+
+from . import util
+
+ENABLED = False
+
+PHASES = ("dns", "connect", "tls", "ttfb", "download", "parse", "total")
+
+# histogram bucket upper bounds in ms; anything slower ends up in the overflow bucket
+BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+ID_RE = re.compile(r'/(?:[\d,]+|[0-9a-fA-F]{8}-[0-9a-fA-F-]{27}|[0-9a-fA-F]{16,})(?=/|$)')
+
+_local = threading.local()
+
+
+def endpointTemplate(url):
+    """
+    Turns a URL into its endpoint template by removing scheme, host and query and replacing IDs with {id}:
+    https://1-2-3-4.abc.plex.direct:32400/library/metadata/123/children?X-Plex-Token=.. ->
+    /library/metadata/{id}/children
+    """
+    path = url.split('?', 1)[0]
+    if '://' in path:
+        rest = path.split('://', 1)[1]
+        path = '/' + rest.split('/', 1)[1] if '/' in rest else '/'
+    return ID_RE.sub('/{id}', path)
+
+
+class Histogram(object):
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        for i, bound in enumerate(BUCKETS):
+            if ms <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+
+        self.count += 1
+        self.sum += ms
+        self.max = max(self.max, ms)
+
+    @property
+    def avg(self):
+        return self.count and self.sum / self.count or 0.0
+
+    def toDict(self):
+        buckets = dict(("<={0}".format(b), c) for b, c in zip(BUCKETS, self.counts) if c)
+        if self.counts[-1]:
+            buckets[">{0}".format(BUCKETS[-1])] = self.counts[-1]
+
+        return {
+            "count": self.count,
+            "avg_ms": round(self.avg, 1),
+            "max_ms": round(self.max, 1),
+            "buckets": buckets
+        }
+
+
+class EndpointStats(object):
+    def __init__(self, template):
+        self.template = template
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.phases = {}
+
+    def addPhase(self, phase, seconds):
+        if phase not in self.phases:
+            self.phases[phase] = Histogram()
+        self.phases[phase].add(seconds * 1000)
+
+    def toDict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "cache_hits": self.cacheHits,
+            "cache_misses": self.cacheMisses,
+            "phases": dict((p, self.phases[p].toDict()) for p in PHASES if p in self.phases)
+        }
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}
+        self.started = time.time()
+
+    def _get(self, template):
+        stats = self.endpoints.get(template)
+        if stats is None:
+            stats = self.endpoints[template] = EndpointStats(template)
+        return stats
+
+    def add(self, timing):
+        with self._lock:
+            stats = self._get(timing.template)
+            stats.count += 1
+            stats.bytes += timing.bytes
+            if timing.error:
+                stats.errors += 1
+            if timing.fromCache is True:
+                stats.cacheHits += 1
+            elif timing.fromCache is False:
+                stats.cacheMisses += 1
+
+            for phase, seconds in timing.phases.items():
+                stats.addPhase(phase, seconds)
+
+    def addPhase(self, url, phase, seconds, nbytes=0):
+        """
+        Records a phase that happens after the request itself has been recorded, e.g. parsing the response
+        """
+        with self._lock:
+            stats = self._get(endpointTemplate(url))
+            stats.bytes += nbytes
+            stats.addPhase(phase, seconds)
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.started = time.time()
+
+    def toDict(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "duration": time.time() - self.started,
+                "endpoints": dict((t, s.toDict()) for t, s in self.endpoints.items())
+            }
+
+    def slowest(self, limit=5, phase="total"):
+        with self._lock:
+            stats = [s for s in self.endpoints.values() if phase in s.phases]
+            return sorted(stats, key=lambda s: s.phases[phase].avg, reverse=True)[:limit]
+
+    def summary(self, limit=3):
+        with self._lock:
+            count = sum(s.count for s in self.endpoints.values())
+            hits = sum(s.cacheHits for s in self.endpoints.values())
+
+        if not count:
+            return ''
+
+        slowest = ', '.join('{0} ({1:.0f} ms)'.format(s.template, s.phases["total"].avg) for s in self.slowest(limit))
+        return '{0} requests, {1} cached; slowest: {2}'.format(count, hits, slowest)
+
+    def dump(self, path, **extra):
+        """
+        Writes the registry to path as JSON; extra keyword arguments are added as top level keys
+        """
+        try:
+            data = self.toDict()
+            data.update(extra)
+            with open(path, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            util.LOG('Request metrics written to: {0}', path)
+            return True
+        except (IOError, OSError, TypeError, ValueError):
+            util.ERROR('Failed to write request metrics to: {0}'.format(path))
+        return False
+
+
+REGISTRY = MetricsRegistry()
+
+
+class RequestTiming(object):
+    __slots__ = ("template", "start", "phases", "bytes", "fromCache", "error")
+
+    def __init__(self, url):
+        self.template = endpointTemplate(url)
+        self.start = time.time()
+        self.phases = {}
+        self.bytes = 0
+        self.fromCache = None
+        self.error = False
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0) + max(seconds, 0)
+
+    def networkTime(self):
+        return sum(self.phases.get(p, 0) for p in ("dns", "connect", "tls"))
+
+    def finish(self, response=None, stream=False, error=False):
+        total = time.time() - self.start
+        self.error = error or response is None or response.status_code >= 400
+
+        if response is not None:
+            self.fromCache = getattr(response, "from_cache", None)
+            if not self.fromCache:
+                # response.elapsed covers everything from sending the request until the headers were parsed, including
+                # connecting
+                elapsed = response.elapsed.total_seconds()
+                self.add("ttfb", elapsed - self.networkTime())
+                if not stream:
+                    self.add("download", total - elapsed)
+
+            length = response.headers.get('Content-Length')
+            if length and length.isdigit():
+                self.bytes = int(length)
+            elif not stream:
+                self.bytes = len(response.content or b'')
+
+        self.add("total", total)
+        if getattr(_local, "timing", None) is self:
+            _local.timing = None
+
+        REGISTRY.add(self)
+
+
+def begin(url):
+    if not ENABLED:
+        return None
+
+    _local.timing = timing = RequestTiming(url)
+    return timing
+
+
+def current():
+    return getattr(_local, "timing", None)
+
+
+def addPhase(phase, seconds):
+    timing = current()
+    if timing:
+        timing.add(phase, seconds)
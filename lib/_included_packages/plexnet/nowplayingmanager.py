@@ -2,6 +2,7 @@
 # TODO: Perhaps remove unnecessary code
 from __future__ import absolute_import
 import time
+import threading
 
 from . import util
 from six import moves
@@ -12,9 +13,19 @@ from . import callback
 from . import http
 
 
+# seconds between periodic timeline updates per playback state; paused/buffering progress doesn't change, so those
+# only need to keep the session alive
+TIMELINE_INTERVALS = {
+    "playing": 10,
+    "buffering": 15,
+    "paused": 20,
+}
+DEFAULT_TIMELINE_INTERVAL = 10
+
+
 class ServerTimeline(util.AttributeDict):
-    def reset(self):
-        self.expires = time.time() + 10
+    def reset(self, state=None):
+        self.expires = time.time() + TIMELINE_INTERVALS.get(state, DEFAULT_TIMELINE_INTERVAL)
 
     def isExpired(self):
         return time.time() > self.get('expires', 0)
@@ -61,6 +72,123 @@ class TimelineData(util.AttributeDict):
                 self.controllableStr += name
 
 
+class TimelineUpdate(object):
+    __slots__ = ("key", "state", "path", "playQueue", "retries")
+
+    def __init__(self, key, state, path, playQueue=None):
+        # (timelineType, ratingKey)
+        self.key = key
+        self.state = state
+        self.path = path
+        self.playQueue = playQueue
+        self.retries = 0
+
+
+class TimelineQueue(object):
+    __slots__ = ("server", "updates", "inflight", "retryTimer", "lostTimer")
+
+    def __init__(self, server):
+        self.server = server
+        self.updates = []
+        self.inflight = None
+        self.retryTimer = None
+        self.lostTimer = None
+
+
+class TimelineReporter(object):
+    """
+    Sends timeline updates through one ordered queue per server with at most one request in flight, so progress
+    reports can't overtake each other. A queued update is replaced by a newer one for the same item (stopped updates
+    are always delivered), and failed updates are retried with exponential backoff unless superseded.
+    """
+    MAX_RETRIES = 3
+    BACKOFF = 2
+    # connection errors don't call back; consider an in-flight request failed this many seconds after its timeout
+    LOST_GRACE = 5
+
+    def __init__(self, responseCallback):
+        self.responseCallback = responseCallback
+        self.lock = threading.Lock()
+        self.queues = {}
+
+    def add(self, server, update):
+        with self.lock:
+            queue = self.queues.get(server.uuid)
+            if not queue:
+                queue = self.queues[server.uuid] = TimelineQueue(server)
+            queue.server = server
+
+            superseded = [u for u in queue.updates if u.key == update.key and u.state != "stopped"]
+            if superseded:
+                util.DEBUG_LOG("Timeline: dropping {0} superseded update(s) for {1}", len(superseded), update.key)
+                queue.updates = [u for u in queue.updates if u not in superseded]
+            queue.updates.append(update)
+
+        self.pump(queue)
+
+    def pump(self, queue):
+        with self.lock:
+            if queue.inflight or queue.retryTimer or not queue.updates:
+                return
+
+            update = queue.inflight = queue.updates.pop(0)
+            server = queue.server
+
+            request = plexrequest.PlexRequest(server, update.path)
+            context = request.createRequestContext("timelineUpdate", callback.Callable(self.onResponse))
+            context.playQueue = update.playQueue
+            context.timelineQueue = queue
+            context.timelineUpdate = update
+
+            queue.lostTimer = util.TIMER(float(context.timeout) + self.LOST_GRACE,
+                                         callback.Callable(self.onLostTimer, [queue, update]))
+            util.APP.addTimer(queue.lostTimer)
+
+        util.APP.startRequest(request, context)
+
+    def _finish(self, queue, update, status):
+        # called with the lock held; retries on network errors and server errors, not on rejected updates
+        queue.inflight = None
+        if queue.lostTimer:
+            queue.lostTimer.cancel()
+            queue.lostTimer = None
+
+        if (not status or status >= 500) and update.retries < self.MAX_RETRIES and \
+                not any(u.key == update.key for u in queue.updates):
+            update.retries += 1
+            delay = self.BACKOFF ** update.retries
+            util.DEBUG_LOG("Timeline: update for {0} failed ({1}), retrying in {2}s", update.key, status, delay)
+            queue.updates.insert(0, update)
+            queue.retryTimer = util.TIMER(delay, callback.Callable(self.onRetryTimer, [queue]))
+            util.APP.addTimer(queue.retryTimer)
+
+    def onResponse(self, request, response, context):
+        queue = context.timelineQueue
+        update = context.timelineUpdate
+        with self.lock:
+            if queue.inflight is not update:
+                # already given up on
+                return
+            self._finish(queue, update, response.getStatus())
+
+        self.responseCallback(request, response, context)
+        self.pump(queue)
+
+    def onLostTimer(self, queue, update):
+        with self.lock:
+            if queue.inflight is not update:
+                return
+            util.DEBUG_LOG("Timeline: no response for update of {0}", update.key)
+            self._finish(queue, update, None)
+
+        self.pump(queue)
+
+    def onRetryTimer(self, queue):
+        with self.lock:
+            queue.retryTimer = None
+        self.pump(queue)
+
+
 class NowPlayingManager(object):
     def __init__(self):
         # Constants
@@ -77,6 +205,8 @@ class NowPlayingManager(object):
         self.textFieldContent = None
         self.textFieldSecure = None
 
+        self.reporter = TimelineReporter(callback.Callable(self.onTimelineResponse))
+
         # Initialization
         self.reset()
 
@@ -137,7 +267,7 @@ class NowPlayingManager(object):
         if itemsEqual and timeline.state == serverTimeline.state and not serverTimeline.isExpired() and not force:
             return
 
-        serverTimeline.reset()
+        serverTimeline.reset(timeline.state)
         serverTimeline.itemData = timeline.itemData
         serverTimeline.state = timeline.state
 
@@ -169,11 +299,8 @@ class NowPlayingManager(object):
             if params[paramKey]:
                 path = http.addUrlParam(path, paramKey + "=" + six.moves.urllib.parse.quote(str(params[paramKey])))
 
-        request = plexrequest.PlexRequest(server, path)
-
-        context = request.createRequestContext("timelineUpdate", callback.Callable(self.onTimelineResponse))
-        context.playQueue = timeline.playQueue
-        util.APP.startRequest(request, context)
+        self.reporter.add(server, TimelineUpdate((timelineType, timeline.itemData.ratingKey), timeline.state, path,
+                                                 timeline.playQueue))
 
     def getServerTimeline(self, timelineType):
         if not self.serverTimelines.get(timelineType):
@@ -129,6 +129,15 @@ class BasePlaylist(plexobjects.PlexObject, signalsmixin.SignalsMixin):
         else:
             return self.current()
 
+    def getNext(self):
+        if not self.hasNext():
+            return None
+
+        if self.isRepeatOne:
+            return self.current()
+
+        return self[(self.pos + 1) % len(self._items)]
+
     def prevItem(self):
         if self.pos < 1:
             return None
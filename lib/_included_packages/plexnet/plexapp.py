@@ -50,13 +50,15 @@ class App(signalsmixin.SignalsMixin):
     def startRequest(self, request, context, body=None, contentType=None):
         context.request = request
 
+        # register before starting, as a pooled request may finish before startAsync returns
+        requestID = request.getIdentity()
+        self.pendingRequests[requestID] = context
         started = request.startAsync(body=body, contentType=contentType, context=context)
 
-        if started:
-            requestID = context.request.getIdentity()
-            self.pendingRequests[requestID] = context
-        elif context.callback:
-            context.callback(None, context)
+        if not started:
+            self.pendingRequests.pop(requestID, None)
+            if context.callback:
+                context.callback(None, context)
 
         return started
 
@@ -105,7 +107,13 @@ class App(signalsmixin.SignalsMixin):
 
     def preShutdown(self):
         from . import http
+        from . import requestpool
+        from . import decisioncache
         http.HttpRequest._cancel = True
+        requestpool.POOL.cancelAll()
+        decisioncache.PREFETCHER.shutdown()
+        util.DEBUG_LOG('Playback decisions: {0}', lambda: decisioncache.CACHE.summary())
+        util.DEBUG_LOG('Async requests: {0}', lambda: requestpool.POOL.summary())
         if self.pendingRequests:
             util.DEBUG_LOG('Closing down {0} App() requests...', lambda: len(self.pendingRequests))
             for k in list(self.pendingRequests.keys()):
@@ -409,6 +417,10 @@ def setAbortFlagFunction(func):
 
 def refreshResources(force=False):
     from . import gdm
+    if force:
+        # pooled keep-alive connections may point to addresses that went away
+        from . import asyncadapter
+        asyncadapter.clearPools()
     gdm.DISCOVERY.discover()
     util.MANAGER.refreshResources(force)
     SERVERMANAGER.refreshManualConnections()
@@ -4,6 +4,7 @@ import socket
 
 from . import http
 from . import callback
+from . import reachability
 from . import util
 
 try:
@@ -78,9 +79,12 @@ class PlexConnection(object):
         self.localVerified = False
         self.isSecure = address[:5] == 'https'
         self.isFallback = isFallback
+        self.isRelay = False
         self.token = token
         self.refreshed = True
         self.score = 0
+        # last measured round trip time of a reachability test, ms
+        self.rtt = None
         self.request = None
         self.pdHostnameResolved = ".plex.direct:" not in address
 
@@ -112,13 +116,14 @@ class PlexConnection(object):
         return not self.__eq__(other)
 
     def __str__(self):
-        return "Connection: {0} local: {1} token: {2} sources: {3} state: {4} score: {5}".format(
+        return "Connection: {0} local: {1} token: {2} sources: {3} state: {4} score: {5} rtt: {6}".format(
             self.address,
             self.isLocal,
             util.hideToken(self.token),
             repr(self.sources),
             self.state,
-            self.getScore()
+            self.getScore(),
+            self.rtt is not None and "{0}ms".format(self.rtt) or "-"
         )
 
     def __repr__(self):
@@ -211,6 +216,7 @@ class PlexConnection(object):
         self.isLocal = self.isLocal | other.isLocal
         self.isSecure = other.isSecure
         self.isFallback = self.isFallback or other.isFallback
+        self.isRelay = other.isRelay
         self.refreshed = True
 
         self.getScore(True)
@@ -288,10 +294,30 @@ class PlexConnection(object):
         else:
             self.state = self.STATE_UNREACHABLE
 
+        self.recordReachability(response)
         self.getScore(True)
 
         context.server.onReachabilityResult(self)
 
+    def recordReachability(self, response):
+        reachable = self.state == self.STATE_REACHABLE
+        rtt = None
+        if reachable and response.event is not None:
+            # time until the response headers arrived, including connection setup
+            rtt = response.event.elapsed.total_seconds()
+            self.rtt = round(rtt * 1000, 1)
+
+        reachability.HISTORY.recordResult(self.address, reachable, rtt)
+
+    def isFasterThan(self, other):
+        """
+        True if both round trip times are known and ours is clearly lower, so that equally scored connections don't
+        flip-flop on jitter
+        """
+        if self.rtt is None or other.rtt is None:
+            return False
+        return self.rtt < other.rtt * 0.8 and other.rtt - self.rtt > 5
+
     def buildUrl(self, server, path, includeToken=False):
         if '://' in path:
             url = path
@@ -320,12 +346,20 @@ class PlexConnection(object):
 
     def getScore(self, recalc=False):
         if recalc:
-            self.score = 0
-            if self.state == self.STATE_REACHABLE:
-                self.score += self.SCORE_REACHABLE
-            if self.isSecure:
-                self.score += self.SCORE_SECURE
-            if self.isLocal:
-                self.score += self.SCORE_LOCAL + (not self.isSecure and util.LOCAL_OVER_SECURE and 2 or 0)
+            self.score = (self.state == self.STATE_REACHABLE and self.SCORE_REACHABLE or 0) + self.getBaseScore()
 
         return self.score
+
+    def getBaseScore(self):
+        score = 0
+        if self.isSecure:
+            score += self.SCORE_SECURE
+        if self.isLocal:
+            score += self.SCORE_LOCAL + (not self.isSecure and util.LOCAL_OVER_SECURE and 2 or 0)
+        return score
+
+    def getPotentialScore(self):
+        """
+        The score this connection would have if its pending reachability test succeeded
+        """
+        return self.SCORE_REACHABLE + self.getBaseScore()
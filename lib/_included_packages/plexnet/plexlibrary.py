@@ -174,11 +174,7 @@ class LibrarySection(plexobjects.PlexObject):
         elif self._isMapped is False:
             return False
 
-        for loc in self.locations:
-            if all(self.getMappedPath(loc)):
-                self._isMapped = True
-                return True
-        self._isMapped = False
+        self._isMapped = any(pms_path for url, pms_path, sep in pmm.mapPaths(self.locations, self.server))
         return self._isMapped
 
     def getAbsolutePath(self, key):
@@ -267,7 +263,7 @@ class LibrarySection(plexobjects.PlexObject):
             path += util.joinArgs(args, '?' not in path)
 
         return plexobjects.listItems(self.server, path, tag_fallback=tag_fallback, not_cachable=not self.cachable,
-                                     cache_ref=self.cacheRef)
+                                     cache_ref=self.cacheRef, stream=True)
 
     def jumpList(self, filter_=None, sort=None, unwatched=False, type_=None, hdr=False, dovi=False):
         if self.key.startswith('/'):
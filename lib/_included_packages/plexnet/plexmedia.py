@@ -9,8 +9,16 @@ from six.moves import filter
 import six
 
 
+def _attribIsTrue(value):
+    return value == '1' or value == 'true'
+
+
 class PlexMedia(plexobjects.PlexObject):
-    __slots__ = ("_data", "container_", "container", "indirectHeaders", "parts")
+    """
+    Parts (and their streams) are only built on first access. Until then, list views are answered from a summary of
+    the Part elements that's gathered while parsing.
+    """
+    __slots__ = ("_data", "container_", "container", "indirectHeaders", "_parts", "_partElems", "_summary")
 
     def __init__(self, data, initpath=None, server=None, container=None):
         self._data = data.attrib
@@ -18,25 +26,60 @@ class PlexMedia(plexobjects.PlexObject):
         self.container_ = self.get('container')
         self.container = container
         self.indirectHeaders = None
-        self.parts = []
+        self._parts = None
+        self._partElems = []
         # If we weren't given any data, this is a synthetic media
         if data is not None:
-            self.parts = [plexpart.PlexPart(elem, initpath=self.initpath, server=self.server, media=self) for elem in data]
+            self._partElems = list(data)
+        self._summary = self._summarize(self._partElems)
+
+    @staticmethod
+    def _summarize(elems):
+        # mirrors PlexPart.isAccessible, PlexPart.isAvailable and PlexPart.hasStreams
+        accessible = available = False
+        for elem in elems:
+            attrib = elem.attrib
+            if not accessible:
+                value = attrib.get('accessible')
+                accessible = _attribIsTrue(value) if value else True
+            if not available:
+                value = attrib.get('exists')
+                available = not value or _attribIsTrue(value)
+
+        hasStreams = bool(elems) and any(e.tag == 'Stream' for e in elems[0])
+        return accessible, available, hasStreams
+
+    @property
+    def parts(self):
+        if self._parts is None:
+            self._parts = [plexpart.PlexPart(elem, initpath=self.initpath, server=self.server, media=self)
+                           for elem in self._partElems]
+        return self._parts
+
+    @parts.setter
+    def parts(self, value):
+        self._parts = value
 
     def get(self, key, default=None):
         return self._data.get(key, default)
 
     def hasStreams(self):
-        return len(self.parts) > 0 and self.parts[0].hasStreams()
+        if self._parts is None:
+            return self._summary[2]
+        return len(self._parts) > 0 and self._parts[0].hasStreams()
 
     def isIndirect(self):
         return self.get('indirect') == '1'
 
     def isAccessible(self):
-        return any(p.isAccessible() for p in self.parts)
+        if self._parts is None:
+            return self._summary[0]
+        return any(p.isAccessible() for p in self._parts)
 
     def isAvailable(self):
-        return any(p.isAvailable() for p in self.parts)
+        if self._parts is None:
+            return self._summary[1]
+        return any(p.isAvailable() for p in self._parts)
 
     def resolveIndirect(self):
         if not self.isIndirect() or locks.LOCKS.isLocked("resolve_indirect"):
@@ -3,6 +3,7 @@ from datetime import datetime
 
 from . import exceptions
 from . import util
+from . import cacheindex
 import json
 import six
 import time
@@ -166,12 +167,27 @@ class Checks(object):
         return False
 
 
+# XML attributes that would clash with PlexObject attributes
+ATTRIB_RENAMES = {"container": "attrib_container"}
+ATTRIB_ALIASES = dict((v, k) for k, v in ATTRIB_RENAMES.items())
+
+CLASS_ATTRIBS = {}
+
+
+def getClassAttribs(cls):
+    names = CLASS_ATTRIBS.get(cls)
+    if names is None:
+        names = CLASS_ATTRIBS[cls] = frozenset(dir(cls))
+    return names
+
+
 class PlexObject(Checks):
     __slots__ = ("initpath", "key", "server", "container", "mediaChoice", "titleSort", "deleted", "_reloaded", "data",
                  "_not_cachable")
     TYPE = None
     cachable = False
     is_watchlist = False
+    _attribs = None
 
     def __init__(self, data, initpath=None, server=None, container=None, **kwargs):
         self.initpath = initpath
@@ -200,13 +216,48 @@ class PlexObject(Checks):
             return
 
         self.name = data.tag
-        for k, v in data.attrib.items():
-            if k in ("container",):
-                k = "attrib_%s" % k
+        self._setAttribs(data.attrib)
+
+    def _setAttribs(self, attribs):
+        """
+        XML attributes stay in the parsed attribute dict and are only turned into PlexValues on first access (see
+        __getattr__). Only attributes shadowing something defined on the class have to be set right away.
+        """
+        if self._attribs:
+            # reloading: attributes of the new data win, the ones not present anymore stay
+            merged = dict(self._attribs)
+            merged.update(attribs)
+            self._attribs = merged
+        else:
+            self._attribs = attribs
+
+        d = self.__dict__
+        classAttribs = getClassAttribs(self.__class__)
+        for k, v in attribs.items():
+            k = ATTRIB_RENAMES.get(k, k)
+            if k in classAttribs:
+                setattr(self, k, PlexValue(v, self))
+            else:
+                # drop values that were set before or materialized from previous data
+                d.pop(k, None)
 
-            setattr(self, k, PlexValue(v, self))
+    def _getAttrib(self, attr):
+        if not self._attribs or attr in ATTRIB_RENAMES:
+            return None
+
+        value = self._attribs.get(ATTRIB_ALIASES.get(attr, attr))
+        if value is None:
+            return None
+
+        value = PlexValue(value, self)
+        setattr(self, attr, value)
+        return value
 
     def __getattr__(self, attr):
+        a = self._getAttrib(attr)
+        if a is not None:
+            return a
+
         a = PlexValue('', self)
         a.NA = True
 
@@ -222,7 +273,9 @@ class PlexObject(Checks):
         return True
 
     def get(self, attr, default=''):
-        ret = self.__dict__.get(attr, getattr(self, attr) if attr in self.__slots__ else None)
+        ret = self.__dict__.get(attr)
+        if ret is None:
+            ret = getattr(self, attr) if attr in self.__slots__ else self._getAttrib(attr)
         return ret is not None and ret or PlexValue(default, self)
 
     def set(self, attr, value):
@@ -240,70 +293,42 @@ class PlexObject(Checks):
                 and ('items' in util.INTERFACE.getPreference('cache_requests') or always_return)):
             return "_".join((self.TYPE, self.ratingKey))
 
-    def _clearCache(self, cks, urls):
-        if not urls:
+    def _clearCache(self, cks):
+        if not cks:
             return
 
-        if util.DEBUG_REQUESTS:
-            util.DEBUG_LOG("Clearing cache for: {0}, {1}".format(self, urls))
-
-        from .asyncadapter import Session
-        s = Session()
-        for url in urls:
-            try:
-                s.cache.delete_url(url)
-            except Exception as e:
-                util.LOG('Failed to delete cached URL {0}: {1}', url, e)
-
-        # compact DB
-        s.cache.vacuum()
+        cacheindex.INDEX.invalidate(cks)
 
-        base = util.CACHED_PLEX_URLS.get(util.INTERFACE.getRCBaseKey(), {})
-
-        # delete cache keys for collected urls
-        for ck in cks:
-            try:
-                del base[ck]
-            except:
-                pass
-
-    def clearCache(self, override_type=None, return_urls=False):
+    def clearCache(self, override_type=None, return_refs=False):
         # fixme: cache handling should be in a separate manager class
         _type = override_type or self.TYPE
         if self.cachable:
             # get cache key no matter what, even if the specific type isn't cached, we still want to clear the library
             # cache regardless
             ck = self.getCacheRef(always_return=True)
-            urls = []
+            cks = []
             if ck:
-                base = util.CACHED_PLEX_URLS.get(util.INTERFACE.getRCBaseKey(), {})
-                cks = []
-                if base:
-                    urls = base.get(ck, [])
-                    cks.append(ck)
-
-                    if _type in ("movie", "episode", "show", "season"):
-                        # library cache
-                        libID = self.getLibrarySectionId()
-                        if libID:
-                            urls += base.get("section_%s" % libID, [])
-                            cks.append("section_%s" % libID)
+                cks.append(ck)
 
-                        # parents caches
-                        if _type == "episode":
-                            urls += base.get("season_%s" % self.parentRatingKey, [])
-                            urls += base.get("show_%s" % self.grandparentRatingKey, [])
-                            cks += ["season_%s" % self.parentRatingKey, "show_%s" % self.grandparentRatingKey]
+                if _type in ("movie", "episode", "show", "season"):
+                    # library cache
+                    libID = self.getLibrarySectionId()
+                    if libID:
+                        cks.append("section_%s" % libID)
 
-                        if _type == "season":
-                            urls += base.get("show_%s" % self.parentRatingKey, [])
-                            cks.append("show_%s" % self.parentRatingKey)
+                    # parents caches
+                    if _type == "episode":
+                        cks += ["season_%s" % self.parentRatingKey, "show_%s" % self.grandparentRatingKey]
 
-                if return_urls:
-                    return cks, urls
+                    if _type == "season":
+                        cks.append("show_%s" % self.parentRatingKey)
 
-                self._clearCache(cks, urls)
+            if return_refs:
+                return cks
 
+            self._clearCache(cks)
+        elif return_refs:
+            return []
 
     def isFullObject(self):
         return self.initpath is None or self.key is None or self.initpath == self.key
@@ -317,11 +342,11 @@ class PlexObject(Checks):
 
     @property
     def defaultThumb(self):
-        return self.__dict__.get('thumb') and self.thumb or PlexValue('', self)
+        return self.get('thumb')
 
     @property
     def defaultArt(self):
-        return self.__dict__.get('art') and self.art or PlexValue('', self)
+        return self.get('art')
 
     def refresh(self):
         self.server.query('%s/refresh' % self.key, method="put")
@@ -513,8 +538,14 @@ class PlexObject(Checks):
         import json
         odict = {}
         if full:
+            classAttribs = getClassAttribs(self.__class__)
+            for k, v in (self._attribs or {}).items():
+                k = ATTRIB_RENAMES.get(k, k)
+                if k not in classAttribs and v:
+                    odict[k] = v
+
             for k, v in self.__dict__.items():
-                if k not in ('server', 'container', 'media', 'initpath', '_data') and v:
+                if k not in ('server', 'container', 'media', 'initpath', '_data', '_attribs') and v:
                     odict[k] = v
         else:
             odict['key'] = self.key
@@ -661,25 +692,40 @@ class ItemContainer(list):
         return self
 
 
+def iterItems(server, path, libtype=None, watched=None, bytag=False, data=None, container=None, tag_fallback=False,
+              not_cachable=False):
+    if not data:
+        return
+
+    for elem in data:
+        if libtype and elem.attrib.get('type') != libtype:
+            continue
+        if watched is True and PlexValue(elem.attrib.get('viewCount', "0")).asInt() == 0:
+            continue
+        if watched is False and PlexValue(elem.attrib.get('viewCount', "0")).asInt() >= 1:
+            continue
+        try:
+            yield buildItem(server, elem, path, bytag, container, tag_fallback, not_cachable=not_cachable)
+        except exceptions.UnknownType:
+            pass
+
+
 def listItems(server, path, libtype=None, watched=None, bytag=False, data=None, container=None, offset=None,
               limit=None, tag_fallback=False, **kwargs):
+    # stream=True parses the response incrementally (see http.StreamedXmlResponse), building each item as soon as its
+    # element has arrived; use iterItems directly to consume items progressively
     not_cachable = kwargs.pop('not_cachable', False)
     data = data if data is not None else server.query(path, offset=offset, limit=limit, **kwargs)
-    container = container or PlexContainer(data, path, server, path)
+    container = container or PlexContainer(getattr(data, 'root', data), path, server, path)
     items = ItemContainer().init(container)
 
-    if data:
-        for elem in data:
-            if libtype and elem.attrib.get('type') != libtype:
-                continue
-            if watched is True and PlexValue(elem.attrib.get('viewCount', "0")).asInt() == 0:
-                continue
-            if watched is False and PlexValue(elem.attrib.get('viewCount', "0")).asInt() >= 1:
-                continue
-            try:
-                items.append(buildItem(server, elem, path, bytag, container, tag_fallback, not_cachable=not_cachable))
-            except exceptions.UnknownType:
-                pass
+    try:
+        for item in iterItems(server, path, libtype=libtype, watched=watched, bytag=bytag, data=data,
+                              container=container, tag_fallback=tag_fallback, not_cachable=not_cachable):
+            items.append(item)
+    except exceptions.StreamAborted:
+        # like a failed request: an empty result, so the caller requests it again
+        return ItemContainer().init(container)
 
     return items
 
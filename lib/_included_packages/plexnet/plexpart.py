@@ -7,7 +7,7 @@ from . import util
 from .media import MediaPartStream
 
 from lib.util import addonSettings
-from lib.path_mapping import pmm, norm_sep
+from lib.path_mapping import pmm
 
 
 class PlexPart(plexobjects.PlexObject):
@@ -18,17 +18,31 @@ class PlexPart(plexobjects.PlexObject):
         plexobjects.PlexObject.__init__(self, data, initpath, server)
         self.container_ = self.container
         self.container = media
-        self.streams = []
+        # streams are only built on first access, see streams
+        self._streams = None
 
         # If we weren't given any data, this is a synthetic part
         if data is not None:
-            self.streams = [MediaPartStream.parse(e, initpath=self.initpath, server=self.server, part=self) for e in data if e.tag == 'Stream']
             if self.indexes:
                 indexKeys = self.indexes('').split(",")
                 self.indexes = util.AttributeDict()
                 for indexKey in indexKeys:
                     self.indexes[indexKey] = True
 
+    @property
+    def streams(self):
+        if self._streams is None:
+            if self.data is not None:
+                self._streams = [MediaPartStream.parse(e, initpath=self.initpath, server=self.server, part=self)
+                                 for e in self.data if e.tag == 'Stream']
+            else:
+                self._streams = []
+        return self._streams
+
+    @streams.setter
+    def streams(self, value):
+        self._streams = value
+
     def getAddress(self):
         address = self.key
 
@@ -162,21 +176,18 @@ class PlexPart(plexobjects.PlexObject):
             return None
 
     def hasStreams(self):
-        return bool(self.streams)
+        if self._streams is None:
+            return self.data is not None and any(e.tag == 'Stream' for e in self.data)
+        return bool(self._streams)
 
     def getPathMappedUrl(self, return_only_folder=False):
         verify = addonSettings.verifyMappedFiles
 
-        map_path, pms_path, _ = pmm.getMappedPathFor(self.file, self.getServer())
-        if map_path and pms_path:
-            if return_only_folder:
-                return map_path
-
-            sep = norm_sep(map_path)
-
-            # replace match and normalize path separator to separator style of map_path
-            url = self.file.replace(pms_path, map_path, 1).replace(sep == "/" and "\\" or "/", sep)
+        if return_only_folder:
+            return pmm.getMappedPathFor(self.file, self.getServer())[0] or ""
 
+        url, pms_path, _ = pmm.getMappedPathFor(self.file, self.getServer(), return_rep=True)
+        if url and pms_path:
             if (verify and xbmcvfs.exists(url)) or not verify:
                 util.DEBUG_LOG("File {} found in path map, mapping to {}", self.file, pms_path)
                 return url
@@ -5,6 +5,7 @@ from . import captions
 from . import http
 from . import plexrequest
 from . import mediadecisionengine
+from . import decisioncache
 from . import serverdecision
 from lib.util import KODI_VERSION_MAJOR
 from lib.cache import CACHE_SIZE
@@ -237,15 +238,22 @@ class PlexPlayer(BasePlayer):
 
         return False
 
-    def getServerDecision(self):
+    def getServerDecision(self, allowCached=False):
+        """
+        allowCached: use a decision the prefetcher already got for the exact same decision path
+        """
         directPlay = not (self.metadata and self.metadata.isTranscoded)
         decisionPath = self.getDecisionPath(directPlay)
         newDecision = None
 
         if decisionPath:
             server = self.metadata.transcodeServer or self.item.getServer()
-            request = plexrequest.PlexRequest(server, decisionPath)
-            response = request.getWithTimeout(util.DEFAULT_TIMEOUT)
+            response = allowCached and decisioncache.CACHE.takeDecision(server, decisionPath) or None
+            if response:
+                util.DEBUG_LOG("MDE: Using prefetched server decision")
+            else:
+                request = plexrequest.PlexRequest(server, decisionPath)
+                response = request.getWithTimeout(util.DEFAULT_TIMEOUT)
 
             if response.isSuccess() and response.container:
                 decision = serverdecision.ServerDecision(self, response, self)
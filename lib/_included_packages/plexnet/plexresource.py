@@ -49,6 +49,7 @@ class PlexResource(object):
                 self.accessToken,
                 hasSecureConn and conn.attrib.get('protocol') != "https"
             )
+            connection.isRelay = conn.attrib.get('relay') == '1'
 
             # Keep the secure connection on top
             if connection.isSecure and not util.LOCAL_OVER_SECURE:
@@ -4,6 +4,7 @@ from __future__ import absolute_import
 import time
 import re
 import json
+import threading
 
 import six
 import urllib3.exceptions
@@ -19,6 +20,11 @@ from . import plexobjects
 from . import plexresource
 from . import plexlibrary
 from . import asyncadapter
+from . import metrics
+from . import cacheindex
+from . import reachability
+from . import callback
+from . import threadutils
 from six.moves import range
 
 # from plexapi.client import Client
@@ -30,6 +36,9 @@ DEFAULT_BASEURI = 'http://localhost:32400'
 
 CACHE_MAP = {}
 
+# single-flight for identical concurrent GETs in PlexServer.query
+QUERY_FLIGHTS = threadutils.SingleFlight()
+
 
 class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
     TYPE = 'PLEXSERVER'
@@ -54,6 +63,10 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
 
         self.pendingReachabilityRequests = 0
         self.pendingSecureRequests = 0
+        # id(connection): connection; connections aren't hashable
+        self.pendingTests = {}
+        self.race = None
+        self.raceLock = threading.RLock()
 
         self.features = {}
         self.librariesByUuid = {}
@@ -144,7 +157,16 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
     def getPrefs(self):
         return plexobjects.listItems(self, "/:/prefs", bytag=True, cachable=False, not_cachable=True)
 
-    def hubs(self, section=None, count=None, search_query=None, section_ids=None, ignore_hubs=None):
+    def hubs(self, section=None, count=None, search_query=None, section_ids=None, ignore_hubs=None,
+             hub_callback=None, continue_watching=True, method=None):
+        """
+        hub_callback: called with every Hub as soon as it has been built, while the rest of the response is still
+                      being received
+        continue_watching: whether to query the new continueWatching hub for the home section inline; if False the
+                           caller is expected to fetch it via continueWatchingHub itself
+        method: request method to use instead of our session's get, e.g. of a separate session that can be canceled
+                on its own
+        """
         hubs = []
 
         params = {"includeMarkers": 1}
@@ -177,24 +199,29 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             if count is not None:
                 params['count'] = count
 
-        data = self.query(q, params=params)
-        container = plexobjects.PlexContainer(data, initpath=q, server=self, address=q)
+        def addHub(hub):
+            if section_ids and "pinnedContentDirectoryID" not in hub.key:
+                # when we have hidden sections, apply the filter to the hubs keys for subsequent queries
+                hub.key += util.joinArgs(params, '?' not in hub.key)
 
-        self.currentHubs = {} if self.currentHubs is None else self.currentHubs
+            hubs.append(hub)
+            if hub_callback:
+                hub_callback(hub)
 
         newCW = util.INTERFACE.getPreference('hubs_use_new_continue_watching', False) and not search_query \
             and not section
 
-        if newCW:
+        if newCW and continue_watching:
             # home, add continueWatching
-            cq = '/hubs/continueWatching'
-            if section_ids:
-                cq += util.joinArgs(params)
+            cwHub = self.continueWatchingHub(count=count, section_ids=section_ids)
+            if cwHub:
+                addHub(cwHub)
 
-            cdata = self.query(cq, params=params)
-            ccontainer = plexobjects.PlexContainer(cdata, initpath=cq, server=self, address=cq)
-            self.currentHubs[cdata[0].attrib.get('hubIdentifier')] = cdata[0].attrib.get('title')
-            hubs.append(plexlibrary.Hub(cdata[0], server=self, container=ccontainer))
+        # only stream the response when somebody consumes the hubs one by one
+        data = self.query(q, method=method, params=params, stream=bool(hub_callback))
+        container = plexobjects.PlexContainer(getattr(data, 'root', data), initpath=q, server=self, address=q)
+
+        self.currentHubs = {} if self.currentHubs is None else self.currentHubs
 
         if data:
             for elem in data:
@@ -209,15 +236,37 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
                 if ignore_hubs and "{}:{}".format(section, hubIdent) in ignore_hubs:
                     continue
 
-                hubs.append(plexlibrary.Hub(elem, server=self, container=container))
+                addHub(plexlibrary.Hub(elem, server=self, container=container))
 
+        return hubs
+
+    def continueWatchingHub(self, count=None, section_ids=None):
+        """
+        Returns the combined continue watching/on deck hub of the home section or None
+        """
+        params = {"includeMarkers": 1}
         if section_ids:
-            # when we have hidden sections, apply the filter to the hubs keys for subsequent queries
-            for hub in hubs:
-                if "pinnedContentDirectoryID" not in hub.key:
-                    hub.key += util.joinArgs(params, '?' not in hub.key)
+            params['pinnedContentDirectoryID'] = ",".join(section_ids)
 
-        return hubs
+        if count is not None:
+            params['count'] = count
+
+        cq = '/hubs/continueWatching'
+        if section_ids:
+            cq += util.joinArgs(params)
+
+        cdata = self.query(cq, params=params)
+        if not len(cdata or ()):
+            return None
+
+        ccontainer = plexobjects.PlexContainer(cdata, initpath=cq, server=self, address=cq)
+        self.currentHubs = {} if self.currentHubs is None else self.currentHubs
+        self.currentHubs[cdata[0].attrib.get('hubIdentifier')] = cdata[0].attrib.get('title')
+
+        hub = plexlibrary.Hub(cdata[0], server=self, container=ccontainer)
+        if section_ids and "pinnedContentDirectoryID" not in hub.key:
+            hub.key += util.joinArgs(params, '?' not in hub.key)
+        return hub
 
     def playlists(self, start=0, size=10, hub=None):
         try:
@@ -260,6 +309,7 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         params = kwargs.pop("params", None)
         cachable = kwargs.pop("cachable", False)
         cache_ref = kwargs.pop("cache_ref", None)
+        stream = kwargs.pop("stream", False) and not raw
         if params:
             if limit is None:
                 limit = params.get("limit", None)
@@ -289,6 +339,26 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         if cachable and cache_ref:
             kwargs['with_cache'] = with_cache = True
 
+        if stream or method.__name__ != 'get':
+            return self._query(url, method, raw, stream, with_cache, cache_ref, kwargs)
+
+        # identical GETs running at the same time share one request and its (read-only) result
+        # a request canceled by its own session isn't an answer for callers of other sessions; they retry
+        session = getattr(method, '__self__', None)
+        cancels = getattr(session, '_cancels', None)
+        data, shared = QUERY_FLIGHTS.do((method.__name__, url, raw, with_cache),
+                                        lambda: self._query(url, method, raw, stream, with_cache, cache_ref, kwargs),
+                                        lambda: cancels is not None and session._cancels != cancels)
+        if shared:
+            util.DEBUG_LOG('GET (shared) {0}', lambda: util.cleanToken(url))
+            if with_cache and data is not None:
+                cacheindex.INDEX.add(util.INTERFACE.getRCBaseKey(), cache_ref, url)
+        return data
+
+    def _query(self, url, method, raw, stream, with_cache, cache_ref, kwargs):
+        if stream:
+            kwargs['stream'] = True
+
         util.LOG('{0} (cache enabled: {2}) {1}', method.__name__.upper(), re.sub('X-Plex-Token=[^&]+', 'X-Plex-Token=****', url), with_cache)
         try:
             response = method(url, **kwargs)
@@ -305,19 +375,12 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
                 # scope for server+user; URLs itself don't need to be scoped as they differ on X-Plex-Token and domain
                 base_key = util.INTERFACE.getRCBaseKey()
 
-                if base_key not in util.CACHED_PLEX_URLS:
-                    util.CACHED_PLEX_URLS[base_key] = {}
+                if cacheindex.INDEX.add(base_key, cache_ref, url) and util.DEBUG_REQUESTS:
+                    util.DEBUG_LOG('Storing URL for cached response in {0}: {1}: {2}'.format(base_key, cache_ref, url))
 
-                base = util.CACHED_PLEX_URLS[base_key]
-
-                if cache_ref not in base:
-                    base[cache_ref] = []
-
-                # fixme: this could be faster with a dict
-                if url not in base[cache_ref]:
-                    base[cache_ref].append(url)
-                    if util.DEBUG_REQUESTS:
-                        util.DEBUG_LOG('Storing URL for cached response in {0}: {1}: {2}'.format(base_key, cache_ref, url))
+            if stream:
+                data = http.StreamedXmlResponse(response, url=url)
+                return data if data else None
 
             data = response.text.encode('utf8')
         except asyncadapter.TimeoutException:
@@ -327,12 +390,19 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         except (http.requests.ConnectionError, urllib3.exceptions.ProtocolError):
             util.ERROR()
             return None
+        except exceptions.StreamAborted:
+            return None
         except asyncadapter.CanceledException:
             return None
 
         if raw:
             return data
-        return ElementTree.fromstring(data) if data else None
+
+        start = time.time()
+        data = ElementTree.fromstring(data) if data else None
+        if metrics.ENABLED:
+            metrics.REGISTRY.addPhase(url, "parse", time.time() - start)
+        return data
 
     def getImageTranscodeURL(self, path, width, height, **extraOpts):
         if not path:
@@ -460,6 +530,7 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
         epoch = time.time()
         retrySeconds = 60
         minSeconds = 10
+        candidates = []
         for i in range(len(self.connections)):
             conn = self.connections[i]
             diff = epoch - (conn.lastTestedAt or 0)
@@ -468,18 +539,153 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             elif (diff < minSeconds or (not self.isSecondary() and self.isReachable() and diff < retrySeconds)) and \
                     not conn.state == "unauthorized":
                 util.DEBUG_LOG("Skip reachability test for {0} (checked {1} secs ago)", conn, diff)
-            elif conn.testReachability(self, allowFallback):
-                self.pendingReachabilityRequests += 1
-                if conn.isSecure:
-                    self.pendingSecureRequests += 1
+            else:
+                candidates.append(conn)
 
-                if self.pendingReachabilityRequests == 1:
-                    self.trigger("started:reachability")
+        if candidates:
+            self.startRace(candidates, allowFallback)
 
         if self.pendingReachabilityRequests <= 0:
             self.trigger("completed:reachability")
 
+    def startRace(self, candidates, allowFallback=False):
+        """
+        Tests the candidate connections in tiers (last winner on this network, local, secure remote, remote, relay),
+        starting each tier reachability.RACE_STAGGER seconds after the previous one, or right away once the tiers
+        before it are done. The race ends as soon as a reachable connection can't be beaten by any pending one.
+        """
+        history = reachability.HISTORY
+        lastWinner = history.lastWinner(self.uuid)
+        tiers = {}
+        for conn in candidates:
+            tier = reachability.connectionTier(conn, lastWinner, history.connectionStats(conn.address))
+            tiers.setdefault(tier, []).append(conn)
+
+        for tier in tiers.values():
+            tier.sort(key=lambda c: history.rankKey(c.address))
+
+        with self.raceLock:
+            if self.race:
+                self.endRace()
+
+            race = self.race = ConnectionRace([tiers[t] for t in sorted(tiers)], allowFallback)
+
+            # unstarted connections count as pending, so nobody settles for less in the meantime
+            for conn in candidates:
+                self.addPendingReachabilityTest(conn)
+
+        util.DEBUG_LOG("Reachability race for {0}: {1}", repr(self.name),
+                       lambda: " -> ".join(", ".join(c.address for c in tier) for tier in race.tiers))
+
+        self.startRaceTier(race, 0)
+        for i in range(1, len(race.tiers)):
+            timer = util.TIMER(reachability.RACE_STAGGER * i, callback.Callable(self.startRaceTier, [race, i]))
+            race.timers.append(timer)
+            util.APP.addTimer(timer)
+
+    def startRaceTier(self, race, idx):
+        with self.raceLock:
+            if race is not self.race or idx in race.started:
+                return
+            race.started.add(idx)
+            conns = race.tiers[idx]
+
+        for conn in conns:
+            if not conn.testReachability(self, race.allowFallback):
+                self.onReachabilityTestSkipped(conn)
+
+    def addPendingReachabilityTest(self, conn):
+        with self.raceLock:
+            if id(conn) in self.pendingTests:
+                return
+            self.pendingTests[id(conn)] = conn
+            self.pendingReachabilityRequests += 1
+            if conn.isSecure:
+                self.pendingSecureRequests += 1
+
+            if self.pendingReachabilityRequests == 1:
+                self.trigger("started:reachability")
+
+    def removePendingReachabilityTest(self, conn):
+        """
+        Returns False if conn's test wasn't pending anymore (e.g. a late result of a canceled test)
+        """
+        with self.raceLock:
+            if self.pendingTests.pop(id(conn), None) is None:
+                return False
+            self.pendingReachabilityRequests -= 1
+            if conn.isSecure:
+                self.pendingSecureRequests -= 1
+
+            if self.race:
+                self.race.pending.pop(id(conn), None)
+            return True
+
+    def endRace(self):
+        """
+        Stops the current race; connections it hasn't started testing yet aren't pending anymore
+        """
+        with self.raceLock:
+            race = self.race
+            if not race:
+                return
+            self.race = None
+            race.cancelTimers()
+            for conn in race.unstarted():
+                self.removePendingReachabilityTest(conn)
+
+    def onReachabilityTestSkipped(self, conn):
+        self.removePendingReachabilityTest(conn)
+        if self.pendingReachabilityRequests <= 0:
+            self.finishReachability()
+        else:
+            self.advanceRace()
+
+    def advanceRace(self):
+        """
+        Starts the next tier right away if all started tests are done
+        """
+        with self.raceLock:
+            race = self.race
+            if not race:
+                return
+
+            nextTier = race.nextTier()
+            if nextTier is None or race.running():
+                return
+
+        self.startRaceTier(race, nextTier)
+
+    def checkRaceWinner(self):
+        """
+        Cancels the remaining tests if the active connection can't be beaten by any of them anymore
+        """
+        with self.raceLock:
+            race = self.race
+            active = self.activeConnection
+            if not race or not race.pending or not active or active.state != active.STATE_REACHABLE:
+                return False
+
+            best = max(conn.getPotentialScore() for conn in race.pending.values())
+            if active.getScore() < best:
+                return False
+
+            # deferred results (e.g. insecure connections that aren't allowed) can't be canceled and arrive shortly
+            losers = [conn for conn in race.pending.values() if conn.hasPendingRequest]
+            unstarted = len(race.unstarted())
+            self.endRace()
+
+        util.DEBUG_LOG("Reachability race for {0} won by {1}, canceling {2} running and {3} queued tests",
+                       repr(self.name), active.address, len(losers), unstarted)
+        for conn in losers:
+            conn.cancelReachability()
+            conn.hasPendingRequest = False
+            self.removePendingReachabilityTest(conn)
+        return True
+
     def cancelReachability(self):
+        self.endRace()
+
         for i in range(len(self.connections)):
             conn = self.connections[i]
             conn.cancelReachability()
@@ -487,9 +693,9 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
     def onReachabilityResult(self, connection):
         connection.lastTestedAt = time.time()
         connection.hasPendingRequest = None
-        self.pendingReachabilityRequests -= 1
-        if connection.isSecure:
-            self.pendingSecureRequests -= 1
+        if not self.removePendingReachabilityTest(connection):
+            util.DEBUG_LOG("Ignoring late reachability result for {0}: {1}", repr(self.name), connection.address)
+            return
 
         util.DEBUG_LOG("Reachability result for {0}: {1} is {2}", repr(self.name), connection.address, connection.state)
 
@@ -509,7 +715,8 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
 
             util.DEBUG_LOG("Connection score: {0}, {1}", conn.address, lambda: conn.getScore(True))
 
-            if not best or conn.getScore() > best.getScore():
+            if not best or conn.getScore() > best.getScore() or \
+                    (conn.getScore() == best.getScore() and conn.isFasterThan(best)):
                 best = conn
 
         if best and best.state == best.STATE_REACHABLE:
@@ -519,15 +726,33 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             else:
                 util.DEBUG_LOG("Found a good connection for {0}, but holding out for better", repr(self.name))
 
+        if self.pendingReachabilityRequests > 0 and not self.checkRaceWinner():
+            self.advanceRace()
+
         if self.pendingReachabilityRequests <= 0:
-            # Retest the server with fallback enabled. hasFallback will only
-            # be True if there are available insecure connections and fallback
-            # is allowed.
+            self.finishReachability()
+            return
 
-            if self.hasFallback:
-                self.updateReachability(False, True)
-            else:
-                self.trigger("completed:reachability")
+        util.LOG("Active connection for {0} is {1}", repr(self.name), self.activeConnection)
+
+        from . import plexservermanager
+        plexservermanager.MANAGER.updateReachabilityResult(self, bool(self.activeConnection))
+
+    def finishReachability(self):
+        self.endRace()
+
+        if self.activeConnection and self.activeConnection.state == self.activeConnection.STATE_REACHABLE:
+            reachability.HISTORY.setWinner(self.uuid, self.activeConnection.address)
+        reachability.HISTORY.flush()
+
+        # Retest the server with fallback enabled. hasFallback will only
+        # be True if there are available insecure connections and fallback
+        # is allowed.
+
+        if self.hasFallback:
+            self.updateReachability(False, True)
+        else:
+            self.trigger("completed:reachability")
 
         util.LOG("Active connection for {0} is {1}", repr(self.name), self.activeConnection)
 
@@ -727,6 +952,7 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
             isFallback = hasSecureConn and conn['address'][:5] != "https" and not util.LOCAL_OVER_SECURE
             sources = plexconnection.PlexConnection.SOURCE_BY_VAL[conn['sources']]
             connection = plexconnection.PlexConnection(sources, conn['address'], conn['isLocal'], conn['token'], isFallback)
+            connection.isRelay = conn.get('isRelay', False)
 
             # Keep the secure connection on top
             if connection.isSecure and not util.LOCAL_OVER_SECURE:
@@ -756,6 +982,7 @@ class PlexServer(plexresource.PlexResource, signalsmixin.SignalsMixin):
                     'address': conn.address,
                     'isLocal': conn.isLocal,
                     'isSecure': conn.isSecure,
+                    'isRelay': conn.isRelay,
                     'token': conn.token
                 })
                 if conn == self.activeConnection:
@@ -781,6 +1008,36 @@ def createPlexServer():
     return PlexServer()
 
 
+class ConnectionRace(object):
+    """
+    State of one reachability race of a server; see PlexServer.startRace
+    """
+    def __init__(self, tiers, allowFallback=False):
+        self.tiers = tiers
+        self.allowFallback = allowFallback
+        self.started = set()
+        self.timers = []
+        # connections whose test hasn't finished (or started) yet, by id
+        self.pending = dict((id(conn), conn) for tier in tiers for conn in tier)
+
+    def nextTier(self):
+        for i in range(len(self.tiers)):
+            if i not in self.started:
+                return i
+        return None
+
+    def running(self):
+        return any(id(conn) in self.pending for i in self.started for conn in self.tiers[i])
+
+    def unstarted(self):
+        return [conn for i in range(len(self.tiers)) if i not in self.started for conn in self.tiers[i]]
+
+    def cancelTimers(self):
+        for timer in self.timers:
+            timer.cancel()
+        self.timers = []
+
+
 def createPlexServerForConnection(conn):
     obj = createPlexServer()
     obj.connections.append(conn)
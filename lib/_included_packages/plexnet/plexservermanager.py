@@ -378,6 +378,7 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                 isFallback = hasSecureConn and conn['address'][:5] != "https" and not util.LOCAL_OVER_SECURE
                 sources = plexconnection.PlexConnection.SOURCE_BY_VAL[conn['sources']]
                 connection = plexconnection.PlexConnection(sources, conn['address'], conn['isLocal'], conn['token'], isFallback)
+                connection.isRelay = conn.get('isRelay', False)
 
                 # Keep the secure connection on top
                 if connection.isSecure and not util.LOCAL_OVER_SECURE:
@@ -425,6 +426,7 @@ class PlexServerManager(signalsmixin.SignalsMixin):
                         'address': conn.address,
                         'isLocal': conn.isLocal,
                         'isSecure': conn.isSecure,
+                        'isRelay': conn.isRelay,
                         'token': conn.token
                     })
 
@@ -0,0 +1,191 @@
+# coding=utf-8
+"""
+Reachability bookkeeping shared by all servers: which network we're on, which connection of a server won the last
+reachability race on that network, and the measured round trip times and failures of each connection per network, so
+the next race can try the best candidates first.
+"""
+from __future__ import absolute_import
+
+import json
+import time
+import socket
+import threading
+
+from . import util
+
+# connection tiers, started in this order with RACE_STAGGER between them
+TIER_LAST_WINNER = 0
+TIER_LOCAL = 1
+TIER_SECURE_REMOTE = 2
+TIER_REMOTE = 3
+TIER_RELAY = 4
+# connections that failed FAIL_DEMOTE times in a row on this network
+TIER_FAILING = 5
+
+FAIL_DEMOTE = 3
+# weight of a new RTT sample in the moving average
+RTT_SMOOTHING = 0.3
+
+# seconds between starting the tests of two consecutive tiers
+RACE_STAGGER = 0.25
+
+
+def connectionTier(conn, lastWinner=None, stats=None):
+    if lastWinner and conn.address == lastWinner:
+        return TIER_LAST_WINNER
+    if stats and stats.get("fails", 0) >= FAIL_DEMOTE:
+        return TIER_FAILING
+    if conn.isRelay:
+        return TIER_RELAY
+    if conn.isLocal:
+        return TIER_LOCAL
+    if conn.isSecure:
+        return TIER_SECURE_REMOTE
+    return TIER_REMOTE
+
+
+def _localAddress(family, target):
+    # connecting a UDP socket doesn't send anything, but makes the OS pick the interface of the default route
+    s = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        s.connect((target, 9))
+        return s.getsockname()[0]
+    finally:
+        s.close()
+
+
+def currentNetworkID():
+    """
+    Returns an identifier of the network we're connected to (the /24 or /64 of the default route's local address)
+    """
+    try:
+        ip = _localAddress(socket.AF_INET, "192.0.2.1")
+        return ip.rsplit(".", 1)[0] + ".0/24"
+    except (socket.error, OSError):
+        pass
+
+    try:
+        ip = _localAddress(socket.AF_INET6, "2001:db8::1")
+        return ":".join(socket.inet_ntop(socket.AF_INET6, socket.inet_pton(socket.AF_INET6, ip)).split(":")[:4]) + \
+            "::/64"
+    except (socket.error, OSError, ValueError):
+        pass
+
+    return "unknown"
+
+
+class ReachabilityHistory(object):
+    """
+    Remembers per network the winning connection address of each server and, per connection address, the smoothed
+    round trip time ("rtt", ms), consecutive failures ("fails") and the time of the last success ("ok").
+
+    Results are kept in memory and written to the registry by flush.
+    """
+    REGISTRY_KEY = "PlexReachabilityHistory"
+    MAX_NETWORKS = 10
+    NETWORK_ID_TTL = 30
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = None
+        self._networkID = None
+        self._networkIDAt = 0
+        self._dirty = False
+
+    @property
+    def networkID(self):
+        if not self._networkID or time.time() - self._networkIDAt > self.NETWORK_ID_TTL:
+            self._networkID = currentNetworkID()
+            self._networkIDAt = time.time()
+        return self._networkID
+
+    def _load(self):
+        if self._data is None:
+            self._data = {}
+            jstring = util.INTERFACE.getRegistry(self.REGISTRY_KEY)
+            if jstring:
+                try:
+                    self._data = json.loads(jstring)
+                except ValueError:
+                    util.ERROR_LOG("Failed to parse reachability history")
+        return self._data
+
+    def _network(self, create=False):
+        networks = self._load()
+        network = networks.get(self.networkID)
+        if network is None and create:
+            network = networks[self.networkID] = {"winners": {}, "connections": {}}
+        return network
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+
+            networks = self._load()
+            if len(networks) > self.MAX_NETWORKS:
+                oldest = sorted(networks, key=lambda k: networks[k].get("seen", 0))
+                for key in oldest[:len(networks) - self.MAX_NETWORKS]:
+                    del networks[key]
+            util.INTERFACE.setRegistry(self.REGISTRY_KEY, json.dumps(networks))
+            self._dirty = False
+
+    def lastWinner(self, uuid):
+        with self._lock:
+            network = self._network()
+            return network and network["winners"].get(uuid) or None
+
+    def setWinner(self, uuid, address):
+        with self._lock:
+            network = self._network(create=True)
+            network["seen"] = int(time.time())
+            if network["winners"].get(uuid) == address:
+                return
+
+            network["winners"][uuid] = address
+            util.DEBUG_LOG("Remembering {0} as the best connection for {1} on {2}", address, uuid, self.networkID)
+            self._dirty = True
+
+    def connectionStats(self, address):
+        with self._lock:
+            network = self._network()
+            return network and network.setdefault("connections", {}).get(address) or None
+
+    def recordResult(self, address, success, rtt=None):
+        """
+        Records the outcome of a reachability test of address on the current network; rtt in seconds
+        """
+        with self._lock:
+            network = self._network(create=True)
+            stats = network.setdefault("connections", {}).setdefault(address, {"fails": 0})
+            if success:
+                stats["fails"] = 0
+                stats["ok"] = int(time.time())
+                if rtt is not None:
+                    rtt = round(rtt * 1000, 1)
+                    stats["rtt"] = round(stats["rtt"] + RTT_SMOOTHING * (rtt - stats["rtt"]), 1) \
+                        if stats.get("rtt") is not None else rtt
+            else:
+                stats["fails"] = stats.get("fails", 0) + 1
+            self._dirty = True
+            return stats
+
+    def rankKey(self, address):
+        """
+        Sort key for connections of the same tier: known-good and fast first, unknown next, failing last
+        """
+        stats = self.connectionStats(address)
+        if not stats:
+            return 1, 0
+        if stats.get("fails"):
+            return 2, stats["fails"]
+        return 0, stats.get("rtt") or 0
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
+            self._dirty = False
+            util.INTERFACE.setRegistry(self.REGISTRY_KEY, '')
+
+
+HISTORY = ReachabilityHistory()
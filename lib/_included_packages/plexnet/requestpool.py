@@ -0,0 +1,209 @@
+# coding=utf-8
+"""
+Bounded worker pool for asynchronous HttpRequests (reachability tests, timeline updates, resource refreshes, ...).
+
+Instead of spawning one thread per request, requests are queued and run by up to MAX_WORKERS threads, with at most
+MAX_PER_HOST requests in flight per host:port. Identical GET requests that are queued or running at the same time are
+coalesced into one job; every caller still receives its own callback.
+"""
+from __future__ import absolute_import
+
+import time
+import threading
+import collections
+
+from six.moves.urllib.parse import urlparse
+
+from . import asyncadapter
+from . import threadutils
+from . import util
+
+
+class AsyncJob(object):
+    """
+    One HTTP request performed on behalf of one or more (HttpRequest, RequestContext) members. Members can detach
+    (cancel) individually; the request itself is only aborted once no member is interested anymore.
+    """
+    __slots__ = ("pool", "request", "body", "contentType", "context", "key", "host", "members", "closed")
+
+    def __init__(self, pool, request, body, contentType, context, key):
+        self.pool = pool
+        self.request = request
+        self.body = body
+        self.contentType = contentType
+        self.context = context
+        self.key = key
+        self.host = urlparse(request.url).netloc
+        self.members = [(request, context)]
+        self.closed = False
+
+    @property
+    def canceled(self):
+        # HttpRequest._cancel is set on the class on shutdown
+        return not self.members or type(self.request)._cancel
+
+    def attach(self, request, context):
+        if self.closed:
+            return False
+
+        self.members.append((request, context))
+        return True
+
+    def detach(self, request):
+        """
+        Removes request from the members. Returns False if the job has already finished, in which case the caller
+        has to clean up its own request.
+        """
+        with self.pool.lock:
+            if self.closed:
+                return False
+
+            self.members = [m for m in self.members if m[0] is not request]
+            if self.members:
+                return True
+
+        # nobody's waiting for the result anymore; queued jobs are skipped by the pool
+        performer = self.request
+        performer.session.cancel()
+        performer.killSocket()
+        return True
+
+    def run(self):
+        if self.canceled:
+            self.pool.close(self)
+            return
+
+        res, error = self.request.perform(self.body, self.contentType, self.context, lambda: self.canceled)
+
+        members = self.pool.close(self)
+        for request, context in members:
+            try:
+                request.deliver(res, error, context)
+            except Exception as e:
+                util.ERROR(err=e)
+
+
+class AsyncRequestPool(object):
+    MAX_WORKERS = 8
+    # None: use the keep-alive pool size, so no request has to open a connection that can't be kept
+    MAX_PER_HOST = None
+    IDLE_TIMEOUT = 10
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self._queue = collections.deque()
+        self._coalesce = {}
+        self._running = {}
+        self._workers = 0
+        self._busy = 0
+        self._counter = 0
+        self.stats = {"requests": 0, "coalesced": 0, "canceled": 0, "peak_workers": 0}
+
+    @property
+    def maxPerHost(self):
+        return self.MAX_PER_HOST or asyncadapter.POOL_MAXSIZE
+
+    def submit(self, request, body=None, contentType=None, context=None):
+        """
+        Queues request and returns its AsyncJob
+        """
+        key = request.coalesceKey(body)
+        with self.lock:
+            self.stats["requests"] += 1
+            job = key and self._coalesce.get(key)
+            if job and job.attach(request, context):
+                self.stats["coalesced"] += 1
+                util.DEBUG_LOG("Coalescing request: {0}", lambda: util.cleanToken(request.url))
+                return job
+
+            job = AsyncJob(self, request, body, contentType, context, key)
+            if key:
+                self._coalesce[key] = job
+            self._queue.append(job)
+
+            if self._workers - self._busy < len(self._queue) and self._workers < self.MAX_WORKERS:
+                self._startWorker()
+            self.lock.notify()
+        return job
+
+    def _startWorker(self):
+        self._workers += 1
+        self._counter += 1
+        self.stats["peak_workers"] = max(self.stats["peak_workers"], self._workers)
+        t = threadutils.KillableThread(target=self._work, name='HTTP-ASYNC-{0}'.format(self._counter))
+        t.daemon = True
+        t.start()
+
+    def _next(self):
+        """
+        Pops the oldest job whose host has a free slot, dropping canceled jobs on the way
+        """
+        maxPerHost = self.maxPerHost
+        for job in list(self._queue):
+            if not job.members:
+                self._queue.remove(job)
+                self._drop(job)
+                self.stats["canceled"] += 1
+                continue
+
+            if self._running.get(job.host, 0) < maxPerHost:
+                self._queue.remove(job)
+                return job
+        return None
+
+    def _drop(self, job):
+        job.closed = True
+        if job.key and self._coalesce.get(job.key) is job:
+            del self._coalesce[job.key]
+
+    def _work(self):
+        while True:
+            with self.lock:
+                job = self._next()
+                idleSince = time.time()
+                while not job:
+                    remaining = self.IDLE_TIMEOUT - (time.time() - idleSince)
+                    if remaining <= 0:
+                        self._workers -= 1
+                        return
+                    self.lock.wait(remaining)
+                    job = self._next()
+
+                self._busy += 1
+                self._running[job.host] = self._running.get(job.host, 0) + 1
+
+            try:
+                job.run()
+            except Exception as e:
+                util.ERROR(err=e)
+            finally:
+                with self.lock:
+                    self._busy -= 1
+                    self._running[job.host] -= 1
+                    if not self._running[job.host]:
+                        del self._running[job.host]
+                    # a host slot became available
+                    self.lock.notify()
+
+    def close(self, job):
+        """
+        Marks job as finished, so no more requests are coalesced into it, and returns its remaining members
+        """
+        with self.lock:
+            self._drop(job)
+            return list(job.members)
+
+    def cancelAll(self):
+        with self.lock:
+            for job in self._queue:
+                self._drop(job)
+            self.stats["canceled"] += len(self._queue)
+            self._queue.clear()
+
+    def summary(self):
+        with self.lock:
+            return '{requests} requests, {coalesced} coalesced, {canceled} canceled while queued, ' \
+                   'at most {peak_workers} threads'.format(**self.stats)
+
+
+POOL = AsyncRequestPool()
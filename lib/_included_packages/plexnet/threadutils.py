@@ -92,3 +92,81 @@ class KillableThread(threading.Thread):
     #         self._Thread__target(*self._Thread__args, **self._Thread__kwargs)
     #     except KillThreadException:
     #         self.onKilled()
+
+
+class _Flight(object):
+    __slots__ = ("event", "result", "error", "waiters", "canceled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+        self.canceled = False
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls for the same key into one: the first caller runs the function, callers arriving while
+    it's running wait for and share its result (or exception). Results aren't kept after the call finished.
+
+    If the first caller's call was canceled (see do), the waiting callers don't get its result but call again.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, canceled=None):
+        """
+        Returns (result, shared); shared is True if the result came from another caller's call.
+
+        canceled is called after func when it ran for this caller; if it returns True, the result (or exception) is
+        only this caller's and waiting callers run the call again.
+        """
+        retry = False
+        while True:
+            with self._lock:
+                if not retry:
+                    self.calls += 1
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    flight.waiters += 1
+
+            if leader:
+                break
+
+            flight.event.wait()
+            if flight.canceled:
+                retry = True
+                continue
+            with self._lock:
+                self.shared += 1
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = func()
+            return flight.result, False
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            flight.canceled = bool(canceled and canceled())
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+    def toDict(self):
+        with self._lock:
+            return {"calls": self.calls, "shared": self.shared, "in_flight": len(self._flights)}
+
+    def summary(self):
+        if not self.calls:
+            return ''
+        return '{0} calls, {1} shared ({2:.0f}%)'.format(self.calls, self.shared, 100.0 * self.shared / self.calls)
@@ -67,7 +67,6 @@ LAN_REACHABILITY_TIMEOUT = 0.01                     # s
 CHECK_LOCAL = False
 LOCAL_OVER_SECURE = False
 DEBUG_REQUESTS = False
-CACHED_PLEX_URLS = {}
 REQUESTS_CACHE_EXPIRY = 168
 X_PLEX_CONTAINER_SIZE = 50                          # max results to return in a single search page
 
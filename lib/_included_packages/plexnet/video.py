@@ -553,24 +553,18 @@ class CachableItemsMixin(object):
     def cachable(self):
         return 'items' in util.INTERFACE.getPreference('cache_requests') and not self._not_cachable
 
-    def clearChildCaches(self, return_urls=False):
+    def clearChildCaches(self, return_refs=False):
         # clear caches of this season and its items
         if not self.cachable:
-            return
-        cks = []
-        urls = []
+            return [] if return_refs else None
+        cks = set()
         for e in self.getImmediateChildren():
-            cks_, urls_ = e.clearCache(return_urls=True)
-            cks += cks_
-            urls += urls_
-
-        cks = list(set(cks))
-        urls = list(set(urls))
+            cks.update(e.clearCache(return_refs=True))
 
-        if return_urls:
-            return cks, urls
+        if return_refs:
+            return list(cks)
 
-        self._clearCache(cks, urls)
+        self._clearCache(cks)
 
 
 class PlayableVideo(CachableItemsMixin, Video, media.RelatedMixin):
@@ -866,9 +860,9 @@ class Show(CachableItemsMixin, Video, media.RelatedMixin, SectionOnDeckMixin):
     def getImmediateChildren(self):
         return self.seasons()
 
-    def clearCache(self, return_urls=False, **kwargs):
-        if return_urls:
-            return self.clearChildCaches(return_urls=True)
+    def clearCache(self, return_refs=False, **kwargs):
+        if return_refs:
+            return self.clearChildCaches(return_refs=True)
         self.clearChildCaches()
 
 
@@ -922,9 +916,9 @@ class Season(CachableItemsMixin, Video):
     def getImmediateChildren(self):
         return self.episodes()
 
-    def clearCache(self, return_urls=False, **kwargs):
-        if return_urls:
-            return self.clearChildCaches(return_urls=True)
+    def clearCache(self, return_refs=False, **kwargs):
+        if return_refs:
+            return self.clearChildCaches(return_refs=True)
         self.clearChildCaches()
 
 
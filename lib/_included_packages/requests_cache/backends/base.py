@@ -95,6 +95,12 @@ class BaseCache(object):
         """
         self.delete(self._url_to_key(url))
 
+    def delete_urls(self, urls):
+        """ Delete responses associated with `urls` from cache
+        """
+        for key in self._urls_to_keys(urls):
+            self.delete(key)
+
     def clear(self):
         """ Clear cache
         """
@@ -131,6 +137,10 @@ class BaseCache(object):
         session = requests.Session()
         return self.create_key(session.prepare_request(requests.Request('GET', url)))
 
+    def _urls_to_keys(self, urls):
+        session = requests.Session()
+        return [self.create_key(session.prepare_request(requests.Request('GET', url))) for url in urls]
+
     _response_attrs = ['_content', 'url', 'status_code', 'cookies',
                        'headers', 'encoding', 'request', 'reason', 'raw']
 
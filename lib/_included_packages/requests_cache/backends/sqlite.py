@@ -45,6 +45,22 @@ class DbCache(BaseCache):
     def vacuum(self):
         self.responses.vacuum()
 
+    def delete_urls(self, urls):
+        """ Delete responses associated with `urls` and any keys mapped to them in a single transaction
+        """
+        keys = self._urls_to_keys(urls)
+        if not keys:
+            return
+
+        with self.responses.connection(True) as con:
+            # stay below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(keys), 400):
+                chunk = keys[i:i + 400]
+                marks = ",".join("?" * len(chunk))
+                con.execute("delete from `%s` where key in (%s)" % (self.responses.table_name, marks), chunk)
+                con.execute("delete from `%s` where key in (%s) or value in (%s)" %
+                            (self.keys_map.table_name, marks, marks), chunk + chunk)
+
     def clear(self):
         super(DbCache, self).clear()
         self.other.clear()
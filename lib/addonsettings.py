@@ -10,6 +10,7 @@ class AddonSettings(object):
     _proxiedSettings = (
         ("debug", False),
         ("debug_requests", False),
+        ("request_metrics", False),
         ("kodi_skip_stepping", False),
         ("auto_seek", True),
         ("auto_seek_delay", 1),
@@ -49,8 +50,11 @@ class AddonSettings(object):
         ("subtitle_use_extended_title", True),
         ("poster_resolution_scale_perc", 100),
         ("consecutive_video_pb_wait", 0.0),
+        ("prefetch_next_playback", True),
+        ("local_seek_thumbnails", True),
         ("retrieve_all_media_up_front", False),
         ("library_chunk_size", 240),
+        ("prefetch_posters", 24),
         ("verify_mapped_files", True),
         ("episode_no_spoiler_blur", 16),
         ("ignore_docker_v4", True),
@@ -58,9 +62,11 @@ class AddonSettings(object):
         ("intro_marker_max_offset", 600),
         ("hubs_rr_max", 250),
         ("max_retries1", 3),
+        ("keepalive_connections", 4),
         ("use_cert_bundle", "acme"),
         ("cache_templates", True),
         ("always_compile_templates", False),
+        ("parallel_template_rendering", False),
         ("tickrate", 1.0),
         ("honor_plextv_dnsrebind", True),
         ("honor_plextv_pam", True),
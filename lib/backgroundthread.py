@@ -1,6 +1,8 @@
 from __future__ import absolute_import
 import six.moves.queue
 import heapq
+import threading
+import time
 from kodi_six import xbmc
 from .monitor import MONITOR
 from .settings_util import getSetting
@@ -10,20 +12,26 @@ from plexnet import threadutils
 from six.moves import range
 
 
+NO_DEADLINE = float('inf')
+
+
 class Tasks(list):
+    """
+    A group of tasks, usually owned by a window. Canceling the group also removes its queued tasks from the threader,
+    so they don't hold up the workers after the window has been closed or has moved on.
+    """
     def add(self, task):
-        for t in self:
-            if not t.isValid():
-                self.remove(t)
+        self[:] = [t for t in self if t.isValid()]
 
-        if isinstance(task, list):
-            self += task
-        else:
-            self.append(task)
+        tasks = task if isinstance(task, list) else [task]
+        for t in tasks:
+            t.group = self
+        self += tasks
 
     def cancel(self):
         while self:
             self.pop().cancel()
+        BGThreader.purge()
 
     def kill(self):
         self.cancel()
@@ -31,23 +39,47 @@ class Tasks(list):
 
 
 class Task:
+    # queued tasks with the same supersedeKey are replaced by the newest one
+    supersedeKey = None
+    # whether the task may be dropped when the queue is full
+    droppable = False
+
     def __init__(self, priority=None):
         self._priority = priority
         self._canceled = False
         self.finished = False
+        self.deadline = None
+        self.group = None
+        self.queuedAt = None
+        self.startedAt = None
+        self.finishedAt = None
+
+    def _sortKey(self):
+        return (NO_DEADLINE if self.deadline is None else self.deadline, self._priority)
 
     def __cmp__(self, other):
-        return self._priority - other._priority
+        a, b = self._sortKey(), other._sortKey()
+        return (a > b) - (a < b)
+
+    def __lt__(self, other):
+        return self._sortKey() < other._sortKey()
 
     def __le__(self, other):
-        return self._priority < other._priority
+        return self._sortKey() < other._sortKey()
 
     def __gt__(self, other):
-        return self._priority > other._priority
+        return self._sortKey() > other._sortKey()
 
     def __bool__(self):
         return self.isValid()
 
+    def setDeadline(self, seconds):
+        """
+        Tasks with a deadline run before tasks without one, earliest deadline first
+        """
+        self.deadline = time.time() + seconds
+        return self
+
     def start(self):
         BGThreader.addTask(self)
 
@@ -85,22 +117,85 @@ class MutablePriorityQueue(six.moves.queue.PriorityQueue):
             self.mutex.release()
         return lowest
 
+    def tasks(self):
+        with self.mutex:
+            return list(self.queue)
+
+    def purge(self):
+        """Remove canceled tasks; returns the number of removed tasks."""
+        with self.mutex:
+            before = len(self.queue)
+            self.queue[:] = [t for t in self.queue if not t._canceled]
+            removed = before - len(self.queue)
+            if removed:
+                heapq.heapify(self.queue)
+                self.unfinished_tasks = max(0, self.unfinished_tasks - removed)
+                self.not_full.notify_all()
+            return removed
+
+
+class TaskStats(object):
+    """
+    Queue-wait and run-time statistics per task class
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.data = {}
+
+    def _get(self, task):
+        name = task.__class__.__name__
+        if name not in self.data:
+            self.data[name] = {"count": 0, "canceled": 0, "dropped": 0, "wait": 0.0, "run": 0.0, "max_wait": 0.0,
+                               "max_run": 0.0}
+        return self.data[name]
+
+    def add(self, task):
+        with self._lock:
+            d = self._get(task)
+            d["count"] += 1
+            wait = task.startedAt - (task.queuedAt or task.startedAt)
+            run = task.finishedAt - task.startedAt
+            d["wait"] += wait
+            d["run"] += run
+            d["max_wait"] = max(d["max_wait"], wait)
+            d["max_run"] = max(d["max_run"], run)
+
+    def discard(self, task, dropped=False):
+        with self._lock:
+            self._get(task)["dropped" if dropped else "canceled"] += 1
+
+    def summary(self):
+        with self._lock:
+            return ", ".join(
+                "{0}: {1} run (avg wait {2:.0f} ms, avg run {3:.0f} ms, max wait {4:.0f} ms), {5} canceled, "
+                "{6} dropped".format(name, d["count"], d["count"] and d["wait"] / d["count"] * 1000 or 0,
+                                     d["count"] and d["run"] / d["count"] * 1000 or 0, d["max_wait"] * 1000,
+                                     d["canceled"], d["dropped"])
+                for name, d in sorted(self.data.items()))
+
 
 class BackgroundWorker:
-    def __init__(self, queue, name=None):
+    def __init__(self, queue, name=None, stats=None):
         self._queue = queue
         self.name = name
+        self._stats = stats
         self._thread = None
         self._abort = False
         self._task = None
 
     def _runTask(self, task):
         if task._canceled:
+            if self._stats:
+                self._stats.discard(task)
             return
+        task.startedAt = time.time()
         try:
             task._run()
         except:
             logging.ERROR()
+        task.finishedAt = time.time()
+        if self._stats:
+            self._stats.add(task)
 
     def abort(self):
         self._abort = True
@@ -152,17 +247,48 @@ class BackgroundWorker:
 
 
 class BackgroundThreader:
+    # upper bound of queued tasks; once reached, the least urgent droppable tasks are discarded
+    MAX_QUEUE_SIZE = 500
+
     def __init__(self, name=None, worker_count=5):
         self.name = name
         self._queue = MutablePriorityQueue()
         self._abort = False
         self._priority = -1
-        self.workers = [BackgroundWorker(self._queue, 'queue.{0}:worker.{1}'.format(self.name, x)) for x in range(worker_count)]
+        self.stats = TaskStats()
+        self.workers = [BackgroundWorker(self._queue, 'queue.{0}:worker.{1}'.format(self.name, x), stats=self.stats)
+                        for x in range(worker_count)]
 
     def _nextPriority(self):
         self._priority += 1
         return self._priority
 
+    def _put(self, task):
+        task.queuedAt = time.time()
+        if task.supersedeKey is not None or self._queue.qsize() >= self.MAX_QUEUE_SIZE:
+            queued = self._queue.tasks()
+            discard = []
+            if task.supersedeKey is not None:
+                discard = [t for t in queued if t.supersedeKey == task.supersedeKey and not t._canceled]
+                for t in discard:
+                    t.cancel()
+                    self.stats.discard(t)
+
+            overflow = len(queued) - len(discard) - self.MAX_QUEUE_SIZE + 1
+            if overflow > 0:
+                dropped = sorted((t for t in queued if t.droppable and not t._canceled), reverse=True)[:overflow]
+                for t in dropped:
+                    t.cancel()
+                    self.stats.discard(t, dropped=True)
+                if dropped:
+                    logging.DEBUG_LOG('BGThreader: queue full, dropped {0} tasks', len(dropped))
+                discard += dropped
+
+            if discard:
+                self._queue.purge()
+
+        self._queue.put(task)
+
     def abort(self):
         self._abort = True
         for w in self.workers:
@@ -178,27 +304,34 @@ class BackgroundThreader:
         for w in self.workers:
             w.shutdown()
 
+        summary = self.stats.summary()
+        if summary:
+            logging.DEBUG_LOG('BGThreader ({0}): {1}', self.name, summary)
+
     def addTask(self, task):
         task._priority = self._nextPriority()
-        self._queue.put(task)
+        self._put(task)
         self.startWorkers()
 
     def addTasks(self, tasks):
         for t in tasks:
             t._priority = self._nextPriority()
-            self._queue.put(t)
+            self._put(t)
 
         self.startWorkers()
 
     def addTasksToFront(self, tasks):
-        lowest = self.getLowestPrority()
+        lowest = self._queue.lowest()
         if lowest is None:
             return self.addTasks(tasks)
 
-        p = lowest - len(tasks)
+        p = lowest._priority - len(tasks)
         for t in tasks:
             t._priority = p
-            self._queue.put(t)
+            # ahead of the front task's deadline, unless the task's own is earlier
+            if t.deadline is None or (lowest.deadline is not None and lowest.deadline < t.deadline):
+                t.deadline = lowest.deadline
+            self._put(t)
             p += 1
 
         self.startWorkers()
@@ -221,11 +354,27 @@ class BackgroundThreader:
         return lowest._priority
 
     def moveToFront(self, qitem):
-        lowest = self.getLowestPrority()
-        if lowest is None:
+        lowest = self._queue.lowest()
+        if lowest is None or lowest is qitem:
             return
 
-        qitem._priority = lowest - 1
+        qitem._priority = lowest._priority - 1
+        qitem.deadline = lowest.deadline
+
+    def cancelGroup(self, group):
+        """
+        Cancels all queued and running tasks belonging to group
+        """
+        for t in self._queue.tasks():
+            if t.group is group:
+                t.cancel()
+        for w in self.workers:
+            if w._task and w._task.group is group:
+                w._task.cancel()
+        return self.purge()
+
+    def purge(self):
+        return self._queue.purge()
 
     def kill(self):
         for w in self.workers:
@@ -0,0 +1,240 @@
+# coding=utf-8
+
+import os
+import mmap
+import struct
+import bisect
+import shutil
+import threading
+import collections
+
+from plexnet import http, threadutils
+from plexnet import util as pnUtil
+
+from . import util
+
+
+BIF_MAGIC = b"\x89BIF\r\n\x1a\n"
+BIF_HEADER_SIZE = 64
+BIF_INDEX_END = 0xffffffff
+
+
+class BifError(Exception):
+    pass
+
+
+class BifFile(object):
+    """
+    A memory-mapped BIF (Roku trickplay index) file: a 64 byte header, a table of (timestamp, byte offset) pairs,
+    terminated by a 0xffffffff timestamp, followed by the JPEG frames.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._file.close()
+            raise
+
+        try:
+            self.timestamps, self.offsets = self._parse(self._data)
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def _parse(data):
+        size = len(data)
+        if size < BIF_HEADER_SIZE or data[:8] != BIF_MAGIC:
+            raise BifError("Not a BIF file")
+
+        count, separation = struct.unpack_from("<II", data, 12)
+        # timestamps are in units of separation ms, 0 means seconds
+        separation = separation or 1000
+
+        timestamps = []
+        offsets = []
+        pos = BIF_HEADER_SIZE
+        for x in range(count + 1):
+            if pos + 8 > size:
+                break
+            timestamp, offset = struct.unpack_from("<II", data, pos)
+            pos += 8
+            if offset > size or offsets and offset < offsets[-1]:
+                raise BifError("Invalid frame offset")
+
+            offsets.append(offset)
+            if timestamp == BIF_INDEX_END:
+                break
+            timestamps.append(timestamp * separation)
+
+        # the end marker may be missing; the last frame then reaches to the end of the file
+        if len(offsets) == len(timestamps):
+            offsets.append(size)
+
+        if not timestamps:
+            raise BifError("BIF file contains no frames")
+
+        return timestamps, offsets
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frameIndex(self, offset):
+        """
+        Index of the frame shown at offset (ms)
+        """
+        return max(0, bisect.bisect_right(self.timestamps, offset) - 1)
+
+    def frame(self, index):
+        return self._data[self.offsets[index]:self.offsets[index + 1]]
+
+    def close(self):
+        try:
+            self._data.close()
+        finally:
+            self._file.close()
+
+
+class TrickplayCache(object):
+    """
+    Serves seek bar thumbnails of the playing media from its locally downloaded BIF index instead of requesting every
+    seek position's frame from the server.
+
+    The indexes of all parts are downloaded once when playback starts and memory-mapped. Kodi can only show images
+    from a path, so requested frames are cut out and written to small files, of which at most MAX_FILES are kept.
+    Everything is removed when playback ends.
+    """
+    MAX_FILES = 100
+
+    def __init__(self):
+        self.path = os.path.join(util.translatePath("special://temp/"), "plex_bif")
+        self._lock = threading.Lock()
+        self._key = None
+        self._session = None
+        self._bifs = {}
+        self._files = collections.OrderedDict()
+
+    @property
+    def enabled(self):
+        return util.addonSettings.localSeekThumbnails
+
+    def load(self, playerObject):
+        """
+        Starts downloading the BIF indexes of playerObject's media, unless they're already loaded
+        """
+        if not self.enabled or not playerObject or not playerObject.media:
+            return
+
+        server = playerObject.item.getServer()
+        parts = []
+        for part in playerObject.media.parts:
+            path = part.getIndexPath("hd") or part.getIndexPath("sd")
+            if path:
+                parts.append((str(part.id), server.buildUrl(path, True)))
+
+        key = tuple(partID for partID, url in parts)
+        if not key or key == self._key:
+            return
+
+        self.clear()
+        session = http.Session()
+        with self._lock:
+            self._key = key
+            self._session = session
+
+        t = threadutils.KillableThread(target=self._download, args=(key, parts, session), name='BIF-DOWNLOAD')
+        t.daemon = True
+        t.start()
+
+    def _download(self, key, parts, session):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        for partID, url in parts:
+            fn = os.path.join(self.path, "{0}.bif".format(partID))
+            try:
+                r = session.get(url, stream=True)
+                r.raise_for_status()
+                with open(fn, "wb") as f:
+                    for chunk in r.iter_content(65536):
+                        if self._key != key:
+                            return
+                        f.write(chunk)
+                bif = BifFile(fn)
+            except Exception as e:
+                if self._key == key:
+                    util.LOG("Couldn't download seek thumbnails of part {0} ({1}): {2}", partID,
+                             pnUtil.cleanToken(url), e)
+                continue
+
+            with self._lock:
+                if self._key != key:
+                    bif.close()
+                    return
+                self._bifs[partID] = bif
+            util.DEBUG_LOG("Downloaded {0} seek thumbnails of part {1}", len(bif), partID)
+
+    def getFrame(self, playerObject, offset):
+        """
+        Returns the path of a local image of the frame at offset (ms), or None if the index isn't available (yet)
+        """
+        if not self._bifs:
+            return None
+
+        startOffset = 0
+        for part in playerObject.media.parts:
+            duration = part.duration.asInt()
+            if startOffset <= offset < startOffset + duration:
+                break
+            startOffset += duration
+        else:
+            return None
+
+        partID = str(part.id)
+        with self._lock:
+            bif = self._bifs.get(partID)
+            if not bif:
+                return None
+
+            index = bif.frameIndex(offset - startOffset)
+            fn = os.path.join(self.path, "{0}_{1}.jpg".format(partID, index))
+            if fn in self._files:
+                self._files.move_to_end(fn)
+                return fn
+
+            try:
+                with open(fn, "wb") as f:
+                    f.write(bif.frame(index))
+            except (IOError, OSError) as e:
+                util.DEBUG_LOG("Couldn't write seek thumbnail {0}: {1}", fn, e)
+                return None
+
+            self._files[fn] = None
+            while len(self._files) > self.MAX_FILES:
+                self._remove(self._files.popitem(last=False)[0])
+        return fn
+
+    @staticmethod
+    def _remove(fn):
+        try:
+            os.remove(fn)
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            if self._session:
+                self._session.cancel()
+            self._key = None
+            self._session = None
+            for bif in self._bifs.values():
+                bif.close()
+            self._bifs = {}
+            self._files.clear()
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+TRICKPLAY = TrickplayCache()
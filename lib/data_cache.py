@@ -3,8 +3,8 @@
 import os
 import json
 import time
-import copy
-import zlib
+import sqlite3
+import threading
 
 from kodi_six import xbmcvfs
 
@@ -14,79 +14,153 @@ from . util import translatePath, ADDON, ERROR, DEBUG_LOG, LOG
 
 
 class DataCacheManager(object):
-    # store arbitrary data in JSON on disk
-    DATA_CACHES_VERSION = 2
-    DATA_CACHES = {
-        "general": {},
-        "cache": {}
-    }
-    DC_LAST_UPDATE = None
-    DC_PATH = os.path.join(translatePath(ADDON.getAddonInfo("profile")), "data_cache.json")
+    """
+    Stores arbitrary JSON-serializable data per (server, context, identifier) in an sqlite database.
+
+    Entries are read from disk lazily on first access. Changed entries and access times are buffered and written on
+    storeDataCache (or once the buffer grows beyond DC_FLUSH_THRESHOLD), so only changed rows hit the disk. Expiry is
+    done via indexes on the timestamps instead of scanning the whole cache.
+    """
+    DATA_CACHES_VERSION = 3
+    DC_PROFILE = translatePath(ADDON.getAddonInfo("profile"))
+    DC_PATH = os.path.join(DC_PROFILE, "data_cache.db")
+    DC_LEGACY_PATHS = (os.path.join(DC_PROFILE, "data_cache.json"), os.path.join(DC_PROFILE, "data_cache.jsonz"))
     DC_LRU_TIMEOUT = 30
     DC_LRUP_TIMEOUT = 90
-    USE_GZ = False
+    DC_FLUSH_THRESHOLD = 100
 
     def __init__(self):
         self._currentServerUUID = None
+        self._lock = threading.RLock()
+        self._db = None
+        # (server, context, identifier): entry dict or None if known to be missing
+        self._entries = {}
+        self._dirty = set()
+        self._touched = set()
+        self._deleted = set()
+
         plexapp.util.APP.on('change:selectedServer', self.setServerUUID)
         plexapp.util.APP.on('change:tempServer', self.setServerUUID)
-        if self.USE_GZ:
-            self.DC_PATH += "z"
-        if xbmcvfs.exists(self.DC_PATH):
+
+        try:
+            self._db = self._connect()
+            self.migrateLegacy()
+            self.dataCacheCleanup()
+        except:
+            ERROR("Couldn't open data cache")
+            self._db = None
+
+    def _connect(self):
+        if not xbmcvfs.exists(self.DC_PROFILE):
+            xbmcvfs.mkdirs(self.DC_PROFILE)
+
+        db = sqlite3.connect(self.DC_PATH, timeout=10, check_same_thread=False)
+        db.execute("CREATE TABLE IF NOT EXISTS general (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                   "server TEXT, context TEXT, identifier TEXT, data TEXT, updated REAL, last_access REAL, "
+                   "PRIMARY KEY (server, context, identifier))")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        db.execute("CREATE INDEX IF NOT EXISTS entries_updated ON entries (updated)")
+        db.execute("INSERT OR REPLACE INTO general (key, value) VALUES ('version', ?)",
+                   (str(self.DATA_CACHES_VERSION),))
+        db.commit()
+        return db
+
+    def migrateLegacy(self):
+        """
+        Imports the entries of the old single-file JSON data cache once and removes the file afterwards
+        """
+        for path in self.DC_LEGACY_PATHS:
+            if not xbmcvfs.exists(path):
+                continue
+
             try:
-                f = xbmcvfs.File(self.DC_PATH)
-                d = f.readBytes() if self.USE_GZ else f.read()
+                f = xbmcvfs.File(path)
+                d = f.readBytes()
                 f.close()
-
-                tdc = json.loads(zlib.decompress(d).decode("utf-8") if self.USE_GZ else d)
-                old_ver = tdc["general"].get("version", 0)
-                if old_ver < self.DATA_CACHES_VERSION:
-                    # this is where we migrate
-                    if old_ver == 1:
-                        tdc = self.DATA_CACHES.copy()
-                    tdc["general"]["version"] = self.DATA_CACHES_VERSION
-                    tdc["general"]["updated"] = time.time()
-                    self.DATA_CACHES = tdc
-                    self.storeDataCache()
-                else:
-                    tdc["general"]["version"] = self.DATA_CACHES_VERSION
-                    self.DATA_CACHES.update(tdc)
-                self.dataCacheCleanup()
-                self.DC_LAST_UPDATE = self.DATA_CACHES["general"]["updated"]
+                if path.endswith("z"):
+                    import zlib
+                    d = zlib.decompress(d)
+
+                tdc = json.loads(d.decode("utf-8"))
+                # version 1 caches were discarded on upgrade before as well
+                if tdc["general"].get("version", 0) > 1:
+                    rows = []
+                    for server, contexts in tdc["cache"].items():
+                        for context, identifiers in contexts.items():
+                            for identifier, iddata in identifiers.items():
+                                if iddata.get("data"):
+                                    rows.append((server, context, identifier, json.dumps(iddata["data"]),
+                                                 iddata["updated"], iddata["last_access"]))
+
+                    with self._lock:
+                        self._db.executemany("INSERT OR REPLACE INTO entries "
+                                             "(server, context, identifier, data, updated, last_access) "
+                                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+                        self._db.commit()
+                    LOG("Data cache: migrated {} entries from {}".format(len(rows), os.path.basename(path)))
             except:
-                ERROR("Couldn't read data_cache.json")
-                self.DATA_CACHES["general"]["updated"] = time.time()
-                self.storeDataCache()
+                ERROR("Couldn't migrate {}".format(os.path.basename(path)))
+
+            xbmcvfs.delete(path)
 
     def deinit(self):
         plexapp.util.APP.off('change:selectedServer', self.setServerUUID)
         plexapp.util.APP.off('change:tempServer', self.setServerUUID)
+        with self._lock:
+            if self._db:
+                self._db.close()
+                self._db = None
 
-    def getCacheData(self, context, identifier):
-        ret = self.DATA_CACHES["cache"].get(self._currentServerUUID, {}).get(context, {}).get(identifier, {})
-        if "data" in ret and ret["data"]:
-            # purge old data (> X days last updated)
-            if ret["updated"] < time.time() - self.DC_LRUP_TIMEOUT * 3600 * 24:
-                del self.DATA_CACHES["cache"][self._currentServerUUID][context][identifier]
-                return None
+    def _load(self, key):
+        if key in self._entries:
+            return self._entries[key]
 
-            self.DATA_CACHES["cache"][self._currentServerUUID][context][identifier]["last_access"] = time.time()
-            return ret["data"]
+        entry = None
+        if self._db and key not in self._deleted:
+            try:
+                row = self._db.execute("SELECT data, updated, last_access FROM entries "
+                                       "WHERE server = ? AND context = ? AND identifier = ?", key).fetchone()
+                if row:
+                    entry = {"data": json.loads(row[0]), "updated": row[1], "last_access": row[2]}
+            except:
+                ERROR("Couldn't read data cache entry: {}".format(key))
+
+        self._entries[key] = entry
+        return entry
+
+    def getCacheData(self, context, identifier):
+        key = (self._currentServerUUID, context, identifier)
+        with self._lock:
+            ret = self._load(key)
+            if ret and ret["data"]:
+                # purge old data (> X days last updated)
+                if ret["updated"] < time.time() - self.DC_LRUP_TIMEOUT * 3600 * 24:
+                    self._entries[key] = None
+                    self._dirty.discard(key)
+                    self._touched.discard(key)
+                    self._deleted.add(key)
+                    return None
+
+                ret["last_access"] = time.time()
+                if key not in self._dirty:
+                    self._touched.add(key)
+                return ret["data"]
 
     def setCacheData(self, context, identifier, value):
-        if self._currentServerUUID not in self.DATA_CACHES["cache"]:
-            self.DATA_CACHES["cache"][self._currentServerUUID] = {}
-        if context not in self.DATA_CACHES["cache"][self._currentServerUUID]:
-            self.DATA_CACHES["cache"][self._currentServerUUID][context] = {}
-        if identifier not in self.DATA_CACHES["cache"][self._currentServerUUID][context]:
-            self.DATA_CACHES["cache"][self._currentServerUUID][context][identifier] = {}
+        key = (self._currentServerUUID, context, identifier)
         t = time.time()
-        self.DATA_CACHES["general"]["updated"] = t
-        self.DATA_CACHES["cache"][self._currentServerUUID][context][identifier] = {
-            "updated": t,
-            "last_access": t,
-            "data": value
-        }
+        with self._lock:
+            self._entries[key] = {
+                "updated": t,
+                "last_access": t,
+                "data": value
+            }
+            self._dirty.add(key)
+            self._touched.discard(key)
+            self._deleted.discard(key)
+            if len(self._dirty) >= self.DC_FLUSH_THRESHOLD:
+                self.storeDataCache()
 
     def setServerUUID(self, server=None, **kwargs):
         if not server and not plexapp.SERVERMANAGER.selectedServer:
@@ -94,30 +168,45 @@ class DataCacheManager(object):
         self._currentServerUUID = (server if server is not None else plexapp.SERVERMANAGER.selectedServer).uuid[-8:]
 
     def dataCacheCleanup(self):
-        d = copy.deepcopy(self.DATA_CACHES)
+        """
+        Drops everything not accessed during the last DC_LRU_TIMEOUT days or not updated during the last
+        DC_LRUP_TIMEOUT days
+        """
         t = time.time()
-        for k, contexts in d["cache"].items():
-            for context, identifiers in contexts.items():
-                for identifier, iddata in identifiers.items():
-                    # clean up anything not accessed during the last X days
-                    if iddata["last_access"] < t - self.DC_LRU_TIMEOUT * 3600 * 24:
-                        DEBUG_LOG("Clearing cached data for: {}: {}".format(context, identifier))
-                        del self.DATA_CACHES["cache"][k][context][identifier]
+        with self._lock:
+            if not self._db:
+                return
+            cur = self._db.execute("DELETE FROM entries WHERE last_access < ? OR updated < ?",
+                                   (t - self.DC_LRU_TIMEOUT * 3600 * 24, t - self.DC_LRUP_TIMEOUT * 3600 * 24))
+            self._db.commit()
+            if cur.rowcount:
+                DEBUG_LOG("Data cache: cleared {} expired entries".format(cur.rowcount))
+                self._entries = {}
 
     def storeDataCache(self):
-        lu = self.DATA_CACHES["general"].get("updated")
-        if self.DATA_CACHES and lu and self.DC_LAST_UPDATE != lu:
+        with self._lock:
+            if not self._db or not (self._dirty or self._touched or self._deleted):
+                return
+
             try:
-                dcf = xbmcvfs.File(self.DC_PATH, "w")
-                self.dataCacheCleanup()
-                d = json.dumps(self.DATA_CACHES)
-                if self.USE_GZ:
-                    d = zlib.compress(d.encode("utf-8"))
-                dcf.write(d)
-                dcf.close()
-                LOG("Data cache written to: addon_data/script.plexmod/data_cache.json")
+                self._db.executemany("INSERT OR REPLACE INTO entries "
+                                     "(server, context, identifier, data, updated, last_access) "
+                                     "VALUES (?, ?, ?, ?, ?, ?)",
+                                     [key + (json.dumps(self._entries[key]["data"]), self._entries[key]["updated"],
+                                             self._entries[key]["last_access"]) for key in self._dirty])
+                self._db.executemany("UPDATE entries SET last_access = ? "
+                                     "WHERE server = ? AND context = ? AND identifier = ?",
+                                     [(self._entries[key]["last_access"],) + key for key in self._touched])
+                self._db.executemany("DELETE FROM entries WHERE server = ? AND context = ? AND identifier = ?",
+                                     list(self._deleted))
+                self._db.commit()
+                DEBUG_LOG("Data cache: wrote {} entries, {} access times, removed {}".format(
+                    len(self._dirty), len(self._touched), len(self._deleted)))
+                self._dirty = set()
+                self._touched = set()
+                self._deleted = set()
             except:
-                ERROR("Couldn't write data_cache.json")
+                ERROR("Couldn't write data cache")
 
 
 dcm = DataCacheManager()
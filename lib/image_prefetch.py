@@ -0,0 +1,147 @@
+# coding=utf-8
+
+import threading
+import collections
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from plexnet import http, threadutils
+from plexnet import util as pnUtil
+
+from . import util
+
+
+class ImagePrefetchManager(object):
+    """
+    Warms the transcoded poster URLs of list items that are about to scroll into view.
+
+    Kodi's texture loader fetches thumbnails one by one once an item becomes visible, which makes the server transcode
+    every image on demand. Requesting the upcoming images in the background beforehand lets the server's photo
+    transcoder cache answer those fetches right away.
+
+    URLs are deduplicated across hubs and windows, fetched by a bounded number of workers over a shared connection
+    pool, and the most recently requested batch is fetched first.
+    """
+    WORKERS = 3
+    # drop queued URLs the user has most likely scrolled past already
+    QUEUE_MAX = 200
+    SEEN_MAX = 5000
+    TIMEOUT = 10
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._seen = collections.OrderedDict()
+        self._workers = []
+        self._session = None
+        self._stopped = False
+
+    @property
+    def count(self):
+        return util.addonSettings.prefetchPosters
+
+    def _getSession(self):
+        if not self._session:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.WORKERS)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            session.headers = pnUtil.BASE_HEADERS.copy()
+            bundle = http.certBundle()
+            if bundle:
+                session.verify = bundle
+            self._session = session
+        return self._session
+
+    def prefetch(self, urls, count=None):
+        """
+        Queues up to count (default: the prefetch_posters setting) of urls for warming
+        """
+        count = self.count if count is None else count
+        if not count or self._stopped:
+            return
+
+        batch = []
+        with self._cond:
+            for url in urls:
+                if len(batch) >= count:
+                    break
+                if not url or "://" not in url or url in self._seen:
+                    continue
+
+                self._seen[url] = None
+                batch.append(url)
+
+            if not batch:
+                return
+
+            while len(self._seen) > self.SEEN_MAX:
+                self._seen.popitem(last=False)
+
+            # newest batch first, in its own order
+            self._queue.extendleft(reversed(batch))
+            while len(self._queue) > self.QUEUE_MAX:
+                self._seen.pop(self._queue.pop(), None)
+
+            self._cond.notify(len(batch))
+            self._startWorkers()
+
+    def _startWorkers(self):
+        # called with the lock held; exiting workers have already removed themselves
+        self._getSession()
+        for x in range(self.WORKERS - len(self._workers)):
+            w = threadutils.KillableThread(target=self._work, name='IMAGE-PREFETCH({0})'.format(x))
+            w.daemon = True
+            self._workers.append(w)
+            w.start()
+
+    def _work(self):
+        try:
+            while not self._stopped and not util.MONITOR.abortRequested():
+                with self._cond:
+                    if not self._queue:
+                        # idle workers exit and are restarted by prefetch
+                        self._cond.wait(5)
+                        if not self._queue:
+                            # deregister while still holding the lock, so prefetch starts a new worker for what it
+                            # queues next instead of counting on this one
+                            self._workers.remove(threading.current_thread())
+                            return
+                    url = self._queue.popleft()
+
+                self._fetch(url)
+        finally:
+            with self._cond:
+                if threading.current_thread() in self._workers:
+                    self._workers.remove(threading.current_thread())
+
+    def _fetch(self, url):
+        try:
+            r = self._getSession().get(url, timeout=self.TIMEOUT, stream=True)
+            # read (and discard) the whole body so the transcode finishes and the connection goes back to the pool
+            for chunk in r.iter_content(65536):
+                if self._stopped:
+                    break
+            r.close()
+        except Exception as e:
+            # allow retrying later
+            with self._cond:
+                self._seen.pop(url, None)
+            util.DEBUG_LOG('Image prefetch failed for {0}: {1}', pnUtil.cleanToken(url), e)
+
+    def clear(self):
+        with self._cond:
+            self._queue.clear()
+            self._seen.clear()
+
+    def shutdown(self):
+        self._stopped = True
+        with self._cond:
+            self._queue.clear()
+            self._cond.notify_all()
+        if self._session:
+            self._session.close()
+
+
+ipm = ImagePrefetchManager()
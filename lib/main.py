@@ -31,6 +31,7 @@ from . import backgroundthread
 from . import util
 from .logging import KodiLogProxyHandler
 from .data_cache import dcm
+from .image_prefetch import ipm
 
 BACKGROUND = None
 quitKodi = False
@@ -300,7 +301,9 @@ def _main():
             util.DEBUG_LOG('Main: SHUTTING DOWN...')
             dcm.storeDataCache()
             dcm.deinit()
+            ipm.shutdown()
             plexapp.util.INTERFACE.shutdownCache()
+            plexapp.util.INTERFACE.dumpRequestMetrics()
             plexapp.util.INTERFACE.playbackManager.deinit()
             player.shutdown()
             plexapp.util.APP.preShutdown()
@@ -21,11 +21,55 @@ def norm_sep(s):
     return "\\" in s and "\\" or "/"
 
 
+class PrefixIndex(object):
+    """
+    Longest-prefix lookup of the PMS paths of one server's path mappings.
+
+    Prefixes are grouped by length, so a lookup costs one slice and dict probe per distinct prefix length, longest
+    first, instead of a startswith per mapping. The separator normalization of each mapping is precomputed.
+    """
+    def __init__(self, mapping):
+        # {length: {pms_path: (map_path, sep, foreign_sep)}}
+        self.prefixes = {}
+        for map_path, pms_path in mapping.items():
+            if not pms_path:
+                continue
+            sep = norm_sep(map_path)
+            # the first mapping of a PMS path wins
+            self.prefixes.setdefault(len(pms_path), {}).setdefault(pms_path,
+                                                                   (map_path, sep, sep == "/" and "\\" or "/"))
+        self.lengths = sorted(self.prefixes, reverse=True)
+
+    def lookup(self, path):
+        """
+        Returns (pms_path, (map_path, sep, foreign_sep)) of the longest PMS path path starts with, or None
+        """
+        for length in self.lengths:
+            pms_path = path[:length]
+            entry = self.prefixes[length].get(pms_path)
+            if entry:
+                return pms_path, entry
+        return None
+
+    def resolve(self, path):
+        """
+        Returns (url, pms_path, sep) like PathMappingManager.getMappedPathFor with return_rep
+        """
+        match = path and self.lookup(path)
+        if not match or not match[1][0]:
+            return None, None, None
+
+        pms_path, (map_path, sep, foreign_sep) = match
+        # replace match and normalize path separator to separator style of map_path
+        return (map_path + path[len(pms_path):]).replace(foreign_sep, sep), pms_path, sep
+
+
 class PathMappingManager(object):
     mapfile = os.path.join(translatePath(ADDON.getAddonInfo("profile")), "path_mapping.json")
     PATH_MAP = {}
 
     def __init__(self):
+        self._indexes = {}
         self.load()
 
     def load(self):
@@ -42,6 +86,7 @@ class PathMappingManager(object):
 
                 data = PM_COMMA_RE.sub("}}", data)
                 self.PATH_MAP = json.loads(data)
+                self._indexes = {}
                 f.close()
             except:
                 ERROR("Couldn't read path_mapping.json")
@@ -52,29 +97,35 @@ class PathMappingManager(object):
     def mapping(self):
         return self.PATH_MAP and getSetting("path_mapping", True)
 
+    def index(self, server):
+        index = self._indexes.get(server.name)
+        if index is None:
+            index = self._indexes[server.name] = PrefixIndex(self.PATH_MAP.get(server.name, {}))
+        return index
+
     def getMappedPathFor(self, path, server, return_rep=False):
         if self.mapping:
-            match = ("", "")
-
-            for map_path, pms_path in self.PATH_MAP.get(server.name, {}).items():
-                # the longest matching path wins
-                if path.startswith(pms_path) and len(pms_path) > len(match[1]):
-                    match = (map_path, pms_path)
-
-            if all(match):
-                map_path, pms_path = match
+            if return_rep:
+                # fixme: this is dirty.
+                return self.index(server).resolve(path)
 
-                if return_rep:
-                    sep = norm_sep(map_path)
-
-                    # replace match and normalize path separator to separator style of map_path
-                    url = path.replace(pms_path, map_path, 1).replace(sep == "/" and "\\" or "/", sep)
-
-                    # fixme: this is dirty.
-                    return url, pms_path, sep
+            match = path and self.index(server).lookup(path)
+            if match and match[1][0]:
+                pms_path, (map_path, sep, foreign_sep) = match
                 return map_path, pms_path, None
         return None, None, None
 
+    def mapPaths(self, paths, server):
+        """
+        Maps many paths of server in one pass. Returns a list of (url, pms_path, sep) per path, like
+        getMappedPathFor with return_rep; (None, None, None) for unmapped paths.
+        """
+        if not self.mapping:
+            return [(None, None, None)] * len(paths)
+
+        resolve = self.index(server).resolve
+        return [resolve(path) for path in paths]
+
     def deletePathMapping(self, target, server=None, save=True):
         server = server or plexnet.util.SERVERMANAGER.selectedServer
         if not server:
@@ -91,6 +142,7 @@ class PathMappingManager(object):
             if target == t:
                 deleted = s
                 del self.PATH_MAP[server.name][s]
+                self._indexes.pop(server.name, None)
                 break
         if save and deleted and self.save():
             LOG("Path mapping stored after deletion of {}:{}".format(deleted, target))
@@ -115,6 +167,7 @@ class PathMappingManager(object):
             target += sep
 
         self.PATH_MAP[server.name][source] = target
+        self._indexes.pop(server.name, None)
         if save and self.save():
             LOG("Path mapping stored for {}:{}".format(source, target))
 
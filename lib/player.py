@@ -12,6 +12,7 @@ from kodi_six import xbmc
 from kodi_six import xbmcgui
 from iso639 import languages
 from . import backgroundthread
+from . import bif
 from . import kodijsonrpc
 from . import colors
 from .windows import seekdialog, windowutils, blackoutdialog
@@ -1385,6 +1386,7 @@ class SeekPlayerHandler(BasePlayerHandler):
             return
         self.ended = True
         util.DEBUG_LOG('Player: Video session ended')
+        bif.TRICKPLAY.clear()
         self.player.trigger('session.ended', session_id=self.sessionID)
         self.hideOSD(delete=True)
 
@@ -1979,7 +1981,7 @@ class PlexPlayer(xbmc.Player, signalsmixin.SignalsMixin):
             if not playerObject:
                 self.playerObject = plexplayer.PlexPlayer(self.video, offset, forceUpdate=force_update, session_id=self.sessionID)
                 self.playerObject.build()
-            self.playerObject = self.playerObject.getServerDecision()
+            self.playerObject = self.playerObject.getServerDecision(allowCached=True)
         except plexplayer.DecisionFailure as e:
             util.showNotification(e.reason, header=util.T(32448, 'Playback Failed!'))
             raise
@@ -1992,6 +1994,8 @@ class PlexPlayer(xbmc.Player, signalsmixin.SignalsMixin):
 
         bifURL = self.playerObject.getBifUrl()
         util.DEBUG_LOG('Playing URL(+{1}ms): {0}{2}', plexnetUtil.cleanToken(url), offset, bifURL and ' - indexed' or '')
+        if bifURL:
+            bif.TRICKPLAY.load(self.playerObject)
 
         self.ignoreStopEvents = True
         self.stopAndWait()  # Stop before setting up the handler to prevent player events from causing havoc
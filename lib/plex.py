@@ -1,4 +1,5 @@
 from __future__ import absolute_import
+import os
 import sys
 import platform
 import traceback
@@ -11,7 +12,8 @@ import six
 
 from kodi_six import xbmc, xbmcaddon
 
-from plexnet import plexapp, myplex, util as plexnet_util, asyncadapter, http as pnhttp
+from plexnet import plexapp, myplex, util as plexnet_util, asyncadapter, http as pnhttp, metrics, cacheindex, \
+    decisioncache
 
 from .playback_utils import PlaybackManager
 from . windows.settings import PlayedThresholdSetting
@@ -164,7 +166,7 @@ class PlexInterface(plexapp.AppInterface):
         try:
             util.DEBUG_LOG('Main: Clearing requests cache...')
             asyncadapter.Session().cache.clear()
-            plexnet_util.CACHED_PLEX_URLS = {}
+            cacheindex.INDEX.clear()
         except:
             pass
 
@@ -195,13 +197,13 @@ class PlexInterface(plexapp.AppInterface):
                 # this should never happen; might've been old interference with the service and the old style of
                 # initializing the cache load in global space, not via plex.init()
                 pass
-        plexnet_util.CACHED_PLEX_URLS = urls
+        cacheindex.INDEX.load(urls)
         util.HUB_ITEM_STATES = hub_item_states
 
     def shutdownCache(self):
         if util.getSetting('persist_requests_cache'):
             s = asyncadapter.Session()
-            s.cache.other["stored_urls"] = plexnet_util.CACHED_PLEX_URLS
+            s.cache.other["stored_urls"] = cacheindex.INDEX.toDict()
             s.cache.other["item_states"] = util.HUB_ITEM_STATES
             s.cache.other["last_shutdown_successful"] = True
             s.remove_expired_responses()
@@ -210,6 +212,23 @@ class PlexInterface(plexapp.AppInterface):
             self.clearRequestsCache()
             util.LOG('PlexInterface: Cleared requests cache.')
 
+    def dumpRequestMetrics(self):
+        summary = asyncadapter.CONNECTION_STATS.summary()
+        if summary:
+            util.LOG('PlexInterface: Connections: {0}', summary)
+
+        from plexnet import plexserver as pnserver
+        summary = pnserver.QUERY_FLIGHTS.summary()
+        if summary:
+            util.LOG('PlexInterface: Server GETs: {0}', summary)
+
+        if not metrics.ENABLED:
+            return
+
+        metrics.REGISTRY.dump(os.path.join(util.PROFILE, 'request_metrics.json'),
+                              connections=asyncadapter.CONNECTION_STATS.toDict(),
+                              single_flight=pnserver.QUERY_FLIGHTS.toDict())
+
     def getRegistry(self, reg, default=None, sec=None):
         if sec == 'myplex' and reg == 'MyPlexAccount':
             ret = util.getSetting('{0}.{1}'.format(sec, reg), default=default)
@@ -361,6 +380,8 @@ plexapp.util.APP.on('change:manual_ip_0', onManualIPChange)
 plexapp.util.APP.on('change:manual_ip_1', onManualIPChange)
 plexapp.util.APP.on('change:manual_port_0', onManualIPChange)
 plexapp.util.APP.on('change:manual_port_1', onManualIPChange)
+plexapp.util.APP.on('change:setting', decisioncache.CACHE.invalidate)
+plexapp.util.APP.on('change:user', decisioncache.CACHE.invalidate)
 
 plexapp.util.CHECK_LOCAL = util.getSetting('smart_discover_local')
 plexapp.util.LOCAL_OVER_SECURE = util.getSetting('prefer_local')
@@ -387,7 +408,9 @@ plexapp.util.LANGUAGE_CODE = util.LANGUAGE_CODE
 plexapp.setUserAgent(defaultUserAgent())
 plexnet_util.BASE_HEADERS = plexnet_util.getPlexHeaders()
 asyncadapter.MAX_RETRIES = int(util.addonSettings.maxRetries1)
+asyncadapter.POOL_MAXSIZE = util.addonSettings.keepaliveConnections
 asyncadapter.DEBUG_REQUESTS = plexnet_util.DEBUG_REQUESTS = util.addonSettings.debugRequests
+metrics.ENABLED = util.addonSettings.requestMetrics
 asyncadapter.REQUESTS_CACHE_EXPIRY = util.addonSettings.requestsCacheExpiry
 if util.addonSettings.useCertBundle != "system":
     util.LOG("Using certificate bundle: {}".format(util.addonSettings.useCertBundle))
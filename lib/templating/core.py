@@ -1,14 +1,19 @@
 # coding=utf-8
+import io
 import os
 import glob
+import json
 import shutil
+import hashlib
+import threading
 
 from pprint import pformat
-from kodi_six import xbmcvfs, xbmc
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from ibis.context import ContextDict
 from lib.logging import log as LOG, log_error as ERROR
-from .util import deep_update
-from ..util import PROFILE
+from .util import deep_update, TrackingContextDict
+from ..util import PROFILE, THEME_VERSION
 from lib.os_utils import fast_iglob
 from .filters import *
 
@@ -50,7 +55,163 @@ def prepare_template_data(thm, context):
     return ContextDict(template_context)
 
 
+class TemplateLoader(object):
+    """
+    Loads templates from the first of base_dirs that contains them, like ibis' FileLoader. Compiled templates are kept
+    across renders and recompiled only when their source changed.
+
+    Sources are read and hashed once per render pass (see reset), and every template loaded since the last reset,
+    including extended and included ones, is recorded in loaded.
+
+    Templates are compiled to Python code objects (see ibis.codegen), which are cached in cache_dir keyed by the
+    source hash, so later runs skip lexing and parsing. Generating the code takes longer than rendering with the tree
+    walker, so a template without cached code is loaded as a regular tree-walking ibis Template, and its code is
+    generated afterwards by compile_missing. Templates the code generator can't handle stay tree-walking ones.
+    """
+    def __init__(self, *base_dirs, **kwargs):
+        self.base_dirs = base_dirs
+        self.cache_dir = kwargs.get("cache_dir")
+        self.cache = {}
+        self.loaded = set()
+        self._sources = {}
+
+    def reset(self):
+        self._sources = {}
+        self.loaded = set()
+
+    def _read(self, filename):
+        source = self._sources.get(filename)
+        if source:
+            return source
+
+        source = self._sources[filename] = self._locate(filename)
+        return source
+
+    def _locate(self, filename):
+        for base_dir in self.base_dirs:
+            path = os.path.join(base_dir, filename)
+            if os.path.isfile(path):
+                try:
+                    with io.open(path, "rb") as f:
+                        data = f.read()
+                except (IOError, OSError) as err:
+                    msg = "TemplateLoader cannot load the template file '{}'.".format(path)
+                    ibis.errors.raise_(ibis.errors.TemplateLoadError(msg), err)
+
+                # the path is part of the hash, as a custom template overriding a default one changes the output
+                return hashlib.sha1(path.encode("utf-8") + b"\0" + data).hexdigest(), data
+
+        msg = "TemplateLoader cannot locate the template file '{}'.".format(filename)
+        raise ibis.errors.TemplateLoadError(msg)
+
+    def source_hash(self, filename):
+        try:
+            return self._read(filename)[0]
+        except ibis.errors.TemplateLoadError:
+            return None
+
+    def __call__(self, filename):
+        self.loaded.add(filename)
+        digest, data = self._read(filename)
+        cached = self.cache.get(filename)
+        if cached and cached[0] == digest:
+            return cached[1]
+
+        template = self._load_compiled(filename, digest) or ibis.Template(data.decode("utf-8"), filename)
+        self.cache[filename] = (digest, template)
+        return template
+
+    def _cache_path(self, filename, digest):
+        return os.path.join(self.cache_dir, "{}.{}.code".format(filename.replace("/", "_"), digest))
+
+    def _load_compiled(self, filename, digest):
+        if not self.cache_dir:
+            return None
+
+        try:
+            with io.open(self._cache_path(filename, digest), "rb") as f:
+                code = ibis.codegen.loads(f.read())
+            if code:
+                return ibis.codegen.CompiledTemplate(code, filename)
+        except (IOError, OSError):
+            pass
+        except Exception as e:
+            LOG("Ignoring invalid cached template {}: {}", filename, e)
+        return None
+
+    def compile_missing(self, digests):
+        """
+        Generates and caches the code of the templates in digests ({template file name: source hash}) that have none
+        cached yet, and swaps it in for their tree-walking Templates
+        """
+        if not self.cache_dir:
+            return
+
+        for filename, digest in digests.items():
+            if not digest or os.path.exists(self._cache_path(filename, digest)):
+                continue
+
+            try:
+                current, data = self._locate(filename)
+            except ibis.errors.TemplateLoadError:
+                continue
+            # changed since it was rendered; the next render picks it up
+            if current != digest:
+                continue
+
+            try:
+                code = ibis.codegen.compile_template(data.decode("utf-8"), filename)
+            except Exception as e:
+                LOG("Couldn't compile template {} to Python code, using the tree renderer: {}", filename, e)
+                continue
+
+            self._store(filename, digest, code)
+            cached = self.cache.get(filename)
+            if cached and cached[0] == digest:
+                self.cache[filename] = (digest, ibis.codegen.CompiledTemplate(code, filename))
+
+    def _store(self, filename, digest, code):
+        path = self._cache_path(filename, digest)
+        tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.current_thread().ident)
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir, exist_ok=True)
+            # drop the code of older versions of this template
+            prefix = filename.replace("/", "_") + "."
+            for fn in os.listdir(self.cache_dir):
+                if fn.startswith(prefix) and fn.endswith(".code") and fn.count(".") == prefix.count(".") + 1:
+                    os.remove(os.path.join(self.cache_dir, fn))
+
+            with io.open(tmp_path, "wb") as f:
+                f.write(ibis.codegen.dumps(code))
+            os.replace(tmp_path, path)
+        except (IOError, OSError) as e:
+            LOG("Couldn't cache compiled template {}: {}", filename, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+def context_hashes(template_context):
+    return dict((section, hashlib.sha1(pformat(data).encode("utf-8")).hexdigest())
+                for section, data in template_context.items())
+
+
 class TemplateEngine(object):
+    """
+    Renders the script-plex-*.xml.tpl templates into the skin directory.
+
+    A manifest in the target directory records for every rendered template the hashes of all template sources it was
+    built from, of the context sections it read and of its output, so only templates affected by a change are
+    rendered again. Entries also record the THEME_VERSION they were rendered with, as a version bump has to re-render
+    everything after changes outside the templates (filters, render helpers).
+    """
+    MANIFEST = ".render_manifest.json"
+    MAX_WORKERS = 4
+    # seconds a parallel render may take before the templates that aren't done are rendered one by one
+    PARALLEL_TIMEOUT = 60
+
     loader = None
     target_dir = None
     template_dir = None
@@ -59,6 +220,7 @@ class TemplateEngine(object):
     context = None
     debug_log = None
     TEMPLATES = None
+    codegen = None
 
     def init(self, target_dir, template_dir, custom_template_dir):
         self.target_dir = target_dir
@@ -83,6 +245,7 @@ class TemplateEngine(object):
             self.target_dir = writable_base
         self.template_dir = template_dir
         self.custom_template_dir = custom_template_dir
+        self.manifest = None
         self.get_available_templates()
         paths = [custom_template_dir, self.template_dir]
 
@@ -97,84 +260,234 @@ class TemplateEngine(object):
         self.TEMPLATES = tpls
 
     def prepare_loader(self, fns):
-        self.loader = ibis.loaders.FileLoader(*fns)
+        self.loader = TemplateLoader(*fns, cache_dir=os.path.join(PROFILE, "template_cache"))
         ibis.loader = self.loader
 
-    def compile(self, fn, data):
-        template = self.loader(fn)
-        return template.render(data)
-
-    def write(self, template, data, retry=0):
-        def ensure_file_exists(file_name, expected_size):
-            if xbmcvfs.exists(file_name):
-                s = xbmcvfs.Stat(file_name)
-                size = s.st_size()
-                return size == expected_size
-            return False
-
-        leeway = 50
-        expected_len = len(data)
-        # write final file
-        count = 0
-        fn = os.path.join(self.target_dir, "script-plex-{}.xml".format(template))
-        f = xbmcvfs.File(fn, "w")
-
+    @property
+    def manifest_path(self):
+        return os.path.join(self.target_dir, self.MANIFEST)
+
+    def load_manifest(self):
+        if self.manifest is None:
+            self.manifest = {}
+            try:
+                with io.open(self.manifest_path, encoding="utf-8") as f:
+                    self.manifest = json.load(f)
+            except (IOError, OSError):
+                pass
+            except ValueError:
+                LOG("Couldn't parse template manifest, rendering all templates")
+        return self.manifest
+
+    def save_manifest(self):
+        self._write_atomic(self.manifest_path, json.dumps(self.manifest, sort_keys=True).encode("utf-8"))
+
+    def target_path(self, template):
+        return os.path.join(self.target_dir, "script-plex-{}.xml".format(template))
+
+    def output_hash(self, template):
         try:
-            success = f.write(data)
+            with io.open(self.target_path(template), "rb") as f:
+                return hashlib.sha1(f.read()).hexdigest()
+        except (IOError, OSError):
+            return None
 
-            while not success and count < leeway:
-                success = f.write(data)
-                xbmc.sleep(100)
-                count += 1
-        finally:
-            f.close()
-
-        count = 0
-        exists = ensure_file_exists(fn, expected_len)
-        while not exists and count < leeway:
-            xbmc.sleep(100)
-            exists = ensure_file_exists(fn, expected_len)
-            count += 1
-
-        if not exists:
-            if retry > 0:
-                raise OSError("Timed out while waiting for template {} to be saved to disk".format(fn))
-            return self.write(template, data, retry=1)
-        return True
-
-    def apply(self, theme, update_callback, templates=None):
-        templates = self.TEMPLATES if templates is None else templates
+    def prepare(self, theme):
         template_context = prepare_template_data(theme, self.context)
         self.debug_log("Final template context: {}".format(pformat(template_context)))
+        return template_context
 
-        progress = {"at": 0, "steps": len(templates)}
-
-        def step(message):
-            progress["at"] += 1
-            update_callback(progress["at"], progress["steps"], message)
+    def get_jobs(self, theme, templates=None):
+        """
+        Returns (template, template file name) of templates (default: all)
+        """
+        templates = self.TEMPLATES if templates is None else templates
 
         custom_templates = []
         if theme == "custom":
-            progress["steps"] += 1
-            step("custom_templates")
             custom_templates = [f.split("script-plex-")[1].split(".custom.xml.tpl")[0] for f in
                                 glob.iglob(os.path.join(self.custom_template_dir, "*.custom.xml.tpl"))]
             if not custom_templates:
                 LOG("No custom templates found in: {}", self.custom_template_dir)
 
+        return [(template, "script-plex-{}{}.xml.tpl".format(template, ".custom" if template in custom_templates
+                                                             else "")) for template in templates]
+
+    def outdated(self, jobs, template_context):
+        """
+        Filters jobs down to the templates whose sources, used context sections or rendered file changed since they
+        were last rendered
+        """
+        manifest = self.load_manifest()
+        hashes = context_hashes(template_context)
+        self.loader.reset()
+
+        def is_outdated(template, fn):
+            entry = manifest.get(template)
+            if not entry or entry.get("source") != fn or entry.get("version") != THEME_VERSION:
+                return True
+            if any(hashes.get(section) != digest for section, digest in entry["context"].items()):
+                return True
+            if any(self.loader.source_hash(dep) != digest for dep, digest in entry["deps"].items()):
+                return True
+            return self.output_hash(template) != entry["output"]
+
+        return [job for job in jobs if is_outdated(*job)]
+
+    def compile(self, fn, data):
+        template = self.loader(fn)
+        return template.render(data)
+
+    def render(self, fn, template_context):
+        """
+        Renders fn and returns its output, the context sections it read and the hashes of the template files it used
+        """
+        accessed = set()
+        data = ContextDict((section, TrackingContextDict(value, section, accessed) if isinstance(value, dict)
+                            else value) for section, value in template_context.items())
+        self.loader.loaded = set()
+        output = self.compile(fn, data)
+        return output, accessed, dict((dep, self.loader.source_hash(dep)) for dep in self.loader.loaded)
+
+    def _pool(self, workers, template_context):
+        """
+        Returns a pool of workers forked off this process, or None if the platform can't fork or lacks the
+        primitives multiprocessing needs (e.g. sem_open on Android)
+        """
+        try:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                       initializer=_init_worker, initargs=(template_context,))
+        except (ImportError, ValueError, OSError, NotImplementedError) as e:
+            LOG("Can't render templates in parallel, rendering them one by one: {}", e)
+
+    def render_all(self, jobs, template_context, workers=1):
+        """
+        Yields (template, template file name, render result) for all jobs; with more than one worker, templates are
+        rendered in forked processes and yielded as they complete
+        """
+        pool = workers > 1 and len(jobs) > 1 and self._pool(min(workers, len(jobs)), template_context)
+        if not pool:
+            for template, fn in jobs:
+                yield template, fn, self.render(fn, template_context)
+            return
+
+        # biggest first, so a large template started last doesn't hold up the whole render
+        jobs = sorted(jobs, key=lambda job: len(self.loader._read(job[1])[1]), reverse=True)
+        futures = dict((pool.submit(_render_worker, fn), (template, fn)) for template, fn in jobs)
+        yielded = set()
+        try:
+            try:
+                for future in as_completed(futures, timeout=self.PARALLEL_TIMEOUT):
+                    template, fn = futures[future]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        # the error didn't survive pickling; rendering it here raises template errors properly
+                        LOG("Couldn't render {} in parallel, rendering it directly: {}", template, e)
+                        result = self.render(fn, template_context)
+                    yielded.add(future)
+                    yield template, fn, result
+            except (FuturesTimeoutError, BrokenProcessPool) as e:
+                LOG("Parallel template rendering failed, rendering the remaining templates one by one: {}",
+                    e.__class__.__name__)
+                self._stop_pool(pool, futures)
+                for future, (template, fn) in futures.items():
+                    if future not in yielded:
+                        yield template, fn, self.render(fn, template_context)
+        finally:
+            self._stop_pool(pool, futures)
+
+    @staticmethod
+    def _stop_pool(pool, futures):
+        """
+        Shuts pool down without waiting for it; workers still rendering are killed
+        """
+        for future in futures:
+            future.cancel()
+        if not all(future.done() for future in futures):
+            # ProcessPoolExecutor has no public way to stop running work
+            for process in list((getattr(pool, "_processes", None) or {}).values()):
+                try:
+                    process.terminate()
+                except (OSError, AttributeError):
+                    pass
+        pool.shutdown(wait=False)
+
+    @staticmethod
+    def _write_atomic(fn, data):
+        # write next to the target and swap it in, so Kodi never sees a partially written file
+        tmp = fn + ".tmp"
+        with io.open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, fn)
+
+    def write(self, template, data):
+        self._write_atomic(self.target_path(template), data)
+
+    def apply(self, theme, jobs, template_context, update_callback, workers=1):
+        # don't fork render workers off a process that's still generating code for the last render
+        if self.codegen:
+            self.codegen.join()
+
+        manifest = self.load_manifest()
+        hashes = context_hashes(template_context)
+        self.loader.reset()
+        workers = min(workers, self.MAX_WORKERS)
+
         applied = []
-        for template in templates:
-            fn = "script-plex-{}{}.xml.tpl".format(template, ".custom" if theme == "custom" and
-                                                   template in custom_templates else "")
-            compiled_template = self.compile(fn, template_context)
-            if self.write(template, compiled_template):
-                applied.append(template)
-            else:
-                raise Exception("Couldn't write script-plex-{}.xml", template)
-            step(template)
-
-        update_callback(progress["steps"], progress["steps"], "complete")
+        unchanged = []
+        used = {}
+        try:
+            results = self.render_all(jobs, template_context, workers=workers)
+            for at, (template, fn, (output, accessed, deps)) in enumerate(results):
+                data = output.encode("utf-8")
+                digest = hashlib.sha1(data).hexdigest()
+
+                if self.output_hash(template) == digest:
+                    unchanged.append(template)
+                else:
+                    self.write(template, data)
+                    applied.append(template)
+
+                manifest[template] = {
+                    "version": THEME_VERSION,
+                    "source": fn,
+                    "deps": deps,
+                    "context": dict((section, hashes.get(section)) for section in accessed),
+                    "output": digest
+                }
+                used.update(deps)
+                update_callback(at + 1, len(jobs), template)
+        finally:
+            self.save_manifest()
+            self.loader.reset()
+
+        update_callback(len(jobs), len(jobs), "complete")
         LOG('Using theme {} for: {}', theme, applied)
+        if unchanged:
+            LOG('Rendered templates without changes: {}', unchanged)
+
+        # templates rendered by the tree walker get their code generated for the next render
+        self.codegen = threading.Thread(target=self.loader.compile_missing, args=(used,), name="template-codegen")
+        self.codegen.daemon = True
+        self.codegen.start()
+
+
+_worker_context = None
+
+
+def _init_worker(template_context):
+    global _worker_context
+    _worker_context = template_context
+
+
+def _render_worker(fn):
+    return engine.render(fn, _worker_context)
 
 
 engine = TemplateEngine()
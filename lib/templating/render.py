@@ -15,7 +15,6 @@ from lib.windows.busy import ProgressDialog
 
 
 STEP_MAP = {
-    "custom_templates": 33063,
     "default": 33064,
     "complete": 33065
 }
@@ -49,33 +48,44 @@ def render_templates(theme=None, templates=None, force=False):
     engine.debug_log = DEBUG_LOG
 
     def apply():
-        LOG("Rendering templates")
         start = time.time()
 
+        # get template overrides
+        watch_state_type = getSetting('watched_indicators', 'modern_2024')
+        overrides = {
+            "core": {
+                "resolution": DISPLAY_RESOLUTION,
+                "needs_scaling": NEEDS_SCALING
+            },
+            "indicators": {
+                "START": {
+                    "INHERIT": watch_state_type,
+                    "style": watch_state_type,
+                    "hide_aw_bg": getSetting('hide_aw_bg', False),
+                    "use_scaling": getSetting('scale_indicators', True)
+                }
+            },
+        }
+        deep_update(context, overrides)
+
+        template_context = engine.prepare(theme)
+        jobs = engine.get_jobs(theme, templates)
+        if not addonSettings.alwaysCompileTemplates:
+            jobs = engine.outdated(jobs, template_context)
+
+        if not jobs:
+            LOG("Templates are up to date (checked in: {:.2f}s)".format(time.time() - start))
+            return
+
+        LOG("Rendering templates: {}", [template for template, fn in jobs])
+
         with ProgressDialog(T(33062, ''), "", raise_hard=True) as pd:
             def update_progress(at, length, message):
                 pd.update(int(at * 100 / float(length)),
                           message=T(STEP_MAP.get(message, STEP_MAP["default"]), '').format(message))
 
-            # get template overrides
-            watch_state_type = getSetting('watched_indicators', 'modern_2024')
-            overrides = {
-                "core": {
-                    "resolution": DISPLAY_RESOLUTION,
-                    "needs_scaling": NEEDS_SCALING
-                },
-                "indicators": {
-                    "START": {
-                        "INHERIT": watch_state_type,
-                        "style": watch_state_type,
-                        "hide_aw_bg": getSetting('hide_aw_bg', False),
-                        "use_scaling": getSetting('scale_indicators', True)
-                    }
-                },
-            }
-            deep_update(context, overrides)
-
-            engine.apply(theme, update_progress, templates=templates)
+            engine.apply(theme, jobs, template_context, update_progress,
+                         workers=addonSettings.parallelTemplateRendering and os.cpu_count() or 1)
             end = time.time()
             MONITOR.waitForAbort(0.1)
 
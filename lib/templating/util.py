@@ -1,4 +1,5 @@
 # coding=utf-8
+import copy
 import ibis.context
 
 from ibis.context import ContextDict
@@ -29,3 +30,56 @@ def deep_update(source, overrides):
         else:
             source[key] = overrides[key]
     return source
+
+
+class TrackingContextDict(ContextDict):
+    """
+    A top-level section of the template context which adds its name to accessed whenever it's read from, so we know
+    which sections a template depends on.
+    """
+    def __init__(self, data, name, accessed):
+        ContextDict.__init__(self, data)
+        # bypass ContextDict.__setattr__, which would store these as items
+        self.__dict__["_name"] = name
+        self.__dict__["_accessed"] = accessed
+
+    def _touch(self):
+        accessed = self.__dict__.get("_accessed")
+        if accessed is not None:
+            accessed.add(self.__dict__["_name"])
+
+    def __getitem__(self, key):
+        self._touch()
+        return ContextDict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        self._touch()
+        return ContextDict.__contains__(self, key)
+
+    def __iter__(self):
+        self._touch()
+        return ContextDict.__iter__(self)
+
+    def get(self, key, default=None):
+        self._touch()
+        return ContextDict.get(self, key, default)
+
+    def keys(self):
+        self._touch()
+        return ContextDict.keys(self)
+
+    def values(self):
+        self._touch()
+        return ContextDict.values(self)
+
+    def items(self):
+        self._touch()
+        return ContextDict.items(self)
+
+    def __copy__(self):
+        self._touch()
+        return ContextDict(ContextDict.items(self))
+
+    def __deepcopy__(self, memo):
+        self._touch()
+        return copy.deepcopy(ContextDict(ContextDict.items(self)), memo)
@@ -14,6 +14,7 @@ import contextlib
 import subprocess
 import unicodedata
 import pprint
+import shutil
 
 import six.moves.urllib.request, six.moves.urllib.parse, six.moves.urllib.error
 import six
@@ -883,6 +884,7 @@ def cleanupCacheFolder():
             fn = os.path.join(base, f)
             DEBUG_LOG("Removing leftover cached file: {}", fn)
             xbmcvfs.delete(fn)
+        shutil.rmtree(os.path.join(base, "plex_bif"), ignore_errors=True)
     except:
         pass
 
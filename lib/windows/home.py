@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import json
 import threading
+import collections
 import time
 import math
 
@@ -14,6 +15,7 @@ from six.moves import range
 from lib import backgroundthread
 from lib import player
 from lib import util
+from lib.image_prefetch import ipm
 from lib.path_mapping import pmm
 from lib.plex_hosts import pdm
 from lib.util import T
@@ -58,14 +60,28 @@ class HubsList(list):
 
 
 class SectionHubsTask(backgroundthread.Task):
-    def setup(self, section, callback, section_keys=None, ignore_hubs=None, reselect_pos_dict=None):
+    def setup(self, section, callback, section_keys=None, ignore_hubs=None, reselect_pos_dict=None,
+              hub_callback=None, continue_watching=True):
         self.section = section
         self.callback = callback
         self.section_keys = section_keys
         self.ignore_hubs = ignore_hubs
         self.reselect_pos_dict = reselect_pos_dict
+        self.hub_callback = hub_callback
+        self.continue_watching = continue_watching
         return self
 
+    def getHubs(self):
+        return self.section.server.hubs(self.section.key, count=HUB_PAGE_SIZE, section_ids=self.section_keys,
+                                        ignore_hubs=self.ignore_hubs,
+                                        hub_callback=self.hub_callback and self.onHub or None,
+                                        continue_watching=self.continue_watching)
+
+    def onHub(self, hub):
+        if self.isCanceled():
+            return
+        self.hub_callback(self.section, hub, reselect_pos_dict=self.reselect_pos_dict)
+
     def run(self):
         if self.isCanceled():
             return
@@ -75,9 +91,7 @@ class SectionHubsTask(backgroundthread.Task):
             return
 
         try:
-            hubs = HubsList(self.section.server.hubs(self.section.key, count=HUB_PAGE_SIZE,
-                                                                      section_ids=self.section_keys,
-                                                                      ignore_hubs=self.ignore_hubs)).init()
+            hubs = HubsList(self.getHubs()).init()
             if self.isCanceled():
                 return
             self.callback(self.section, hubs, reselect_pos_dict=self.reselect_pos_dict)
@@ -94,11 +108,59 @@ class SectionHubsTask(backgroundthread.Task):
             self.callback(self.section, hubs)
 
 
+class ContinueWatchingHubTask(SectionHubsTask):
+    """
+    Fetches the home section's continueWatching hub alongside the other home hubs instead of before them
+    """
+    def getHubs(self):
+        hub = self.section.server.continueWatchingHub(count=HUB_PAGE_SIZE, section_ids=self.section_keys)
+        if not hub:
+            return []
+
+        if self.hub_callback:
+            self.onHub(hub)
+        return [hub]
+
+
+class SectionHubsCollector(object):
+    """
+    Joins the hubs of a section that are fetched by multiple tasks in parallel and hands them to the callback once
+    all parts have arrived. Only the primary part decides whether the section failed to load.
+    """
+    def __init__(self, parts, callback):
+        self.pending = parts
+        self.callback = callback
+        self.hubs = HubsList().init()
+        self.reselect_pos_dict = None
+        self.lock = threading.Lock()
+
+    def part(self, primary=False):
+        def callback(section, hubs, reselect_pos_dict=None):
+            self.partDone(section, hubs, reselect_pos_dict=reselect_pos_dict, primary=primary)
+        return callback
+
+    def partDone(self, section, hubs, reselect_pos_dict=None, primary=False):
+        with self.lock:
+            if primary:
+                self.hubs.invalid = hubs.invalid
+                self.reselect_pos_dict = reselect_pos_dict
+            self.hubs += hubs
+            self.pending -= 1
+            if self.pending:
+                return
+
+        self.hubs.lastUpdated = time.time()
+        self.callback(section, self.hubs, reselect_pos_dict=self.reselect_pos_dict)
+
+
 class UpdateHubTask(backgroundthread.Task):
     def setup(self, hub, callback, reselect_pos=None):
         self.hub = hub
         self.callback = callback
         self.reselect_pos = reselect_pos
+        # a newer update of the same hub supersedes a queued one
+        self.supersedeKey = ("update", hub.hubIdentifier)
+        self.droppable = True
         return self
 
     def run(self):
@@ -430,6 +492,9 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
         self.lastNonOptionsFocusID = None
         self.sectionHubs = {}
         self.updateHubs = {}
+        self.drawnHubs = {}
+        self._itemCache = collections.OrderedDict()
+        self._hubItemKeys = {}
         self.changingServer = False
         self._shuttingDown = False
         self._checkingForExit = False
@@ -1271,6 +1336,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
 
     def setDirty(self, *args, **kwargs):
         self._reloadOnReinit = True
+        self.clearItemCache()
         self.cacheSpoilerSettings()
 
     def setHostsDirty(self, *args, **kwargs):
@@ -2064,6 +2130,11 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
                 self.backgroundSet = False
 
             util.DEBUG_LOG('Section changed ({0}): {1}', section.key, repr(section.title))
+            # pending hub updates belong to the previous section
+            for task in self.tasks:
+                if isinstance(task, UpdateHubTask):
+                    task.cancel()
+            backgroundthread.BGThreader.purge()
             self.lastSection = section
             self.showHubs(section)
 
@@ -2076,9 +2147,47 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
                             cur_sel_ds.key))
             self.checkSectionItem(force=True)
 
+    def createSectionHubsTasks(self, section, reselect_pos_dict=None):
+        """
+        The home section's continueWatching hub is fetched in parallel to the other home hubs; all hubs of the
+        visible section are drawn as soon as they arrive.
+        """
+        if section.key is None and not section.server.DEFER_HUBS \
+                and util.getSetting('hubs_use_new_continue_watching', False):
+            collector = SectionHubsCollector(2, self.sectionHubsCallback)
+            return [
+                ContinueWatchingHubTask().setup(section, collector.part(), self.wantedSections,
+                                                reselect_pos_dict=reselect_pos_dict,
+                                                hub_callback=self.hubLoadedCallback),
+                SectionHubsTask().setup(section, collector.part(primary=True), self.wantedSections,
+                                        reselect_pos_dict=reselect_pos_dict, ignore_hubs=self.ignoredHubs,
+                                        hub_callback=self.hubLoadedCallback, continue_watching=False)
+            ]
+
+        return [SectionHubsTask().setup(section, self.sectionHubsCallback, self.wantedSections,
+                                        reselect_pos_dict=reselect_pos_dict, ignore_hubs=self.ignoredHubs,
+                                        hub_callback=self.hubLoadedCallback)]
+
+    def hubLoadedCallback(self, section, hub, reselect_pos_dict=None):
+        with self.lock:
+            # only draw hubs early while the visible section has nothing to show yet; refreshes of already visible
+            # hubs are handled as a whole by sectionHubsCallback
+            if self.lastSection != section or self.sectionHubs.get(section.key):
+                return
+
+            is_home = section.key is None
+            identifier = hub.getCleanHubIdentifier(is_home=is_home)
+            if self.showHub(hub, is_home=is_home,
+                            reselect_pos=reselect_pos_dict.get(identifier) if reselect_pos_dict else None):
+                self.drawnHubs.setdefault(section.key, set()).add(identifier)
+                self.setBoolProperty('loading.content', False)
+                if hub.items:
+                    self.setBoolProperty('no.content', False)
+
     def sectionHubsCallback(self, section, hubs, reselect_pos_dict=None):
         with self.lock:
-            update = bool(self.sectionHubs.get(section.key))
+            drawn = self.drawnHubs.pop(section.key, None)
+            update = bool(self.sectionHubs.get(section.key)) or bool(drawn)
             # sort hubs by hubmap index
             hubs.sort(key=lambda hub: self.HUBMAP.get(hub.getCleanHubIdentifier(is_home=section.key is None),
                                                     {"index": 999})["index"])
@@ -2086,7 +2195,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
             self.sectionHubs[section.key] = hubs
             self.setBoolProperty('loading.content', False)
             if self.lastSection == section:
-                self.showHubs(section, update=update, reselect_pos_dict=reselect_pos_dict)
+                self.showHubs(section, update=update, reselect_pos_dict=reselect_pos_dict, drawn=drawn)
 
     def updateHubCallback(self, hub, items=None, reselect_pos=None):
         with self.lock:
@@ -2167,8 +2276,10 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
             self.wantedSections = None
 
         if plexapp.SERVERMANAGER.selectedServer.hasHubs():
-            self.tasks = [SectionHubsTask().setup(s, self.sectionHubsCallback, self.wantedSections, self.ignoredHubs)
-                          for s in [home_section] + sections if not s.server.DEFER_HUBS]
+            self.tasks = []
+            for s in [home_section] + sections:
+                if not s.server.DEFER_HUBS:
+                    self.tasks += self.createSectionHubsTasks(s)
             backgroundthread.BGThreader.addTasks(self.tasks)
 
         show_pm_indicator = util.getSetting('path_mapping_indicators')
@@ -2204,12 +2315,13 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
         else:
             self.setFocusId(self.SECTION_LIST_ID)
 
-    def showHubs(self, section=None, update=False, force=False, reselect_pos_dict=None):
+    def showHubs(self, section=None, update=False, force=False, reselect_pos_dict=None, drawn=None):
         self.setBoolProperty('no.content', False)
         if not update:
             self.setProperty('drawing', '1')
         try:
-            self._showHubs(section=section, update=update, force=force, reselect_pos_dict=reselect_pos_dict)
+            self._showHubs(section=section, update=update, force=force, reselect_pos_dict=reselect_pos_dict,
+                           drawn=drawn)
         finally:
             self.setProperty('drawing', '')
 
@@ -2236,7 +2348,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
         return rp
 
     @busy.busy_property()
-    def _showHubs(self, section=None, update=False, force=False, reselect_pos_dict=None):
+    def _showHubs(self, section=None, update=False, force=False, reselect_pos_dict=None, drawn=None):
         if not update:
             self.clearHubs()
 
@@ -2267,9 +2379,8 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
 
             if not hubs and not section_stale:
                 for task in self.tasks:
-                    if task.section == section:
+                    if getattr(task, 'section', None) == section:
                         backgroundthread.BGThreader.moveToFront(task)
-                        break
 
                 if section.type != "home":
                     self.setBoolProperty('no.content', True)
@@ -2286,11 +2397,9 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
             if not update:
                 if section.key in self.sectionHubs:
                     self.sectionHubs[section.key] = None
-            task = SectionHubsTask().setup(section, self.sectionHubsCallback, self.wantedSections,
-                                           reselect_pos_dict=rpd,
-                                           ignore_hubs=self.ignoredHubs)
-            self.tasks.append(task)
-            backgroundthread.BGThreader.addTask(task)
+            tasks = self.createSectionHubsTasks(section, reselect_pos_dict=rpd)
+            self.tasks += tasks
+            backgroundthread.BGThreader.addTasks(tasks)
             return
 
         util.DEBUG_LOG('Showing hubs - Section: {0} - Update: {1}', section.key, update)
@@ -2307,6 +2416,14 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
 
             skip[self.HUBMAP[identifier]['index']] = 1
 
+            if drawn and identifier in drawn:
+                # already drawn by hubLoadedCallback
+                if hub.items:
+                    hasContent = True
+                if self.HUBMAP[identifier].get('do_updates'):
+                    self.updateHubs[identifier] = hub
+                continue
+
             if self.showHub(hub, is_home=not section.key,
                             reselect_pos=reselect_pos_dict.get(identifier) if reselect_pos_dict else None):
                 if hub.items:
@@ -2489,7 +2606,68 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
     def createListItem(self, obj, wide=False):
         return self.CREATE_LI_MAP.get(obj.type, self.unhandledHub)(self, obj, wide)
 
+    ITEM_CACHE_SIZE = 500
+
+    def hubItemCacheKey(self, obj, layout):
+        """
+        Identifies what a hub item looks like: the item, its watch state, the way the hub shows it and the server
+        connection its artwork URLs point to
+        """
+        if not obj.ratingKey or obj.type not in self.CREATE_LI_MAP:
+            return None
+
+        server = obj.getServer()
+        conn = server and server.activeConnection
+        return (obj.type, obj.ratingKey, obj.get('updatedAt'), obj.get('viewOffset'), obj.get('viewCount'),
+                obj.get('viewedLeafCount'), obj.get('leafCount'), conn and conn.address, conn and conn.token) + layout
+
+    def createHubListItem(self, obj, key, layout):
+        """
+        Creates the list item of obj as shown in a hub with the given layout, reusing the labels, properties and
+        artwork computed for an item with the same key before
+        """
+        cached = key is not None and self._itemCache.get(key)
+        if cached:
+            self._itemCache.move_to_end(key)
+            label, label2, thumb, properties = cached
+            return kodigui.ManagedListItem(label, label2, thumbnailImage=thumb, data_source=obj,
+                                           properties=properties)
+
+        wide, with_progress, with_art, ar16x9, check_spoilers = layout[:5]
+        mli = self.createListItem(obj, wide=wide)
+        if not mli:
+            return None
+
+        if with_progress:
+            mli.setProperty('progress', util.getProgressImage(obj))
+        if with_art:
+            extra_opts = {}
+            thumb = obj.art
+            # use episode thumbnail for in progress episodes
+            if obj.type == 'episode' and util.addonSettings.continueUseThumb and check_spoilers:
+                # blur them if we don't want any spoilers and the episode hasn't been fully watched
+                if self.noResumeImages and obj._noSpoilers:
+                    extra_opts = {"blur": util.addonSettings.episodeNoSpoilerBlur}
+                thumb = obj.thumb
+
+            mli.setThumbnailImage(thumb.asTranscodedImageURL(*self.THUMB_AR16X9_DIM, **extra_opts))
+            mli.setProperty('thumb.fallback', 'script.plex/thumb_fallbacks/movie16x9.png')
+        if ar16x9:
+            mli.setProperty('thumb.fallback', 'script.plex/thumb_fallbacks/movie16x9.png')
+
+        if key is not None:
+            self._itemCache[key] = (mli.label, mli.label2, mli.thumbnailImage, dict(mli.properties))
+            while len(self._itemCache) > self.ITEM_CACHE_SIZE:
+                self._itemCache.popitem(last=False)
+        return mli
+
+    def clearItemCache(self):
+        self._itemCache.clear()
+        self._hubItemKeys = {}
+
     def clearHubs(self):
+        self.drawnHubs = {}
+        self._hubItemKeys = {}
         for control in self.hubControls:
             control.reset()
 
@@ -2522,10 +2700,6 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
                 if control.getSelectedPos() > 0:
                     use_reselect_pos = True
 
-        items = []
-
-        check_spoilers = False
-
         # fetch previously seen item states
         # date, view count, last viewed at
         hub_item_state_key = "_".join([plexapp.util.INTERFACE.getRCBaseKey(), identifier])
@@ -2534,10 +2708,10 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
                                                                                 "season": 0,
                                                                                 "show": 0})
         cks = []
-        urls = []
 
         hub_is_watchlist = hub.is_watchlist
 
+        entries = []
         for obj in hubitems or hub.items:
             if not self.backgroundSet and not use_reselect_pos:
                 if self.updateBackgroundFrom(obj):
@@ -2545,6 +2719,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
 
             wide = with_art
             no_spoilers = False
+            check_spoilers = False
             if obj.type == 'episode' and hub.hubIdentifier == "home.continue" and self.spoilerSetting != "off":
                 check_spoilers = True
                 obj._noSpoilers = no_spoilers = self.hideSpoilers(obj, use_cache=False)
@@ -2558,60 +2733,73 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
                 seen = hub_item_states[obj.type]
                 last_update = max(int(obj.get('addedAt', 0)), int(obj.get('updatedAt', 0)))
                 if seen < last_update:
-                    _cks, _urls = obj.clearCache(return_urls=True)
-                    cks += _cks
-                    urls += _urls
+                    cks += obj.clearCache(return_refs=True)
                     hub_item_states[obj.type] = last_update
 
             if hub_is_watchlist:
                 obj.is_watchlist = True
 
-            mli = self.createListItem(obj, wide=wide)
-            if mli:
-                items.append(mli)
+            layout = (wide, with_progress, with_art, ar16x9, check_spoilers, no_spoilers, hub_is_watchlist)
+            entries.append((obj, self.hubItemCacheKey(obj, layout), layout))
 
         if util.getSetting('cache_requests'):
-            cks = list(set(cks))
-            urls = list(set(urls))
             if cks:
-                obj._clearCache(cks, urls)
+                obj._clearCache(set(cks))
 
             util.HUB_ITEM_STATES[hub_item_state_key] = hub_item_states
 
-        if with_progress:
-            for mli in items:
-                mli.setProperty('progress', util.getProgressImage(mli.dataSource))
-        if with_art:
-            for mli in items:
-                extra_opts = {}
-                thumb = mli.dataSource.art
-                # use episode thumbnail for in progress episodes
-                if mli.dataSource.type == 'episode' and util.addonSettings.continueUseThumb and check_spoilers:
-                    # blur them if we don't want any spoilers and the episode hasn't been fully watched
-                    if self.noResumeImages and mli.dataSource._noSpoilers:
-                        extra_opts = {"blur": util.addonSettings.episodeNoSpoilerBlur}
-                    thumb = mli.dataSource.thumb
-
-                mli.setThumbnailImage(thumb.asTranscodedImageURL(*self.THUMB_AR16X9_DIM, **extra_opts))
-                mli.setProperty('thumb.fallback', 'script.plex/thumb_fallbacks/movie16x9.png')
-        if ar16x9:
-            for mli in items:
-                mli.setProperty('thumb.fallback', 'script.plex/thumb_fallbacks/movie16x9.png')
-
         more = hub.more.asBool()
-        if more:
-            end = kodigui.ManagedListItem('')
-            end.setBoolProperty('is.end', True)
-            items.append(end)
-
-        if hubitems:
-            end = control.size() - 1
-            control.replaceItem(end, items[0])
-            control.addItems(items[1:])
-            if reselect_pos is None:
-                control.selectItem(end)
+        keys = [key for obj, key, layout in entries] + (more and ['end'] or [])
+
+        drawn = self._hubItemKeys.get(index)
+        if not hubitems and drawn and len(drawn[1]) == len(keys) and control.size() == len(keys) and \
+                all(a is b for a, b in zip(drawn[0], control.items)) and \
+                all(obj.type in self.CREATE_LI_MAP for obj, key, layout in entries):
+            # same hub layout as last time: only replace the items that changed
+            replaced = 0
+            for pos, (obj, key, layout) in enumerate(entries):
+                if key is not None and key == drawn[1][pos]:
+                    control.items[pos].dataSource = obj
+                    continue
+
+                mli = self.createHubListItem(obj, key, layout)
+                control.replaceItem(pos, mli)
+                mli.setProperty('index', str(pos))
+                replaced += 1
+
+            items = control.items[:len(entries)]
+            util.DEBUG_LOG('Hub {0}: Replaced {1} of {2} items', identifier, replaced, len(entries))
         else:
-            control.replaceItems(items)
+            items = []
+            for obj, key, layout in entries:
+                mli = self.createHubListItem(obj, key, layout)
+                if mli:
+                    items.append(mli)
+                else:
+                    # unhandled items aren't shown, so the hub's keys don't match its items anymore
+                    keys = None
+
+            if more:
+                end = kodigui.ManagedListItem('')
+                end.setBoolProperty('is.end', True)
+                items.append(end)
+
+            if hubitems:
+                end = control.size() - 1
+                control.replaceItem(end, items[0])
+                control.addItems(items[1:])
+                if reselect_pos is None:
+                    control.selectItem(end)
+                keys = None
+            else:
+                control.replaceItems(items)
+
+        if keys:
+            self._hubItemKeys[index] = (tuple(control.items), keys)
+        else:
+            self._hubItemKeys.pop(index, None)
+
+        ipm.prefetch(mli.thumbnailImage for mli in items)
 
         # hub reselect logic after updating a hub
         if use_reselect_pos:
@@ -2687,6 +2875,9 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
         if not mli or not mli.dataSource:  # May have become invalid
             return
 
+        # the item doesn't match its hub's drawn state anymore
+        self._hubItemKeys = {}
+
         obj = mli.dataSource
         if obj.type in ('episode', 'movie'):
             mli.setProperty('unwatched', not obj.isWatched and '1' or '')
@@ -2731,6 +2922,7 @@ class HomeWindow(kodigui.BaseWindow, util.CronReceiver, CommonMixin, SpoilersMix
             self.onNewServer()
 
     def onSelectedServerChange(self, **kwargs):
+        self.clearItemCache()
         if self.serverRefresh():
             self.setFocusId(self.SECTION_LIST_ID)
             self.changingServer = False
@@ -779,6 +779,7 @@ class ManagedControlList(object):
         self[pos].invalidate()
         self.items[pos] = mli
         li = self.control.getListItem(pos)
+        self._properties.update(mli.properties)
         mli._manager = self
         mli._listItem = li
         mli._updateListItem()
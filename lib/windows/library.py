@@ -2,8 +2,10 @@ from __future__ import absolute_import
 
 import json
 import os
+import math
 import random
 import threading
+import time
 
 import plexnet
 import six
@@ -20,6 +22,7 @@ from six.moves import range
 from lib import backgroundthread
 from lib import player
 from lib import util
+from lib.image_prefetch import ipm
 from lib.util import T
 from . import busy
 from . import dropdown
@@ -254,9 +257,84 @@ class CreateDefaultItemsTask(backgroundthread.Task):
             items.append(mli)
         self.callback(items, self.key, firstMli)
 
+
+class ChunkPrefetcher(object):
+    """
+    Decides which chunks to request around the current position.
+
+    Tracks the scroll velocity (items/s) and how long a chunk request takes, requests the chunks ahead in the
+    direction of travel that would otherwise be reached before they could arrive and merges adjacent chunks into one
+    request when scrolling is faster than the server can deliver single chunks.
+    """
+    # weight of the newest sample in the moving averages
+    SMOOTHING = 0.3
+    # scrolling pauses longer than this reset the velocity
+    IDLE_TIMEOUT = 1.5
+    MAX_AHEAD = 4
+    MAX_MERGE = 3
+
+    def __init__(self, chunkSize):
+        self.chunkSize = chunkSize
+        self.reset()
+
+    def reset(self):
+        self.lastPos = None
+        self.lastTime = None
+        self.velocity = 0.0
+        self.latency = None
+
+    def move(self, pos):
+        now = time.time()
+        if self.lastPos is not None:
+            delta = pos - self.lastPos
+            elapsed = now - self.lastTime
+            if elapsed > self.IDLE_TIMEOUT or abs(delta) > self.chunkSize:
+                # paused or jumped
+                self.velocity = 0.0
+            elif elapsed > 0:
+                self.velocity += self.SMOOTHING * (delta / elapsed - self.velocity)
+        self.lastPos = pos
+        self.lastTime = now
+
+    def addLatency(self, seconds, size):
+        # normalize to our chunk size so merged requests are comparable
+        seconds = seconds * self.chunkSize / max(size, 1)
+        self.latency = seconds if self.latency is None else self.latency + self.SMOOTHING * (seconds - self.latency)
+
+    @property
+    def direction(self):
+        return -1 if self.velocity < 0 else 1
+
+    def lookahead(self):
+        """
+        Number of chunks to fetch in advance in the direction of travel
+        """
+        # items we'll have passed by the time a chunk request returns; assume 1s until we've measured anything
+        travel = abs(self.velocity) * (self.latency if self.latency is not None else 1.0)
+        return min(self.MAX_AHEAD, 1 + int(math.ceil(travel / self.chunkSize)))
+
+    def deadline(self, pos, chunkPos):
+        """
+        Seconds until the chunk at chunkPos is reached from pos at the current velocity, minus the time it takes to
+        fetch it; None if we're not moving towards it
+        """
+        distance = (chunkPos - pos) if self.velocity > 0 else (pos - (chunkPos + self.chunkSize))
+        if not self.velocity or distance < 0:
+            return None
+        return max(0.0, distance / abs(self.velocity) - (self.latency or 0.0))
+
+    def mergeCount(self):
+        """
+        Number of adjacent chunks to fetch in a single request
+        """
+        if self.latency is None:
+            return 1
+        return max(1, min(self.MAX_MERGE, int(abs(self.velocity) * self.latency / self.chunkSize) + 1))
+
+
 class ChunkRequestTask(backgroundthread.Task):
     def setup(self, section, start, size, callback, filter_=None, sort=None, unwatched=False, subDir=False, hdr=False,
-              dovi=False):
+              dovi=False, timing_callback=None, canceled_callback=None):
         self.section = section
         self.start = start
         self.size = size
@@ -267,8 +345,15 @@ class ChunkRequestTask(backgroundthread.Task):
         self.hdr = hdr
         self.dovi = dovi
         self.subDir = subDir
+        self.timing_callback = timing_callback
+        self.canceled_callback = canceled_callback
         return self
 
+    def cancel(self):
+        backgroundthread.Task.cancel(self)
+        if self.canceled_callback and not self.finished:
+            self.canceled_callback(self.start, self.size)
+
     def contains(self, pos):
         return self.start <= pos <= (self.start + self.size)
 
@@ -277,6 +362,7 @@ class ChunkRequestTask(backgroundthread.Task):
             return
 
         try:
+            started = time.time()
             type_ = getQueryItemType(self.section)
 
             if ITEM_TYPE == 'folder':
@@ -288,6 +374,9 @@ class ChunkRequestTask(backgroundthread.Task):
                 items = self.section.all(self.start, self.size, self.filter, self.sort, self.unwatched, type_=type_,
                                          hdr=self.hdr, dovi=self.dovi)
 
+            if self.timing_callback:
+                self.timing_callback(time.time() - started, self.size)
+
             if self.isCanceled():
                 return
             self.callback(items, self.start)
@@ -449,6 +538,7 @@ class LibraryWindow(PlaybackBtnMixin, kodigui.MultiWindow, windowutils.UtilMixin
             self.CHUNK_SIZE = min(300, util.addonSettings.libraryChunkSize)
         else:
             self.CHUNK_SIZE = util.addonSettings.libraryChunkSize
+        self.prefetcher = ChunkPrefetcher(self.CHUNK_SIZE)
 
         key = self.section.key
         if not key.isdigit():
@@ -534,6 +624,7 @@ class LibraryWindow(PlaybackBtnMixin, kodigui.MultiWindow, windowutils.UtilMixin
                 mli = self.showPanelControl.getSelectedItem()
                 if mli:
                     self.requestChunk(mli.pos())
+                    self.prefetchPosters(mli.pos())
 
                 if util.addonSettings.dynamicBackgrounds:
                     if mli and mli.dataSource:
@@ -749,8 +840,8 @@ class LibraryWindow(PlaybackBtnMixin, kodigui.MultiWindow, windowutils.UtilMixin
         chunkOC = getattr(self._current, "CHUNK_OVERCOMMIT", self.CHUNK_OVERCOMMIT)
         self.showPanelControl.selectItem(pos+chunkOC)
         self.showPanelControl.selectItem(pos)
-        self.requestChunk(pos)
-        self.requestChunk(pos+chunkOC)
+        self.requestChunk(pos, prefetch=False)
+        self.requestChunk(pos+chunkOC, prefetch=False)
 
         self.setFocusId(self.POSTERS_PANEL_ID)
         util.setGlobalProperty('key', li.dataSource)
@@ -1403,8 +1494,11 @@ class LibraryWindow(PlaybackBtnMixin, kodigui.MultiWindow, windowutils.UtilMixin
         self.keyItems = {}
         self.firstOfKeyItems = {}
         totalSize = 0
+        # chunk requests of a previous fill are stale
+        self.tasks.cancel()
         self.alreadyFetchedChunkList = set()
         self.finalChunkPosition = 0
+        self.prefetcher.reset()
 
         type_ = getQueryItemType(self.section)
         # supplying this type kills all results (bug: 2025/10/21)
@@ -1511,7 +1605,8 @@ class LibraryWindow(PlaybackBtnMixin, kodigui.MultiWindow, windowutils.UtilMixin
             tasks.append(
                 ChunkRequestTask().setup(
                     self.section, startChunkPosition, self.CHUNK_SIZE, self._chunkCallback, filter_=self.getFilterOpts(),
-                    sort=self.getSortOpts(), unwatched=self.filterUnwatched, subDir=self.subDir, **kw
+                    sort=self.getSortOpts(), unwatched=self.filterUnwatched, subDir=self.subDir,
+                    timing_callback=self.prefetcher.addLatency, **kw
                 )
             )
 
@@ -1808,29 +1903,87 @@ class LibraryWindow(PlaybackBtnMixin, kodigui.MultiWindow, windowutils.UtilMixin
                     pos += 1
 
         self.setBoolProperty('content.filling', False)
+        self.prefetchPosters()
 
-    def requestChunk(self, start):
+    def prefetchPosters(self, pos=None):
+        """
+        Warms the posters of the items ahead of pos (default: the selected item) in the direction of travel
+        """
+        if not self.showPanelControl or not ipm.count:
+            return
+
+        if pos is None:
+            pos = self.showPanelControl.getSelectedPos()
+            if pos is None:
+                return
+
+        step = self.prefetcher.direction
+        end = max(-1, min(self.showPanelControl.size(), pos + step * ipm.count * 2))
+        ipm.prefetch(self.showPanelControl[p].thumbnailImage for p in range(pos, end, step)
+                     if self.showPanelControl[p].dataSource)
+
+    def _chunkCanceled(self, start, size):
+        self.alreadyFetchedChunkList.difference_update(range(start, start + size, self.CHUNK_SIZE))
+
+    def requestChunk(self, start, prefetch=True):
         if util.addonSettings.retrieveAllMediaUpFront:
             return
 
+        if prefetch:
+            self.prefetcher.move(start)
+
         # Calculate the correct starting chunk position for the item they passed in
         startChunkPosition = (start // self.CHUNK_SIZE) * self.CHUNK_SIZE
-        # If we calculated a chunk position that's beyond the end chunk then just return
-        if startChunkPosition > self.finalChunkPosition:
+
+        # the chunk under the cursor first, then the ones ahead in the direction of travel
+        wanted = [startChunkPosition]
+        if prefetch:
+            direction = self.prefetcher.direction
+            wanted += [startChunkPosition + direction * i * self.CHUNK_SIZE
+                       for i in range(1, self.prefetcher.lookahead() + 1)]
+
+        # Skip chunks beyond the end chunk and chunks that have already been requested
+        wanted = [p for p in wanted if 0 <= p <= self.finalChunkPosition and p not in self.alreadyFetchedChunkList]
+        if not wanted:
             return
 
-        # Check if the chunk has already been requested, if not then go fetch the data
-        if startChunkPosition not in self.alreadyFetchedChunkList:
-            util.DEBUG_LOG('Position {0} so requesting chunk {1}', start, startChunkPosition)
-            # Keep track of the chunks we've already fetched by storing the chunk's starting position
-            self.alreadyFetchedChunkList.add(startChunkPosition)
-            task = ChunkRequestTask().setup(self.section, startChunkPosition, self.CHUNK_SIZE,
+        # merge adjacent chunks into one request when scrolling fast
+        merge = self.prefetcher.mergeCount()
+        requests = []
+        for p in sorted(wanted):
+            if requests and p == requests[-1][0] + requests[-1][1] and requests[-1][1] < merge * self.CHUNK_SIZE:
+                requests[-1][1] += self.CHUNK_SIZE
+            else:
+                requests.append([p, self.CHUNK_SIZE])
+
+        # Keep track of the chunks we've already fetched by storing the chunk's starting position
+        self.alreadyFetchedChunkList.update(wanted)
+
+        current = []
+        ahead = []
+        for pos, size in requests:
+            util.DEBUG_LOG('Position {0} so requesting chunk {1} ({2} items)', start, pos, size)
+            task = ChunkRequestTask().setup(self.section, pos, size,
                                             self._chunkCallback, filter_=self.getFilterOpts(), sort=self.getSortOpts(),
                                             unwatched=self.filterUnwatched, subDir=self.subDir, hdr=self.filterHDR,
-                                            dovi=self.filterDOVI)
-
-            self.tasks.add(task)
-            backgroundthread.BGThreader.addTasksToFront([task])
+                                            dovi=self.filterDOVI, timing_callback=self.prefetcher.addLatency)
+            if task.contains(start):
+                # the visible chunk goes before the ones ahead, which may have deadlines of their own
+                current.append(task.setDeadline(0))
+            else:
+                # prefetched chunks may be dropped by the threader when it's overloaded; fetch them again when needed
+                task.droppable = True
+                task.canceled_callback = self._chunkCanceled
+                deadline = self.prefetcher.deadline(start, pos)
+                if deadline is not None:
+                    task.setDeadline(deadline)
+                ahead.append(task)
+
+        self.tasks.add(current + ahead)
+        if current:
+            backgroundthread.BGThreader.addTasksToFront(current)
+        if ahead:
+            backgroundthread.BGThreader.addTasks(ahead)
 
 
 class PostersWindow(kodigui.ControlledWindow, windowutils.UtilMixin):
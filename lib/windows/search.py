@@ -2,9 +2,10 @@ from __future__ import absolute_import
 
 import threading
 import time
+import collections
 
 from kodi_six import xbmcgui, xbmc
-from plexnet import plexapp
+from plexnet import plexapp, plexobjects, http
 
 from lib import util
 from lib.kodijsonrpc import rpc
@@ -13,6 +14,206 @@ from . import opener
 from . import windowutils
 
 
+class FilteredHub(object):
+    """
+    A search hub narrowed down to the items matching a longer query
+    """
+    def __init__(self, hub, items):
+        self._hub = hub
+        self.items = items
+        self.size = plexobjects.PlexValue(str(len(items)))
+
+    def __getattr__(self, attr):
+        return getattr(self._hub, attr)
+
+
+def filterHubs(hubs, query):
+    words = query.lower().split()
+    filtered = []
+    for hub in hubs:
+        items = []
+        for item in hub.items:
+            text = u' '.join(item.get(attr) for attr in ('title', 'tag', 'parentTitle', 'grandparentTitle')).lower()
+            if all(w in text for w in words):
+                items.append(item)
+        if items:
+            filtered.append(FilteredHub(hub, items))
+    return filtered
+
+
+class SearchQuery(object):
+    def __init__(self, key, server, section, query):
+        self.key = key
+        self.server = server
+        self.section = section
+        self.query = query
+        # own session, so the request can be canceled without affecting others
+        self.session = http.Session()
+        self.canceled = False
+
+    def run(self):
+        return self.server.hubs(count=10, search_query=self.query, section=self.section, method=self.session.get)
+
+    def cancel(self):
+        self.canceled = True
+        self.session.cancel()
+
+
+class SearchEngine(object):
+    """
+    Runs the server searches of a SearchDialog: a query is sent once typing paused for DEBOUNCE seconds, superseded
+    queries are canceled, and results are kept in an LRU cache per (user, server, section, query).
+
+    When a query extends a cached one, the cached result is filtered client-side and shown right away while the
+    server query is running.
+    """
+    DEBOUNCE = 0.35
+    CACHE_SIZE = 50
+    CACHE_TTL = 300
+
+    _cache = collections.OrderedDict()
+    _cacheLock = threading.Lock()
+
+    def __init__(self, resultsCallback):
+        # resultsCallback(query, hubs, final)
+        self.resultsCallback = resultsCallback
+        self._cond = threading.Condition()
+        self._pending = None
+        self._pendingAt = 0
+        self._current = None
+        self._generation = 0
+        self._thread = None
+        self._stopped = False
+
+    @classmethod
+    def cacheGet(cls, key):
+        with cls._cacheLock:
+            entry = cls._cache.get(key)
+            if not entry:
+                return None
+            if entry[0] < time.time() - cls.CACHE_TTL:
+                del cls._cache[key]
+                return None
+            cls._cache.move_to_end(key)
+            return entry[1]
+
+    @classmethod
+    def cachePut(cls, key, hubs):
+        with cls._cacheLock:
+            cls._cache[key] = (time.time(), hubs)
+            cls._cache.move_to_end(key)
+            while len(cls._cache) > cls.CACHE_SIZE:
+                cls._cache.popitem(last=False)
+
+    def cachedPrefix(self, key):
+        """
+        Returns the cached result of the longest cached prefix of key's query
+        """
+        base, query = key[:-1], key[-1]
+        for i in range(len(query) - 1, 0, -1):
+            hubs = self.cacheGet(base + (query[:i],))
+            if hubs is not None:
+                return hubs
+        return None
+
+    def search(self, server, section, query):
+        key = (plexapp.ACCOUNT.ID, server.uuid, section, query.lower())
+        with self._cond:
+            self._generation += 1
+            if self._current and self._current.key != key:
+                self._current.cancel()
+                self._current = None
+
+            cached = self.cacheGet(key)
+            if cached is not None:
+                self._pending = None
+            else:
+                self._pending = SearchQuery(key, server, section, query)
+                self._pendingAt = time.time()
+                self._startThread()
+                self._cond.notify()
+
+        if cached is not None:
+            util.DEBUG_LOG('Search: cache hit for {0!r}', query)
+            self.resultsCallback(query, cached, True)
+            return False
+
+        prefixHubs = self.cachedPrefix(key)
+        if prefixHubs is not None:
+            self.resultsCallback(query, filterHubs(prefixHubs, query), False)
+        return True
+
+    def cancel(self):
+        with self._cond:
+            self._generation += 1
+            self._pending = None
+            if self._current:
+                self._current.cancel()
+                self._current = None
+
+    def stop(self):
+        self._stopped = True
+        self.cancel()
+        with self._cond:
+            self._cond.notify()
+
+    def _startThread(self):
+        # called with the lock held; a worker about to exit has already cleared self._thread
+        if not self._thread:
+            self._thread = threading.Thread(target=self._work, name='search.update')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _work(self):
+        try:
+            while not self._stopped and not util.MONITOR.abortRequested():
+                with self._cond:
+                    if not self._pending:
+                        self._cond.wait(5)
+                        if not self._pending:
+                            # deregister while still holding the lock, so the next search starts a new worker
+                            self._thread = None
+                            return
+                        continue
+
+                    remaining = self._pendingAt + self.DEBOUNCE - time.time()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+
+                    sq = self._current = self._pending
+                    generation = self._generation
+                    self._pending = None
+
+                # each query runs on its own thread, so a superseded one that's still winding down doesn't hold up
+                # the next
+                t = threading.Thread(target=self._run, args=(sq, generation), name='search.query')
+                t.daemon = True
+                t.start()
+        finally:
+            with self._cond:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _run(self, sq, generation):
+        try:
+            hubs = sq.run()
+        except Exception:
+            util.ERROR()
+            hubs = None
+
+        with self._cond:
+            if self._current is sq:
+                self._current = None
+            if sq.canceled or hubs is None:
+                return
+            self.cachePut(sq.key, hubs)
+            superseded = generation != self._generation
+
+        if not superseded:
+            self.resultsCallback(sq.query, hubs, True)
+
+
 class SearchDialog(kodigui.BaseDialog, windowutils.UtilMixin):
     xmlFile = 'script-plex-search.xml'
     path = util.ADDON.getAddonInfo('path')
@@ -112,8 +313,7 @@ class SearchDialog(kodigui.BaseDialog, windowutils.UtilMixin):
         windowutils.UtilMixin.__init__(self)
         self.parentWindow = kwargs.get('parent_window')
         self.sectionID = kwargs.get('section_id')
-        self.resultsThread = None
-        self.updateResultsTimeout = 0
+        self.engine = SearchEngine(self.onSearchResults)
         self.isActive = True
         self.useKodiKbd = util.getSetting('search_use_kodi_kbd')
 
@@ -244,26 +444,23 @@ class SearchDialog(kodigui.BaseDialog, windowutils.UtilMixin):
         self.updateResults()
 
     def updateResults(self):
-        self.updateResultsTimeout = time.time() + 1
-        if not self.resultsThread or not self.resultsThread.is_alive():
-            self.resultsThread = threading.Thread(target=self._updateResults, name='search.update')
-            self.resultsThread.start()
-
-    def _updateResults(self):
-        while time.time() < self.updateResultsTimeout and not util.MONITOR.waitForAbort(0.1):
-            pass
-
-        self._reallyUpdateResults()
-
-    def _reallyUpdateResults(self):
         query = self.edit.getText()
         if query:
-            with self.propertyContext('searching'):
-                hubs = plexapp.SERVERMANAGER.selectedServer.hubs(count=10, search_query=query, section=self.sectionID)
-                self.showHubs(hubs)
+            if self.engine.search(plexapp.SERVERMANAGER.selectedServer, self.sectionID, query):
+                self.setProperty('searching', '1')
         else:
+            self.engine.cancel()
+            self.setProperty('searching', '')
             self.clearHubs()
 
+    def onSearchResults(self, query, hubs, final):
+        if query != self.edit.getText():
+            return
+
+        if final:
+            self.setProperty('searching', '')
+        self.showHubs(hubs)
+
     def sectionClicked(self, controlID):
         section = self.SECTION_BUTTONS[controlID]
         old = self.getProperty('search.section')
@@ -420,6 +617,7 @@ class SearchDialog(kodigui.BaseDialog, windowutils.UtilMixin):
     def wait(self):
         while self.isActive and not util.MONITOR.waitForAbort(0.1):
             pass
+        self.engine.stop()
 
 
 def dialog(parent_window, section_id=None):
@@ -16,6 +16,7 @@ from six.moves import range
 
 import lib.cache
 from lib import util
+from lib import bif
 from lib.kodijsonrpc import builtin
 from lib.util import T
 from . import busy
@@ -2013,11 +2014,14 @@ class SeekDialog(kodigui.BaseDialog, windowutils.GoHomeMixin, PlexSubtitleDownlo
 
         if not no_osd or (no_osd and not self.no_time_no_osd_spoilers):
             if self.hasBif:
-                bifUrl = self.handler.player.playerObject.getBifUrl(offset)
+                playerObject = self.handler.player.playerObject
                 if "blur_chapters" in self.no_spoilers:
-                    bifUrl = self.player.video.server.getImageTranscodeURL(bifUrl,
+                    bifUrl = self.player.video.server.getImageTranscodeURL(playerObject.getBifUrl(offset),
                                                                            *PlaylistDialog.LI_AR16X9_THUMB_DIM,
                                                                            **{"blur": util.addonSettings.episodeNoSpoilerBlur})
+                else:
+                    # prefer the frame from the downloaded index
+                    bifUrl = bif.TRICKPLAY.getFrame(playerObject, offset) or playerObject.getBifUrl(offset)
                 self.setProperty('bif.image', bifUrl)
                 self.bifImageControl.setPosition(bifx, 752)
 
@@ -8,6 +8,7 @@ import datetime
 import types
 
 import plexnet
+from plexnet import metrics, asyncadapter
 from kodi_six import xbmc
 from kodi_six import xbmcgui
 from kodi_six import xbmcaddon
@@ -81,6 +82,7 @@ class Setting(object):
             if old != val:
                 util.DEBUG_LOG('Setting: {0} - changed from [{1}] to [{2}]', self.ID, old, val)
                 self.emit_events(self.ID, val)
+                plexnet.util.APP.trigger('change:setting', id=self.ID, value=val)
                 if self.isThemeRelevant:
                     self.emit_tr_events(self.ID, val)
         else:
@@ -196,6 +198,7 @@ class UserAwareSetting(BasicSetting):
             if old != val:
                 util.DEBUG_LOG('Setting: {0} - changed from [{1}] to [{2}]', self.userAwareID, old, val)
                 self.emit_events(self.userAwareID, val)
+                plexnet.util.APP.trigger('change:setting', id=self.ID, value=val)
                 if self.isThemeRelevant:
                     self.emit_tr_events(self.userAwareID, val)
         return util.setSetting(self.userAwareID, val)
@@ -345,8 +348,8 @@ class ReadFactorSetting(KCMSetting):
 class InfoSetting(BasicSetting):
     type = 'INFO'
 
-    def __init__(self, ID, label, info):
-        BasicSetting.__init__(self, ID, label, None)
+    def __init__(self, ID, label, info, show_cb=None):
+        BasicSetting.__init__(self, ID, label, None, show_cb=show_cb)
         self.info = info
 
     def valueLabel(self):
@@ -1080,6 +1083,11 @@ class Settings(object):
                                 util.getGlobalProperty("service.version"))),
                 InfoSetting('i_last_update_check', T(33690, "Last update check"),
                             lambda: util.getGlobalProperty('last_update_check', datetime.datetime.fromtimestamp(0).strftime('%Y-%m-%dT%H:%M:%S.%f'))),
+                InfoSetting('i_request_metrics', T(34064, 'Request metrics'),
+                            lambda: metrics.REGISTRY.summary() or '-',
+                            show_cb=lambda: metrics.ENABLED).description(T(34063, '')),
+                InfoSetting('i_connection_reuse', T(34069, 'Connection reuse'),
+                            lambda: asyncadapter.CONNECTION_STATS.summary() or '-'),
             )
         ),
     }
@@ -14,6 +14,7 @@ from lib import kodijsonrpc
 from lib import player
 from lib import util
 from lib.util import T
+from plexnet import decisioncache
 from plexnet.serverdecision import DecisionFailure
 from . import busy
 from . import dropdown
@@ -480,6 +481,10 @@ class VideoPlayerWindow(kodigui.ControlledWindow, windowutils.UtilMixin, RolesMi
         util.DEBUG_LOG('PostPlay: Showing video info')
         if self.next:
             self.next.reload(includeChapters=1, includeExtras=1, includeExtrasCount=10)
+            if util.addonSettings.prefetchNextPlayback:
+                # playback has ended, so the server decision for the next item can be fetched as well
+                decisioncache.PREFETCHER.prefetch(self.next, offset=self.next.viewOffset.asInt(),
+                                                  session_id=self.sessionID)
 
         self.relatedPaginator = RelatedPaginator(self.relatedListControl,
                                                  leaf_count=int((self.prev or self.next).relatedCount),